@@ -16,7 +16,18 @@
 #############################################################################
 
 # Import Libraries
-from quick2wire.i2c import I2CMaster, writing_bytes, reading
+import time
+from quick2wire.i2c import perform, writing_bytes, reading, Batch, Transaction
+
+
+# Define exception raised when a conversion never becomes ready
+class ConversionTimeout(IOError):
+    pass
+
+
+# Raw count given when there is no reading (the voltage is -1)
+NO_COUNT = -2**31
+
 
 class MCP3424:
         # Hybrid
@@ -26,7 +37,11 @@ class MCP3424:
         # AdcPi2
         # Address 1 0x68
         # Address 2 0x69
-    def __init__(self, address, resolution=12):
+
+    # Nominal conversion time in seconds for each resolution (240, 60, 15 and 3.75 SPS)
+    CONVERSION_TIME = {12: 1 / 240.0, 14: 1 / 60.0, 16: 1 / 15.0, 18: 1 / 3.75}
+
+    def __init__(self, address, resolution=12, poll_budget=20):
         # Check if user inputed a valid resolution
         if resolution != 12 and resolution != 14 and resolution != 16 and resolution != 18:
             raise ValueError('Incorrect ADC Resolution')
@@ -46,19 +61,38 @@ class MCP3424:
         # Set the calibration multiplier
         self.__varDivisor = 0b1 << (resolution - 12)
         self.__varMultiplier = (2.495 / self.__varDivisor) / 1000
+        self.__count = NO_COUNT
 
-        if self.__changechannel(self.__config[0])<0:
+        # Wake up just before the conversion should be done, then poll a
+        # limited number of times before giving up
+        self.__conversion_time = self.CONVERSION_TIME[resolution]
+        self.__poll_interval = self.__conversion_time / 20
+        self.__poll_budget = poll_budget
+        self.__deadline = 0.0
+        self.__first = None
+
+        # The read used to poll and the write that starts each channel,
+        # compiled once. The configuration byte is updated in place
+        self.__read = Transaction(reading(address, self.__bytes()))
+        self.__writes = [Transaction(writing_bytes(config[0], config[1])) for config in self.__config]
+
+        # Bus usage counters
+        self.__polls = 0
+        self.__polls_total = 0
+        self.__reads = 0
+        self.__timeouts = 0
+
+        if self.__changechannel(0)<0:
             print("Err: No ADC detected at " + format(address, '02x'))
 
 
     # Method to change the channel we wish to read from
-    @staticmethod
-    def __changechannel(config):
+    def __changechannel(self, channel):
+        write = self.__writes[channel]
+        write.buffers[0][0] = self.__config[channel][1]
         try:
             # Using the I2C databus...
-            with I2CMaster(1) as master:
-                master.transaction(
-                    writing_bytes(config[0], config[1]))
+            perform(write, 1)
             return 1
                     
         # If I2C error return
@@ -66,58 +100,275 @@ class MCP3424:
             return -1
 
     # Method to read adc
-    @staticmethod
-    def __getadcreading(config, multiplier, res):
+    def __getadcreading(self, config):
+        self.__polls = 0
+        self.__reads += 1
+        self.__count = NO_COUNT
         try:
-            # Using the I2C databus...
-            with I2CMaster(1) as master:
-                # Calculate how many bytes we will receive for this resolution
-                numBytes = int(max(0, res / 2 - 8) + 3)
-    
-                # Initialise the ADC
-                adcreading = master.transaction(
-                    writing_bytes(config[0], config[1]),
-                    reading(config[0], numBytes))[0]
-    
-                # Wait for valid data **blocking**
-                while (adcreading[-1] & 128):
-                    adcreading = master.transaction(
-                        writing_bytes(config[0], config[1]),
-                        reading(config[0], numBytes))[0]
-                
-#                adcreading = [0, 0, 127]
+            # Calculate how many bytes we will receive for this resolution
+            numBytes = self.__bytes()
+
+            # Already read in a batch with other chips (see Sweep)
+            if self.__first is not None:
+                adcreading, self.__first = self.__first, None
+                self.__polls += 1
+                self.__polls_total += 1
                 
-                # Shift bits to product result
-                if numBytes is 4:
-                    t = ((adcreading[0] & 0b00000001) << 16) | (adcreading[1] << 8) | adcreading[2]
-                else:
-                    t = (adcreading[0] << 8) | adcreading[1]
-    
-                # Check if positive or negative number and invert if needed
-                if adcreading[0] > 128:
-                    t = ~(0x020000 - t)
-    
-                # Return result
-                return t * multiplier
+            else:
+                # Sleep until the conversion is nearly done rather than using
+                # the I2C databus to ask. Don't hold the bus while asleep
+                wait = self.__deadline - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+
+                # Read the conversion started by __changechannel. Only read
+                # so that polling doesn't restart a conversion in progress
+                adcreading = self.__poll(config[0], numBytes)
+
+            # Wait for valid data, giving up when the budget is spent
+            while (adcreading[-1] & 128):
+                if self.__polls >= self.__poll_budget:
+                    self.__timeouts += 1
+                    raise ConversionTimeout("ADC at " + format(config[0], '02x') + " not ready")
+                time.sleep(self.__poll_interval)
+                adcreading = self.__poll(config[0], numBytes)
+            
+#            adcreading = [0, 0, 127]
+            
+            # Shift bits to product result
+            if numBytes is 4:
+                t = ((adcreading[0] & 0b00000001) << 16) | (adcreading[1] << 8) | adcreading[2]
+            else:
+                t = (adcreading[0] << 8) | adcreading[1]
+
+            # Check if positive or negative number and invert if needed
+            if adcreading[0] > 128:
+                t = ~(0x020000 - t)
+
+            # Keep the raw count then return the voltage
+            self.__count = t
+            return t * self.__varMultiplier
                 
-        # If I2C error return error code -1
+        # If I2C error or timeout return error code -1
         except IOError:
             return -1
 
-    # External getter - call this to receive data
-    def get(self, channel, gain=1):
+    # Method to find how many bytes a reading is at this resolution
+    def __bytes(self):
+        return int(max(0, self.__res / 2 - 8) + 3)
+
+    # Method to ask the ADC for its data once. The data is a view of the
+    # read's buffer, good until the next poll
+    def __poll(self, address, numBytes):
+        self.__polls += 1
+        self.__polls_total += 1
+        
+        # Using the I2C databus...
+        return perform(self.__read, 1)[0]
+
+    # Method to start a conversion on a channel without waiting for it
+    def start(self, channel, gain=1):
         config = self.__config[channel]
 
         if gain is 8:
             config[1]  = config[1] | 0b11
 
         # Change adc setting to the channel we want to read
-        self.__changechannel(config)
+        result = self.__changechannel(channel)
+        
+        # Work out when the conversion will be ready
+        if result >= 0:
+            self.__deadline = time.monotonic() + self.__conversion_time * 0.95
         
+        return result
+
+    # Method to collect the result of the conversion started on a channel
+    def collect(self, channel):
         # Read and return the data
-        return self.__getadcreading(config, self.__varMultiplier, self.__res)
+        return self.__getadcreading(self.__config[channel])
+
+    # Method to get the messages that start a conversion, to be sent in a
+    # batch with other chips' messages (see quick2wire.i2c.Batch)
+    def start_messages(self, channel, gain=1):
+        config = self.__config[channel]
+        return [writing_bytes(config[0], config[1] | (0b11 if gain == 8 else 0))]
+
+    # Method called once the batch starting a conversion has been sent
+    def started(self, results):
+        if results is not None:
+            self.__deadline = time.monotonic() + self.__conversion_time * 0.95
+
+    # Method to get the messages that read a conversion in a batch
+    def collect_messages(self, channel):
+        return [reading(self.__config[channel][0], self.__bytes())]
+
+    # Method called with the data read by a batch, which the next collect
+    # uses rather than asking the chip again
+    def collected(self, results):
+        self.__first = results[0] if results is not None else None
+
+    # External getter - call this to receive data
+    def get(self, channel, gain=1):
+        # Start the conversion then wait for the data
+        self.start(channel, gain)
+        return self.collect(channel)
+
+    # Property - What was the raw count of the last reading?
+    @property
+    def count(self):
+        return self.__count
+
+    # Property - How many volts is one count?
+    @property
+    def lsb(self):
+        return self.__varMultiplier
+
+    # Property - When should the conversion be done?
+    @property
+    def deadline(self):
+        return self.__deadline
+
+    # Property - How many times was the bus polled for the last reading?
+    @property
+    def polls(self):
+        return self.__polls
+
+    # Property - How many times has the bus been polled altogether?
+    @property
+    def polls_total(self):
+        return self.__polls_total
+
+    # Property - How many readings have been taken?
+    @property
+    def reads(self):
+        return self.__reads
+
+    # Property - How many readings were never ready?
+    @property
+    def timeouts(self):
+        return self.__timeouts
+        
+        
+
+# Define class
+class Sweep:
+    # Reads a list of channels spread across several MCP3424 chips.
+    # Each chip has one converter, so the channels are split into
+    # rounds with at most one channel per chip. A round starts a
+    # conversion on every chip then collects them in turn, so the
+    # chips convert in parallel rather than one after another. Every
+    # chip in a round is started in one ioctl and read in another.
+    def __init__(self, *requests):
+        self.__rounds = []
+        conversions = []
         
+        # Each request is (adc, channel) or (adc, channel, gain)
+        for request in requests:
+            adc, channel = request[0], request[1]
+            gain = request[2] if len(request) > 2 else 1
+            conversion = (adc, channel, gain)
+            conversions.append(conversion)
+            
+            # Duplicate requests share one conversion
+            if any(conversion in r for r in self.__rounds):
+                continue
+            
+            # Find the first round this chip isn't already converting in
+            for r in self.__rounds:
+                if adc not in [c[0] for c in r]:
+                    r.append(conversion)
+                    break
+                    
+            # Otherwise start a new round
+            else:
+                self.__rounds.append([conversion])
+        
+        # Map each request to its conversion in the order they are read
+        flat = [c for r in self.__rounds for c in r]
+        self.__index = [flat.index(c) for c in conversions]
+        
+        # Preallocate the results
+        self.__readings = [-1] * len(flat)
+        self.__results = [-1] * len(conversions)
+        self.__raw = [NO_COUNT] * len(flat)
+        self.__counts = [NO_COUNT] * len(conversions)
+        self.__lsb = [c[0].lsb for c in conversions]
+        
+        # The batches that start and read each round, built once
+        self.__batches = []
+        for conversions in self.__rounds:
+            start, collect = Batch(1), Batch(1)
+            for adc, channel, gain in conversions:
+                start.add(adc.start_messages(channel, gain), adc.started)
+                collect.add(adc.collect_messages(channel), adc.collected)
+            self.__batches.append((start, collect))
+
+    # Method to send other messages with the first round's start, the
+    # callback is given what they read (see quick2wire.i2c.Batch)
+    def attach(self, messages, callback):
+        if self.__batches:
+            self.__batches[0][0].add(messages, callback)
+
+    # Method to read every requested channel
+    def run(self):
+        slot = 0
+        for conversions, (start, collect) in zip(self.__rounds, self.__batches):
+            # Start a conversion on every chip in this round. If the
+            # request expired in the bus queue nothing was started, so
+            # there is nothing to read
+            try:
+                perform(start, 1)
+            except IOError:
+                for x in range(len(conversions)):
+                    self.__readings[slot] = -1
+                    self.__raw[slot] = NO_COUNT
+                    slot += 1
+                continue
+            
+            # Sleep until they should all be done then read them all
+            wait = max(c[0].deadline for c in conversions) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                
+            # If this expires each chip is polled by collect instead
+            try:
+                perform(collect, 1)
+            except IOError:
+                pass
+                
+            # Then collect them, polling any that weren't ready
+            for adc, channel, gain in conversions:
+                self.__readings[slot] = adc.collect(channel)
+                self.__raw[slot] = adc.count
+                slot += 1
+        
+        # Put the readings back in the order they were requested
+        for x in range(len(self.__index)):
+            self.__results[x] = self.__readings[self.__index[x]]
+            self.__counts[x] = self.__raw[self.__index[x]]
         
+        return self.__results
+
+    # Property - What were the raw counts of the last sweep, in request order?
+    @property
+    def counts(self):
+        return self.__counts
+
+    # Property - How many volts is one count, for each request?
+    @property
+    def lsb(self):
+        return self.__lsb
+
+    # Property - How many ioctls have the sweeps taken, not counting polls?
+    @property
+    def ioctls(self):
+        return sum(start.ioctls + collect.ioctls for start, collect in self.__batches)
+
+    # Property - How many conversion times does a sweep take?
+    @property
+    def rounds(self):
+        return len(self.__rounds)
+
 
 class AdcPi2:
     def __init__(self, res=12):
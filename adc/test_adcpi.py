@@ -0,0 +1,57 @@
+import pytest
+from adc import adcpi
+from sim import bus
+
+
+# A clock that only moves when told to
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sim():
+    simulated = bus.h100_bus()
+    previous = bus.install(simulated)
+    yield simulated
+    bus.remove(simulated, previous)
+
+
+def test_sweep_converts_each_chip_once_a_round(sim):
+    adc1, adc2 = adcpi.MCP3424(0x68), adcpi.MCP3424(0x6C)
+    sim.device(0x68).inputs = [0.1, 0.2, 0.3, 0.0]
+    sim.device(0x6C).inputs = [0.4, 0.0, 0.0, 0.0]
+    
+    # The repeated request shares a conversion
+    sweep = adcpi.Sweep((adc1, 2), (adc2, 0), (adc1, 0), (adc2, 0), (adc1, 1))
+    conversions = sim.device(0x6C).conversions
+    
+    assert sweep.rounds == 3
+    
+    # Results come back in the order asked for
+    assert sweep.run() == pytest.approx([x * 2.495 for x in (0.3, 0.4, 0.1, 0.4, 0.2)], abs=0.01)
+    assert sim.device(0x6C).conversions == conversions + 1
+
+def test_conversion_is_read_once_it_should_be_done(sim):
+    sim.device(0x68).inputs[1] = 0.5
+    adc = adcpi.MCP3424(0x68)
+    
+    # Asleep until the conversion time, so the chip is rarely asked twice
+    assert adc.get(1) == pytest.approx(0.5 * 2.495, abs=0.01)
+    assert adc.polls <= 2 and adc.timeouts == 0
+
+def test_chip_never_ready_gives_up_after_its_poll_budget():
+    # The simulated chips' clock never moves so no conversion finishes
+    simulated = bus.h100_bus(clock=Clock())
+    previous = bus.install(simulated)
+    try:
+        adc = adcpi.MCP3424(0x68, poll_budget=3)
+        
+        assert adc.get(0) == -1
+        assert adc.polls == 3 and adc.timeouts == 1
+        assert adc.count == adcpi.NO_COUNT
+    finally:
+        bus.remove(simulated, previous)
@@ -0,0 +1,157 @@
+##!/usr/bin/env python3
+
+# Asyncio front end for the I2C drivers
+
+# Copyright (C) 2015  Simon Howroyd
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# The drivers block while they talk on the I2C databus. Here their work is
+# handed to a dedicated executor so an asyncio event loop never waits on
+# the bus. The executor has one thread because every device shares the one
+# bus, so transactions are run in the order they were asked for.
+
+# Import libraries
+import asyncio, functools
+from concurrent.futures import ThreadPoolExecutor
+from adc import adcpi
+from temperature import tmp102
+from hybrid import hybrid
+from esc import esc
+from mfc import mfc
+
+# Executor for the I2C databus
+bus_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='i2c')
+
+# Executor for other slow work such as the loadbank, display and files
+io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='io')
+
+
+# Function to run a blocking function on the I2C databus thread
+async def on_bus(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(bus_executor, functools.partial(function, *args))
+
+# Function to run a blocking function that doesn't use the I2C databus
+async def off_bus(function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor, functools.partial(function, *args))
+
+
+# Define class
+class Driver:
+    # Code to run when class is created
+    def __init__(self, driver):
+        self.__driver = driver
+
+    # Anything not wrapped is read straight from the driver (cached values)
+    def __getattr__(self, name):
+        return getattr(self.__driver, name)
+
+    # Method to call a driver method on the I2C databus thread
+    async def call(self, method, *args):
+        return await on_bus(getattr(self.__driver, method), *args)
+
+    # Method to set a driver property on the I2C databus thread
+    async def set(self, name, value):
+        return await on_bus(setattr, self.__driver, name, value)
+
+    # Property - What's the blocking driver?
+    @property
+    def driver(self):
+        return self.__driver
+
+
+# Define class
+class MCP3424(Driver):
+    # Code to run when class is created
+    def __init__(self, address, resolution=12):
+        super().__init__(adcpi.MCP3424(address, resolution))
+
+    # Method to read a channel
+    async def get(self, channel, gain=1):
+        return await self.call('get', channel, gain)
+
+
+# Define class
+class Sweep(Driver):
+    # Code to run when class is created, adcs may be blocking or async
+    def __init__(self, *requests):
+        super().__init__(adcpi.Sweep(*[(_blocking(r[0]),) + tuple(r[1:]) for r in requests]))
+
+    # Method to read every requested channel
+    async def run(self):
+        return list(await self.call('run'))
+
+
+# Define class
+class Tmp102(Driver):
+    # Code to run when class is created
+    def __init__(self):
+        super().__init__(tmp102.Tmp102())
+
+    # Method to read a sensor
+    async def get(self, address):
+        return await self.call('get', address)
+
+
+# Define class
+class Hybrid(Driver):
+    # Code to run when class is created
+    def __init__(self):
+        super().__init__(hybrid.Hybrid())
+
+    # Method to read the hybrid board
+    async def update(self):
+        return await self.call('update')
+
+    # Method to shut the hybrid board down
+    async def shutdown(self):
+        return await self.call('shutdown')
+
+
+# Define class
+class Esc(Driver):
+    # Code to run when class is created
+    def __init__(self, address=0x2c):
+        super().__init__(esc.esc(address))
+
+    # Method to send a new throttle
+    async def set_throttle(self, value):
+        await self.set('throttle', value)
+        return self.driver.throttle
+
+
+# Define class
+class Mfc(Driver):
+    # Code to run when class is created
+    def __init__(self):
+        super().__init__(mfc.mfc())
+
+    # Method to read the flow rate from an adc
+    async def get(self, adc, ch):
+        return await self.call('get', _blocking(adc), ch)
+
+    # Method to read the molar flow rate from an adc
+    async def getMoles(self, adc, ch):
+        return await self.call('getMoles', _blocking(adc), ch)
+
+
+# Function to find the blocking driver behind a front end
+def _blocking(driver):
+    if isinstance(driver, Driver):
+        return driver.driver
+    return driver
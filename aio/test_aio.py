@@ -0,0 +1,88 @@
+import argparse, asyncio, threading, time
+import pytest
+from aio import aio
+from datalog import datalog
+from sim import bus
+from timer import timer
+
+
+@pytest.fixture
+def sim():
+    simulated = bus.h100_bus()
+    previous = bus.install(simulated)
+    yield simulated
+    bus.remove(simulated, previous)
+
+
+# Coroutine counting how often the event loop gets round to it
+async def heartbeat(beats, period=0.002):
+    while True:
+        beats.append(time.monotonic())
+        await asyncio.sleep(period)
+
+
+def test_bus_work_runs_in_turn_on_one_thread(sim):
+    sim.device(0x48).temperature = 25.0
+    threads, active, most = set(), [0], [0]
+    
+    def work():
+        threads.add(threading.get_ident())
+        active[0] += 1
+        most[0] = max(most[0], active[0])
+        time.sleep(0.01)
+        active[0] -= 1
+    
+    async def main():
+        beats = []
+        beat = asyncio.ensure_future(heartbeat(beats))
+        await asyncio.gather(*[aio.on_bus(work) for x in range(5)])
+        temperature = await aio.Tmp102().get(0x48)
+        beat.cancel()
+        return beats, temperature
+    
+    beats, temperature = asyncio.run(main())
+    
+    # One at a time on the bus thread, the loop running all the while
+    assert len(threads) == 1 and threading.get_ident() not in threads
+    assert most[0] == 1
+    assert len(beats) >= 10
+    assert temperature == 25.0
+
+def test_control_and_flush_tasks_share_the_bus_thread(sim, tmpdir, monkeypatch):
+    controller = pytest.importorskip('controller')
+    from h100Controller import H100
+    
+    clock = timer.Clock()
+    monkeypatch.setattr(controller, 'timeStart', time.time(), raising=False)
+    h100 = H100('horizon', clock)
+    my_time = timer.My_Time(clock)
+    log = datalog.Log_Writer(open(str(tmpdir.join('log.tsv')), 'w'))
+    args = argparse.Namespace(format='tsv', verbose=0)
+    
+    # Note which threads the controller runs on
+    threads = set()
+    run = h100.run
+    def tracked():
+        threads.add(threading.current_thread().name)
+        return run()
+    h100.run = tracked
+    
+    async def main():
+        beats = []
+        beat = asyncio.ensure_future(heartbeat(beats))
+        tasks = asyncio.gather(
+            controller._control_task(args, h100, '', '', None, None, my_time, '', log, clock),
+            controller._flush_task(log, 0.05))
+        try:
+            await asyncio.wait_for(tasks, 0.3)
+        except asyncio.TimeoutError:
+            pass
+        beat.cancel()
+        return beats
+    
+    beats = asyncio.run(main())
+    log.close()
+    
+    assert len(threads) == 1 and threads.pop().startswith('i2c')
+    assert sim.transactions > 0 and log.written > 0
+    assert len(beats) >= 20
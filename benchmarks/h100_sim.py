@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+# H100 control tick benchmark on the simulated I2C databus
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Times H100.run() with every device simulated, so the controller can be
+# profiled on any Linux box. The ADCs take their real conversion times
+# and the bus can be slowed to its real clock speed with --speed.
+
+# Import libraries
+import argparse, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from sim import bus
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='Simulated H100 benchmark by Simon Howroyd 2015')
+    
+    # Define aguments
+    parser.add_argument('--ticks', type=int, default=100, help='Number of control ticks to run')
+    parser.add_argument('--purge', type=str, default='horizon', help='Purge controller')
+    parser.add_argument('--speed', type=int, default=100000, help='I2C clock in Hz (0 is instant)')
+    parser.add_argument('--state', type=str, default='on', help='Fuel cell state to run in')
+    parser.add_argument('--worker', type=int, default=0, help='Do the I2C from a worker thread')
+
+    # Return what was argued
+    return parser.parse_args()
+
+# Function to run the controller and time each tick
+def _run(ticks, purge, speed, state, worker=0):
+    from h100Controller import H100
+    from quick2wire import i2c
+
+    simulated = bus.h100_bus(speed=speed)
+    previous = bus.install(simulated)
+    if worker:
+        i2c.start_worker(simulated.n)
+    try:
+        h100 = H100(purge)
+        h100.state = state
+        
+        # Ignore the bus use setting the hardware up
+        simulated.reset()
+        
+        times = []
+        for x in range(ticks):
+            start = time.perf_counter()
+            h100.run()
+            times.append(time.perf_counter() - start)
+    finally:
+        worker = i2c.stop_worker(simulated.n)
+        bus.remove(simulated, previous)
+    
+    return times, simulated, worker
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+    
+    times, simulated, worker = _run(args.ticks, args.purge, args.speed, args.state, args.worker)
+    
+    times.sort()
+    print("Ticks\t\t{0:d}".format(len(times)))
+    print("Mean\t\t{0:.2f} ms".format(1000 * sum(times) / len(times)))
+    print("Median\t\t{0:.2f} ms".format(1000 * times[len(times) // 2]))
+    print("Max\t\t{0:.2f} ms".format(1000 * times[-1]))
+    print("Rate\t\t{0:.1f} Hz".format(len(times) / sum(times)))
+    print("Ioctls/tick\t{0:.1f}".format(simulated.transactions / len(times)))
+    print("Messages/tick\t{0:.1f}".format(simulated.messages / len(times)))
+    print("Bytes/tick\t{0:.1f}".format(simulated.bytes / len(times)))
+    
+    # How long requests waited for the worker, by priority
+    if worker is not None:
+        for priority, stats in sorted(worker.stats().items()):
+            print("Wait p{0:d}\t{1:.3f} ms mean, {2:.3f} ms max, {3:d} expired".format(
+                priority, 1000 * stats['latency_mean'], 1000 * stats['latency_max'], stats['expired']))
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+# I2C syscall benchmark for one H100 control tick
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Counts the open, close and ioctl syscalls made on the I2C bus device
+# while the controller runs, once with a new I2CMaster per transaction
+# (how the drivers used to work) and once with the shared bus master.
+# Run this on the Raspberry Pi with the hybrid board connected.
+
+# Import libraries
+import argparse, os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import quick2wire.i2c as i2c
+from adc import adcpi
+from temperature import tmp102
+from esc import esc
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='I2C syscall benchmark by Simon Howroyd 2015')
+    
+    # Define aguments
+    parser.add_argument('--ticks', type=int, default=100, help='Number of control ticks to run')
+    parser.add_argument('--purge', type=str, default='horizon', help='Purge controller')
+
+    # Return what was argued
+    return parser.parse_args()
+
+# Class to count the syscalls made by the quick2wire i2c module
+class Syscall_Counter:
+    def __init__(self):
+        self.__posix = i2c.posix
+        self.__ioctl = i2c.ioctl
+        self.reset()
+
+    # Make the rest of the posix module visible through the counter
+    def __getattr__(self, name):
+        return getattr(self.__posix, name)
+
+    def open(self, *args):
+        self.calls[0] += 1
+        return self.__posix.open(*args)
+    
+    def close(self, *args):
+        self.calls[1] += 1
+        return self.__posix.close(*args)
+
+    def ioctl(self, *args):
+        self.calls[2] += 1
+        return self.__ioctl(*args)
+
+    # Method to zero the counters
+    def reset(self):
+        self.calls = [0, 0, 0]
+
+    # Method to swap the counting functions into the i2c module
+    def install(self):
+        i2c.posix = self
+        i2c.ioctl = self.ioctl
+
+    # Method to put the real functions back
+    def remove(self):
+        i2c.posix = self.__posix
+        i2c.ioctl = self.__ioctl
+
+# Function to choose how every driver gets its bus master
+def _use_master(factory):
+    i2c.shared_master = factory
+    adcpi.shared_master = factory
+    tmp102.shared_master = factory
+    esc.shared_master = factory
+
+# Function to run the controller and count syscalls per tick
+def _run(ticks, purge):
+    from h100Controller import H100
+
+    counter = Syscall_Counter()
+    counter.install()
+    try:
+        h100 = H100(purge)
+        
+        # Ignore the syscalls made setting the hardware up
+        counter.reset()
+        
+        for x in range(ticks):
+            h100.run()
+    finally:
+        counter.remove()
+    
+    return [calls / ticks for calls in counter.calls]
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+    
+    shared = i2c.shared_master
+    
+    # Before: a new master for each transaction
+    _use_master(i2c.I2CMaster)
+    before = _run(args.ticks, args.purge)
+    
+    # After: one shared master per bus
+    _use_master(shared)
+    after = _run(args.ticks, args.purge)
+    i2c.close_shared_masters()
+    
+    print("Syscalls per tick\topen\tclose\tioctl\ttotal")
+    print("Per transaction\t\t{0:.1f}\t{1:.1f}\t{2:.1f}\t{3:.1f}".format(*(before + [sum(before)])))
+    print("Shared master\t\t{0:.1f}\t{1:.1f}\t{2:.1f}\t{3:.1f}".format(*(after + [sum(after)])))
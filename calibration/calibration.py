@@ -0,0 +1,179 @@
+##!/usr/bin/env python3
+
+# Calibration table for raw ADC channels
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Every calibration constant lives in one file (h100.json by default). It
+# has a version and a table for each board, one row per channel:
+#
+#   name        what the channel measures, eg "V_fc"
+#   input       index of the raw reading to use (default: the row number)
+#   gain        multiplied by the raw reading first (default 1)
+#   offset      then added (default 0)
+#   absolute    then made positive if true (default false)
+#   polynomial  then applied, highest power first (default none)
+#   deadband    then anything smaller than this is zero (default 0)
+#   clamp       then limited to [min, max] (default none)
+#   valid       readings outside [min, max] are faulty... (default none)
+#   fault       ...and read as this (default 0)
+#
+# A null min or max in clamp or valid means no limit on that side.
+#
+# A table is applied to a whole vector of raw readings with a handful of
+# NumPy operations. Raw readings can be one tick or a 2D array of many,
+# so old raw logs can be recalibrated offline with the same table. Given
+# an array to write into, every stage is done in place so a control loop
+# tick allocates nothing.
+
+# Import libraries
+import json, math, os
+import numpy
+
+# Default calibration file
+DEFAULT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'h100.json')
+
+
+# Define class
+class Table:
+    # Code to run when class is created from the rows of one board
+    def __init__(self, rows, version=''):
+        self.__version = version
+        self.__names = [row['name'] for row in rows]
+        self.__input = numpy.array([row.get('input', x) for x, row in enumerate(rows)], int)
+        self.__gain = numpy.array([row.get('gain', 1.0) for row in rows], float)
+        self.__offset = numpy.array([row.get('offset', 0.0) for row in rows], float)
+        self.__absolute = numpy.array([row.get('absolute', False) for row in rows], bool)
+        self.__deadband = numpy.array([row.get('deadband', 0.0) for row in rows], float)
+        self.__clamp = self._limits([row.get('clamp') for row in rows])
+        self.__valid = self._limits([row.get('valid') for row in rows])
+        self.__fault = numpy.array([row.get('fault', 0.0) for row in rows], float)
+        
+        # Polynomials padded with leading zeros to the same degree
+        degree = max([len(row.get('polynomial', [])) for row in rows] + [0])
+        self.__polynomial = numpy.zeros((len(rows), degree))
+        for x, row in enumerate(rows):
+            coefficients = row.get('polynomial', [])
+            if coefficients:
+                self.__polynomial[x, degree - len(coefficients):] = coefficients
+        self.__has_polynomial = numpy.array([bool(row.get('polynomial')) for row in rows], bool)
+        
+        # Skip the stages no channel uses
+        self.__any_absolute = self.__absolute.any()
+        self.__any_deadband = (self.__deadband > 0).any()
+        self.__any_clamp = numpy.isfinite(self.__clamp).any()
+        self.__any_valid = numpy.isfinite(self.__valid).any()
+        self.__work = {}
+        
+    # Method to calibrate raw readings, one row of raw channels per tick.
+    # Out is an array to write the result into, a new one by default
+    def apply(self, raw, out=None):
+        raw = numpy.asarray(raw, float)
+        shape = raw.shape[:-1] + (len(self.__names),)
+        
+        # Work arrays, kept for the next tick when writing into out
+        if out is None:
+            out = numpy.empty(shape)
+            work = self._work(shape)
+        else:
+            work = self.__work.get(shape)
+            if work is None:
+                work = self.__work[shape] = self._work(shape)
+        y, low, high = work
+        
+        numpy.take(raw, self.__input, axis=-1, out=out)
+        numpy.multiply(out, self.__gain, out=out)
+        numpy.add(out, self.__offset, out=out)
+        
+        if self.__any_absolute:
+            numpy.abs(out, out=out, where=self.__absolute)
+            
+        # Polynomial by Horner's method, every channel at once
+        if self.__polynomial.shape[1]:
+            y.fill(0.0)
+            for column in self.__polynomial.T:
+                numpy.multiply(y, out, out=y)
+                numpy.add(y, column, out=y)
+            numpy.copyto(out, y, where=self.__has_polynomial)
+            
+        if self.__any_deadband:
+            numpy.abs(out, out=y)
+            numpy.less(y, self.__deadband, out=low)
+            numpy.copyto(out, 0.0, where=low)
+        if self.__any_clamp:
+            numpy.clip(out, self.__clamp[0], self.__clamp[1], out=out)
+        if self.__any_valid:
+            numpy.less(out, self.__valid[0], out=low)
+            numpy.greater(out, self.__valid[1], out=high)
+            numpy.logical_or(low, high, out=low)
+            numpy.copyto(out, numpy.broadcast_to(self.__fault, shape), where=low)
+            
+        return out
+
+    # Method to make the work arrays for a shape of result
+    @staticmethod
+    def _work(shape):
+        return numpy.empty(shape), numpy.empty(shape, bool), numpy.empty(shape, bool)
+
+    # Method to turn [min, max] pairs into arrays of mins and maxes
+    @staticmethod
+    def _limits(pairs):
+        limits = numpy.empty((2, len(pairs)))
+        for x, pair in enumerate(pairs):
+            low, high = pair or (None, None)
+            limits[0, x] = -math.inf if low is None else low
+            limits[1, x] = math.inf if high is None else high
+        return limits
+
+    # Method to calibrate one raw reading of a named channel
+    def apply_one(self, name, raw):
+        x = self.__names.index(name)
+        row = numpy.zeros(self.__input.max() + 1)
+        row[self.__input[x]] = raw
+        return float(self.apply(row)[x])
+
+    # Method to find where a channel is in the calibrated vector
+    def index(self, name):
+        return self.__names.index(name)
+
+    # Property - What channels are there?
+    @property
+    def names(self):
+        return self.__names
+
+    # Property - What version of the calibration is this?
+    @property
+    def version(self):
+        return self.__version
+
+
+# Function to load a board's table from a calibration file
+def load(board='h100', filename=DEFAULT):
+    with open(filename) as fid:
+        config = json.load(fid)
+    return Table(config[board], config.get('version', ''))
+
+
+# Cache of the tables from the default file
+_defaults = {}
+
+# Function to get a board's table from the default calibration file
+def default(board='h100'):
+    if board not in _defaults:
+        _defaults[board] = load(board)
+    return _defaults[board]
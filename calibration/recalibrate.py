@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+
+# Offline recalibration of raw logs
+
+# Copyright (C) 2015  Simon Howroyd
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# A raw log (controller.py --format raw) keeps the ADC counts of every
+# channel with the calibration version it ran with and the volts per count
+# of each channel. Here a whole raw log is turned into engineering units in
+# one go with any calibration table, so a better calibration found after a
+# test can be applied to it without losing anything.
+#
+# Usage: python3 -m calibration.recalibrate logs/*.raw.bin [--table new.json] [--tsv]
+
+# Import libraries
+import argparse, os
+import numpy
+from adc.adcpi import NO_COUNT
+from calibration import calibration
+from datalog import binary, reader
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='Raw log recalibration by Simon Howroyd 2015')
+
+    # Define aguments
+    parser.add_argument('source', type=str, nargs='+', help='Raw logs to recalibrate')
+    parser.add_argument('--table', type=str, default=calibration.DEFAULT, help='Calibration file')
+    parser.add_argument('--board', type=str, default='', help='Table in the calibration file (default is the board logged)')
+    parser.add_argument('--tsv', action='store_true', help='Also write tab separated values')
+
+    # Return what was argued
+    return parser.parse_args()
+
+# Function to get the raw readings of a raw log in volts, one row per record.
+# A reading that failed is -1 volts as the driver would have given
+def volts(data, fields, lsb):
+    channels = [name for name, kind, unit in fields if unit == 'counts']
+
+    counts = numpy.column_stack([data[name] for name in channels]) if len(data) else \
+             numpy.zeros((0, len(channels)), numpy.int32)
+
+    raw = counts * numpy.asarray(lsb, float)
+    raw[counts == NO_COUNT] = -1
+
+    return raw
+
+# Function to recalibrate a raw log into a binary log in engineering units
+def recalibrate(filename, destination, table):
+    with open(filename, 'rb') as fid:
+        schema = binary.read_schema(fid)[0]
+
+    fields = schema['fields']
+    channels = [name for name, kind, unit in fields if unit == 'counts']
+    if 'lsb' not in schema or not channels:
+        raise ValueError(filename + ' is not a raw log')
+
+    data = reader.read(filename)
+    calibrated = table.apply(volts(data, fields, schema['lsb']))
+
+    # Fields in the same order as the raw log, the counts swapped for the table
+    units = {name: unit for name, kind, unit in binary.controller_fields()}
+    out_fields = []
+    for name, kind, unit in fields:
+        if unit != 'counts':
+            out_fields.append((name, kind, unit))
+        elif name == channels[0]:
+            out_fields += [(channel, '<f4', units.get(channel, '')) for channel in table.names]
+
+    out = numpy.zeros(len(data), numpy.dtype([(name, kind) for name, kind, unit in out_fields]))
+    for name, kind, unit in out_fields:
+        if name in table.names:
+            out[name] = calibrated[:, table.index(name)]
+        else:
+            out[name] = data[name]
+
+    metadata = {'board': schema.get('board', ''),
+                'calibration': table.version,
+                'recalibrated': os.path.basename(filename)}
+
+    with open(destination, 'wb') as fid:
+        fid.write(binary.Binary_Format(out_fields, metadata).header())
+        out.tofile(fid)
+
+    return len(out)
+
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+
+    for source in args.source:
+        board = args.board or reader.metadata(source).get('board', 'h100')
+        table = calibration.load(board, args.table)
+
+        destination = source[:-len('.raw.bin')] if source.endswith('.raw.bin') else os.path.splitext(source)[0]
+        destination += '.cal.bin'
+
+        count = recalibrate(source, destination, table)
+        print(source + ' -> ' + destination + ' (' + str(count) + ' records, calibration '
+              + (table.version or 'unversioned') + ')')
+
+        if args.tsv:
+            reader.to_tsv(destination, os.path.splitext(destination)[0] + '.tsv')
@@ -0,0 +1,68 @@
+import json, numpy, pytest
+from calibration import calibration
+
+
+def table(*rows):
+    return calibration.Table(list(rows), 'test')
+
+def test_stages_are_applied_in_order():
+    calibrated = table({"name": "a", "gain": 2.0, "offset": -1.0, "absolute": True,
+                        "polynomial": [1.0, 0.0, 0.5], "deadband": 1.0, "clamp": [None, 10.0]})
+    
+    # |2x - 1| = 2, then 2^2 + 0.5
+    assert calibrated.apply([1.5])[0] == 4.5
+    # |0.5| then 0.75 is inside the deadband
+    assert calibrated.apply([0.75])[0] == 0.0
+    # Clamped
+    assert calibrated.apply([5.0])[0] == 10.0
+
+def test_faulty_readings_are_replaced():
+    calibrated = table({"name": "a", "valid": [None, 1000.0]},
+                       {"name": "b", "valid": [0.0, None], "fault": -1})
+    
+    assert calibrated.apply([2000.0, -5.0]).tolist() == [0.0, -1.0]
+
+def test_many_ticks_at_once_and_shared_inputs():
+    calibrated = table({"name": "rate", "gain": 0.3}, {"name": "moles", "gain": 0.1, "input": 0})
+    raw = numpy.arange(10.0).reshape(5, 2)
+    
+    result = calibrated.apply(raw)
+    
+    assert result.shape == (5, 2)
+    assert result[:, 0] == pytest.approx(raw[:, 0] * 0.3)
+    assert result[:, 1] == pytest.approx(raw[:, 0] * 0.1)
+
+def test_default_table_matches_the_old_h100_calibration():
+    h100 = calibration.default('h100')
+    raw = [0.5, -0.5, 70.0] + [0.05, -0.05, 7.0] + [12.0, -12.0, 2000.0] * 2 + [2.5]
+    
+    calibrated = h100.apply(raw)
+    
+    assert calibrated[0:3] == pytest.approx([abs(0.5 * 1000 / 60.7), abs(-0.5 * 1000 / 60.7), 0.0])
+    assert calibrated[3:6] == pytest.approx([abs(0.05 * 1000 / 6.89) * 1.075, abs(-0.05 * 1000 / 6.89) * 1.075, 0.0])
+    assert calibrated[6:12] == pytest.approx([12.0, 12.0, 0.0] * 2)
+    assert calibrated[12] == pytest.approx(2.5 / 5.0 * 1.5)
+    assert calibrated[13] == pytest.approx(2.5 / 5.0 * 1.5 * 7.0 / 6280.0)
+    assert h100.version
+
+def test_apply_into_an_array_matches_a_new_one():
+    h100 = calibration.default('h100')
+    raw = numpy.array([0.5, -0.5, 70.0] + [0.05, -0.05, 7.0] + [12.0, -12.0, 2000.0] * 2 + [2.5])
+    out = numpy.zeros(len(h100.names))
+    
+    # Twice, so the second tick reuses the work arrays from the first
+    for tick in range(2):
+        result = h100.apply(raw * (tick + 1), out)
+        
+        assert result is out
+        assert out.tolist() == h100.apply(raw * (tick + 1)).tolist()
+
+def test_load_from_a_file(tmp_path):
+    filename = str(tmp_path / "cal.json")
+    with open(filename, 'w') as fid:
+        json.dump({"version": "v2", "board": [{"name": "x", "gain": 3.0}]}, fid)
+        
+    loaded = calibration.load('board', filename)
+    
+    assert loaded.version == "v2"
+    assert loaded.apply_one('x', 2.0) == 6.0
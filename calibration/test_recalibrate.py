@@ -0,0 +1,41 @@
+import pytest
+from adc.adcpi import NO_COUNT
+from calibration import calibration, recalibrate
+from datalog import binary, reader
+from datalog.datalog import Log_Writer
+
+
+def write_raw(tmp_path, records, lsb):
+    filename = str(tmp_path / "log.raw.bin")
+    fields = binary.raw_fields(["V_fc", "I_fc"])
+    fid, formatter = binary.open_log(filename, fields, {"board": "test", "calibration": "v1", "lsb": lsb})
+    log = Log_Writer(fid, formatter=formatter)
+    for record in records:
+        log.write_record(record)
+    log.close()
+    return filename
+
+def test_raw_log_is_recalibrated_with_a_new_table(tmp_path):
+    records = [[1.0 + x, 1.0, 0.1, 3, 100 * x, NO_COUNT if x == 2 else 10 * x]
+               + [20.0] * 6 + [30.0, 0.5] for x in range(5)]
+    source = write_raw(tmp_path, records, [0.01, 0.001])
+    table = calibration.Table([{"name": "V_fc", "gain": 2.0},
+                               {"name": "I_fc", "gain": 10.0, "valid": [0.0, None], "fault": -1}], "v2")
+    destination = str(tmp_path / "log.cal.bin")
+    
+    assert recalibrate.recalibrate(source, destination, table) == 5
+    
+    data = reader.read(destination)
+    assert data.dtype.names[:6] == ("epoch", "duration", "dt", "state", "V_fc", "I_fc")
+    assert data["V_fc"].tolist() == pytest.approx([2.0 * x for x in range(5)])
+    assert data["I_fc"].tolist() == pytest.approx([0.0, 0.1, -1.0, 0.3, 0.4])
+    assert data["epoch"][4] == 5.0 and data["Pg_t"][0] == 0.5
+    assert reader.units(destination)["V_fc"] == "V"
+    assert reader.metadata(destination)["calibration"] == "v2"
+
+def test_calibrated_log_is_refused(tmp_path):
+    filename = str(tmp_path / "log.bin")
+    binary.open_log(filename, binary.controller_fields())[0].close()
+    
+    with pytest.raises(ValueError):
+        recalibrate.recalibrate(filename, str(tmp_path / "out.bin"), calibration.default('h100'))
@@ -20,18 +20,19 @@
 #############################################################################
 
 # Import libraries
-import argparse, sys, time, select
+import argparse, asyncio, sys, time, select
 from display import h100Display
 from h100Controller import H100
 from switch import switch
-<<<<<<< HEAD
-=======
 from tdiLoadbank import loadbank
 from scheduler import scheduler
 from esc import esc
 from timer import timer
+from aio import aio
+from datalog import datalog, binary
+from sim import bus
+from quick2wire import gpio, i2c
 
->>>>>>> 3b5cd44a29734f67cc8491f2f6f979287aabc672
 
 # Inspect user input arguments
 def _parse_commandline():
@@ -40,102 +41,28 @@ def _parse_commandline():
     
     # Define aguments
     parser.add_argument('--out', type=str, default='', help='Save my data to USB stick')
-<<<<<<< HEAD
-    parser.add_argument('--purgeController', type=int, default=0, help='Set to 1 for purge controller on')
-    parser.add_argument('--purgeTime'  	,type=float, 	default=0.5,	help='How long to purge for in seconds')
-    parser.add_argument('--purgeFreq'  	,type=float, 	default=30,	help='Time between purges in seconds')
-    parser.add_argument('--display'  	,type=int, 	default=1,	help='Piface CAD (1 is on, 0 is off)')
-=======
+    parser.add_argument('--format', type=str, default='tsv', help='Logfile format [tsv, bin, raw]')
+    parser.add_argument('--checkpoint', type=str, default='', help='File to keep the energy totals in across restarts')
     parser.add_argument('--purge', type=str, default='horizon', help='Change purge controller')
     parser.add_argument('--verbose', type=int, default=0, help='Print log to screen')
     parser.add_argument('--profile', type=str, default='', help='Name of flight profile file')
+    parser.add_argument('--interpolate', type=str, default='step', help='Profile interpolation [step, linear, cubic]')
     parser.add_argument('--timer', type=int, default=0, help='Performance monitor timer')
->>>>>>> 3b5cd44a29734f67cc8491f2f6f979287aabc672
+    parser.add_argument('--rate', type=float, default=0, help='Fixed control loop rate in Hz (0 is as fast as possible)')
+    parser.add_argument('--simulate', type=int, default=0, help='Run on a simulated I2C databus, no hardware needed')
+    parser.add_argument('--interrupt', type=int, default=0, help='Read the hybrid board inputs on its INT line rather than every loop')
+    parser.add_argument('--worker', type=int, default=1, help='Do all I2C from one thread, actuator writes ahead of sensor reads')
+    parser.add_argument('--asyncio', type=int, default=0, help='Run the control loop, user input and logging as asyncio tasks')
 
     # Return what was argued
     return parser.parse_args()
 
-<<<<<<< HEAD
-def _display_header(*destination):
-    header = ("\n"
-              + "Fuel Cell Controller \n"
-              + "Horizon H-100 Stack \n"
-              + "(c) Simon Howroyd 2014 \n"
-              + "Loughborough University \n"
-              + "\n"
-              + "This program comes with ABSOLUTELY NO WARRANTY; for details type `show w'. \n"
-              + "This is free software, and you are welcome to redistribute it, \n"
-              + "under certain conditions; type `show c' for details.\n"
-              + str(time.asctime())
-              + "\n\n")
-    for write in destination: _writer(write, header),
-
-    return header
-
-def _print_state(h100, *destination):
-    state = h100.state
-
-    for write in destination: _writer(write, state),
-
-    return state
-
-def _print_electric(h100, *destination):
-    electric = [
-        h100.voltage[0],
-        h100.current[0],
-        h100.power[0],
-    ]
-
-    for write in destination:
-        for cell in electric:
-            _writer(write, cell)
-
-    return electric
-
-def _print_temperature(h100, *destination):
-    temperature = [
-        h100.temperature[0],
-        h100.temperature[1],
-        h100.temperature[2],
-        h100.temperature[3],
-    ]
-
-    for write in destination:
-        for cell in temperature:
-            _writer(write, cell)
-
-    return temperature
-
-
-def _print_purge(h100, *destination):
-    purge = [
-        h100.purgefrequency,
-        h100.purgetime,
-    ]
-
-    for write in destination:
-        for cell in purge:
-            _writer(write, cell)
-
-    return purge
-
-def _print_time(timeStart, *destination):
-    delta = [
-        time.time(),
-        time.time() - timeStart,
-    ]
-
-    for write in destination:
-        for cell in delta:
-            _writer(write, cell)
-
-    return delta
-
-=======
 # Function to write list data
->>>>>>> 3b5cd44a29734f67cc8491f2f6f979287aabc672
 def _writer(function, data):
-    if type(data) is float:
+    # No destination, the caller only wants the data
+    if function is None:
+        return data
+    elif type(data) is float:
         try:
             function("{0:.1f}".format(data) + '\t', end='')
         except (ValueError, TypeError):  # Not a print function
@@ -172,17 +99,18 @@ def _display_header(destination):
 
 # Function to print the time
 def _print_time(my_time, destination, verbose=False):
-    # Get the time data
+    # Get the time data, the epoch is wall clock time for the logfile
+    now = time.time()
     if verbose:
         delta = [
-            "Epoch:",    time.time(),
-            "Duration:", time.time() - timeStart,
+            "Epoch:",    now,
+            "Duration:", now - timeStart,
             "dt:",       my_time.delta,
         ]
     else:
         delta = [
-            time.time(),
-            time.time() - timeStart,
+            now,
+            now - timeStart,
             my_time.delta,
         ]
 
@@ -371,8 +299,18 @@ def _print_current(h100, load, destination, verbose=False):
 
 # Function to print the energy data
 def _print_energy(h100, destination, verbose=False):
-    
-    energy = h100.energy
+    # Get the data from the controller
+    if verbose:
+        energy = ["E_fc:",  h100.energy[0] / 3600.0, "Wh",
+                  "E_b:",   h100.energy[1] / 3600.0, "Wh",
+                  "E_out:", h100.energy[2] / 3600.0, "Wh",
+                  "Q_fc:",  h100.charge[0], "Ah",
+                  "Q_b:",   h100.charge[1], "Ah",
+                  "Q_out:", h100.charge[2], "Ah",
+                  "H2:",    h100.hydrogen * 1000.0, "mmol",
+                  "Eff:",   h100.efficiency * 100.0, "%"]
+    else:
+        energy = h100.energy
 
     # Write the data to destination
     for cell in energy:
@@ -427,6 +365,19 @@ def _print_purge(h100, destination, verbose=False):
     # Return the data
     return purge
     
+# Function to print how long I2C requests waited for the bus worker
+def _print_bus(destination):
+    worker = i2c.worker(1)
+    if worker is None:
+        destination("No I2C worker, each driver uses the bus directly")
+        return
+        
+    names = {i2c.PRIORITY_ACTUATOR: 'Actuators', i2c.PRIORITY_SENSOR: 'Sensors'}
+    for priority, stats in sorted(worker.stats().items()):
+        destination("{}: {} requests, {} expired, wait mean {:.2f}ms max {:.2f}ms, queue max {}".format(
+            names.get(priority, priority), stats['requests'], stats['expired'],
+            stats['latency_mean'] * 1000, stats['latency_max'] * 1000, stats['depth_max']))
+    
 # Function to print the throttle
 def _print_throttle(motor, destination):
     # Get the throttle from the motor controller
@@ -468,59 +419,6 @@ def _reader():
     # If we get here something went wrong so return blank
     return ''
 
-<<<<<<< HEAD
-def _profile(isRunning):
-    if isRunning:
-        # Do running
-        pass
-    else:
-        pass
-    
-    return isRunning
-
-if __name__ == "__main__":
-
-    #########
-    # Setup #
-    #########
-
-    # Grab user args
-    args = _parse_commandline()
-
-    ## Look at user arguments
-    # Logfile
-    if args.out:
-        log = open(("/media/usb0/" + time.strftime("%y%m%d-%H%M%S") + "-controller-" + args.out + ".tsv"), 'w')
-    else:
-        log = open("/dev/null",'w')
-    # Purge Controller
-    if args.purgeController:
-        purge = pid.Pid(10, 1, 1)
-    else:
-        purge = False
-
-    ## Initialise classes
-    # Initialise controller class
-    h100 = H100(purgeControl=purge, purgeFreq=args.purgeFreq, purgeTime=args.purgeTime)
-    # Initialise display class
-    display = h100Display.FuelCellDisplay()
-    display.on = True
-
-        # Record start time
-    timeStart = time.time()
-
-    #
-    _isRunning = 0
-
-    ########
-    # Main #
-    ########
-
-    _display_header(print)
-    display.name = "H100"
-
-    print("Type command: [time, stat, elec, temp, purg, fly] ")
-=======
 # Funtion to moitor performance of individual functions
 def _performance_monitor(is_active, performance_timer, function_name):
     if is_active:
@@ -534,83 +432,323 @@ def _performance_monitor(is_active, performance_timer, function_name):
         performance_timer=time.time()
                 
         return performance_timer   
->>>>>>> 3b5cd44a29734f67cc8491f2f6f979287aabc672
 
-# Shutdown routine        
-def _shutdown(motor, h100, load, log, display):
-    try:
-<<<<<<< HEAD
-        while True:
-            h100.run()
-            _isRunning = _profile(_isRunning)
-
-            # HANDLE USER REQUESTED DATA
-            request = _reader()
-            if request:
-                request = request.split(' ')
-                req_len = len(request)
-                for x in range(req_len): request[x] = request[x].strip()
-
-                if req_len is 1:
-                    if   request[0].startswith("time?"):
-                        _print_time(timeStart, print)
-                    elif request[0].startswith("stat?"):
-                        _print_state(h100, print)
-                    elif request[0].startswith("elec?"):
-                        _print_electric(h100, print)
-                    elif request[0].startswith("temp?"):
-                        _print_temperature(h100, print)
-                    elif request[0].startswith("purg?"):
-                        _print_purge(h100, print)
-                    elif request[0].startswith("fly?"):
-                        if _isRunning: print("Currently flying")
-                        else: print("In the hangar")
-
-                elif req_len is 2:
-                    if   request[0].startswith("stat"):
-                        _new_state = request[1]
-                        print('Changing state to',_new_state,'...',end='')
-                        h100.state = _new_state
-                        if h100.state is _new_state:
-                            print("done!")
-                        else: print("failed")
-                    elif request[0].startswith("fly"):
-                        if int(request[1]) is 0 and _isRunning is 1:
-                            _isRunning = 0
-                            print("...landing")
-                        elif int(request[1]) is 1 and _isRunning is 0:
-                            _isRunning = 1
-                            print("...taking off")
-
-                print()
-
-
-            # LOG TIME
-            _print_time(timeStart, log.write)
-
-            # LOG STATE
-            display.state = _print_state(h100, log.write)
+# Function to send the profile setpoints to their outputs
+def _run_profile(profile, output, load, motor, h100):
+    # Get the programmed setpoint
+    setpoint = profile.run()
+    
+    # Further columns are loadbank current and a purge frequency override
+    setpoints = profile.setpoints
+    
+    # If the output is the digital loadbank...
+    if "loadbank" in output and load:
+        
+        # and the setpoint is not in an error mode...
+        if setpoint >= 0:
+            
+            # Turn the loadbank on
+            load.load = True
+            
+            # Set the type of electrical profile we are running
+            mode = load.mode
+            
+            # Set the setpoint for the electrical profile for now
+            if "VOLTAGE" in mode:
+                load.voltage_constant = str(setpoint)
+            elif "CURRENT" in mode:
+                load.current_constant = str(setpoint)
+            elif "POWER" in mode:
+                load.power_constant = str(setpoint)
+                
+        # Setpoint is in an error mode (eg profile finished) so turn off
+        else:
+            load.load = False
             
-            # LOG ELECTRIC
-            electric = _print_electric(h100, log.write)
-            display.voltage = electric[0]
-            display.current = electric[1]
-            display.power = electric[2]
+    # Otherwise assume a throttle profile, send this to the motor
+    else:
+        motor.throttle = setpoint
+        
+        # If there's a loadbank too, a second column is its current
+        if load and len(setpoints) > 1:
+            if setpoints[1] >= 0:
+                load.load = True
+                load.current_constant = str(setpoints[1])
+            else:
+                load.load = False
 
-            # LOG TEMPERATURE
-            temp = _print_temperature(h100, log.write)
-            display.temperature = max(temp)
+    # A third column overrides the purge controller
+    if len(setpoints) > 2:
+        h100.purge_override = setpoints[2]
 
-            # LOG PURGE
-            _print_purge(h100, log.write)
+    # Return the setpoint
+    return setpoint
 
-            # PRINT NEW LINE
-            if log: log.write("\n")
+# Function to act on a line typed in by the user
+def _handle_request(request, h100, load, motor, profile, my_time, rate='', log=''):
+    # Split the argument from the value
+    request = request.split(' ')
+    
+    # Determine the number of pieces of information
+    req_len = len(request)
+    
+    # Strip away any whitespace
+    for x in range(req_len):
+        request[x] = request[x].strip()
+
+    # If only one piece of information, it is a request for data
+    if req_len is 1:
+        if request[0].startswith("time?"):
+            _print_time(my_time, print, True)
+        elif request[0].startswith("throttle?"):
+            _print_throttle(motor, print)
+        elif request[0].startswith("fc?"):
+            _print_state(h100, print, True)
+        elif request[0].startswith("elec?"):
+            _print_electric(h100, load, print, True)
+        elif request[0].startswith("v?"):
+            _print_voltage(h100, load, print, True)
+        elif request[0].startswith("i?"):
+            _print_current(h100, load, print, True)
+        elif request[0].startswith("energy?"):
+            _print_energy(h100, print, True)
+        elif request[0].startswith("temp?"):
+            _print_temperature(h100, print, True)
+        elif request[0].startswith("purg?"):
+            _print_purge(h100, print, True)
+        elif request[0].startswith("fly?"):
+            if profile and profile.running:
+                print("Currently flying")
+            else:
+                print("In the hangar")
+        elif request[0].startswith("rate?"):
+            if rate:
+                print(rate.report())
+            else:
+                print("Free running")
+        elif request[0].startswith("log?"):
+            if log:
+                print(log.report())
+        elif request[0].startswith("pulse?"):
+            commanded, actual, error, failed = h100.purge_pulse
+            print("Purge pulse: commanded {:.3f}s, actual {:.3f}s, worst error {:.3f}s, {} failed edges".format(commanded, actual, error, failed))
+        elif request[0].startswith("bus?"):
+            _print_bus(print)
+
+    # If there are two pieces of information it is a command to change something
+    elif req_len is 2:
+        if request[0].startswith("fc"):
+            _new_state = request[1]
+            print('Changing state to', _new_state)
+            h100.state = _new_state
+        elif request[0].startswith("fly"):
+            profile.running = request[1]
+        elif request[0].startswith("throttle"):
+            if request[1].startswith("calibration"):
+                motor.calibration()
+            else:
+                motor.throttle = request[1]
 
+    # Print a new line to the screen
+    print()
 
-    # Programme Exit Code
-    finally:
-=======
+# Function to log one timestep of data. A raw log keeps the ADC counts
+# instead of engineering units so it can be recalibrated afterwards
+def _log(log, h100, load, my_time, display, is_timed=False, performance_timer=0, raw=False):
+    # Everything is read from the one snapshot of this tick
+    snapshot = h100.snapshot
+    
+    # Gather the timestep into one record
+    record = _print_time(my_time, None)
+    
+    # Get state
+    state = _print_state(snapshot, None)
+    record.append(state)
+    
+    # Send state to LED display if connected
+    if display:
+        display.state = state
+
+    # Get electrical data
+    electric = _print_electric(snapshot, load, None)
+    record.extend(electric)
+    
+    # Send electrical data to LED display if connected
+    if display:
+        display.voltage = electric[0]
+        display.current = electric[1]
+        display.power = electric[2]
+
+    # Get energy data
+    record.extend(_print_energy(snapshot, None))
+
+    # Get temperature data
+    temp = _print_temperature(snapshot, None)
+    record.extend(temp)
+    
+    # Send temperature data to LED display if connected
+    if display:
+        display.temperature = max(temp)
+
+    # Get purge controller data
+    record.extend(_print_purge(snapshot, None))
+
+    # Swap the calibrated data for the raw counts, keeping the time, state,
+    # temperature and purge timing which aren't calibrated
+    if raw:
+        record = record[:4] + snapshot.counts + temp + record[-2:]
+
+    # Update the performance monitor timer
+    performance_timer = _performance_monitor(is_timed, performance_timer, "log_gather")
+
+    # Hand the record to the background writer, this never waits on the USB stick
+    log.write_record(record)
+
+    # Update the performance monitor timer
+    performance_timer = _performance_monitor(is_timed, performance_timer, "log_queue")
+
+    return performance_timer
+
+# Function to print all the data to the screen
+def _print_all(h100, load, my_time):
+    _print_time(my_time, print)
+    _print_state(h100, print)
+    _print_electric(h100, load, print)
+    _print_energy(h100, print)
+    _print_temperature(h100, print)
+    _print_purge(h100, print)
+    print()
+
+# Function to run the main code loop, one thing after another
+def _run(args, h100, load, profile, output, motor, my_time, display, log, clock, rate=''):
+    # Start a timer
+    performance_timer = time.time()
+    
+    while True:
+        # Read the clock once for this tick
+        clock.tick()
+        
+        ## Handle the background processes
+        # Run the fuel cell controller
+        h100.run()
+
+        # Update the performance monitor timer
+        performance_timer = _performance_monitor(args.timer, performance_timer, H100.__name__)
+        
+        # Run the timer TODO
+        my_time.run()
+
+        # Update the performance monitor timer
+        performance_timer = _performance_monitor(args.timer, performance_timer, timer.My_Time.__name__)
+        
+        # If we are running a scheduled profile...
+        if profile:
+            _run_profile(profile, output, load, motor, h100)
+
+        # Update the performance monitor timer
+        performance_timer = _performance_monitor(args.timer, performance_timer, scheduler.Scheduler.__name__)
+
+        # If there is a loadbank connected, update the sensor values
+        if load:
+            load.update()
+
+        # Update the performance monitor timer
+        performance_timer = _performance_monitor(args.timer, performance_timer, loadbank.TdiLoadbank.__name__)
+
+        ## Handle the user interface
+        # Read typed in user data on the screen
+        request = _reader()
+        
+        # If something was typed in...
+        if request:
+            _handle_request(request, h100, load, motor, profile, my_time, rate, log)
+
+        # Update the performance monitor timer
+        performance_timer = _performance_monitor(args.timer, performance_timer, "UI")
+
+        ## Handle the logfile
+        performance_timer = _log(log, h100, load, my_time, display, args.timer, performance_timer, args.format == "raw")
+
+        # If verbose is argued then print all data to screen
+        if args.verbose and not args.timer:
+            _print_all(h100, load, my_time)
+
+        # If running at a fixed rate, sleep until the next tick
+        if rate:
+            rate.wait()
+
+            # Update the performance monitor timer
+            performance_timer = _performance_monitor(args.timer, performance_timer, "idle")
+
+# Task to run the controller, profile, loadbank and logging
+async def _control_task(args, h100, load, profile, output, motor, my_time, display, log, clock, rate=''):
+    while True:
+        # Read the clock once for this tick
+        clock.tick()
+        
+        # Run the fuel cell controller on the I2C databus thread
+        await aio.on_bus(h100.run)
+        
+        # Run the timer
+        my_time.run()
+        
+        # If we are running a scheduled profile... (the ESC is on the I2C databus)
+        if profile:
+            await aio.on_bus(_run_profile, profile, output, load, motor, h100)
+            
+        # If there is a loadbank connected, update the sensor values
+        if load:
+            await aio.off_bus(load.update)
+        
+        # Log this timestep, the record only goes into the ring buffer
+        _log(log, h100, load, my_time, display, raw=args.format == "raw")
+        
+        # If verbose is argued then print all data to screen
+        if args.verbose:
+            _print_all(h100, load, my_time)
+
+        # If running at a fixed rate, wait for the next tick
+        if rate:
+            await aio.off_bus(rate.wait)
+
+# Task to handle the user interface
+async def _input_task(h100, load, motor, profile, my_time, rate='', log=''):
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    
+    # Queue each line as it is typed in
+    loop.add_reader(sys.stdin, lambda: lines.put_nowait(sys.stdin.readline()))
+    
+    while True:
+        line = await lines.get()
+        
+        # If there is nothing it is the end of the input
+        if not line:
+            loop.remove_reader(sys.stdin)
+            return
+            
+        # Otherwise act on the line, in turn with the other I2C databus work
+        request = line.lower().strip()
+        if request:
+            await aio.on_bus(_handle_request, request, h100, load, motor, profile, my_time, rate, log)
+
+# Task to ask for the logfile to be written out to the USB stick
+async def _flush_task(log, period=1.0):
+    while True:
+        await asyncio.sleep(period)
+        log.flush()
+
+# Function to run the main code loop as concurrent asyncio tasks
+async def _run_async(args, h100, load, profile, output, motor, my_time, display, log, clock, rate=''):
+    await asyncio.gather(
+        _control_task(args, h100, load, profile, output, motor, my_time, display, log, clock, rate),
+        _input_task(h100, load, motor, profile, my_time, rate, log),
+        _flush_task(log))
+
+
+# Shutdown routine        
+def _shutdown(motor, h100, load, log, display):
+    try:
         print("\nShutting down...")
 
         # Set motor throttle to zero
@@ -618,7 +756,6 @@ def _shutdown(motor, h100, load, log, display):
         print('...Throttle set to {:d}'.format(motor.throttle))
     
         # Shutdown fuel cell
->>>>>>> 3b5cd44a29734f67cc8491f2f6f979287aabc672
         h100.shutdown()
     
         # Shutdown loadbank
@@ -628,8 +765,9 @@ def _shutdown(motor, h100, load, log, display):
         
         # Shutdown datalog
         if log:
+            log.close()
             print('...Datalogger closed')
-            if log.close(): print('Done\n')
+            print(log.report())
         
         # Shutdown LED display
         if display:
@@ -654,17 +792,33 @@ if __name__ == "__main__":
         # Get user arguments from command line
         args = _parse_commandline()
         
-        # If user asked for a logfile then open this
+        # Name the logfile
         if args.out:
-            log = open(("/media/usb/" + time.strftime("%y%m%d-%H%M%S") + "-controller-" + args.out + ".tsv"), 'w')
+            filename = "/media/usb/" + time.strftime("%y%m%d-%H%M%S") + "-controller-" + args.out
             
-        # Otherwise open nothing to prevent errors
+        ## Initialise classes
+        # If argued, replace the I2C databus with simulated devices
+        if args.simulate:
+            bus.install(bus.h100_bus())
+            
+        # Do all the I2C from one thread so actuator writes go first
+        if args.worker:
+            i2c.start_worker(1)
+            
+        # Start the clock every part of the control loop shares
+        clock = timer.Clock()
+        
+        # Fire the fan and purge edges on time from their own thread
+        outputs = switch.Edge_Scheduler()
+        
+        # The hybrid board's INT line, on the Pi's I2C interrupt pin
+        if args.interrupt:
+            interrupt = gpio.pins.pin(gpio.I2C_INTERRUPT, direction=gpio.In, interrupt=gpio.Falling)
         else:
-            log = open("/dev/null", 'w')
+            interrupt = None
         
-        ## Initialise classes
         # Initialise controller
-        h100 = H100(args.purge)
+        h100 = H100(args.purge, clock, checkpoint=args.checkpoint, outputs=outputs, interrupt=interrupt)
         
         # Initialise LED display
         display = h100Display.FuelCellDisplay()
@@ -698,9 +852,28 @@ if __name__ == "__main__":
             time.sleep(0.2)
             load.voltage_minimum = '5.0'
         
+        # If user asked for a logfile then open this, in binary if argued
+        if args.out and args.format == "bin":
+            log, formatter = binary.open_log(filename + ".bin", binary.controller_fields(load),
+                                             widths=binary.controller_widths(load))
+        elif args.out and args.format == "raw":
+            log, formatter = binary.open_log(filename + ".raw.bin", binary.raw_fields(H100.CHANNELS),
+                                             {'board': 'h100',
+                                              'calibration': h100.calibration.version,
+                                              'lsb': h100.lsb})
+        elif args.out:
+            log, formatter = open(filename + ".tsv", 'w'), datalog.tsv
+            
+        # Otherwise open nothing to prevent errors
+        else:
+            log, formatter = open("/dev/null", 'w'), datalog.tsv
+            
+        # Write the logfile from a background thread in large blocks
+        log = datalog.Log_Writer(log, formatter=formatter)
+        
         # Initialise profile scheduler if argued
         if args.profile:
-            profile = scheduler.Scheduler(args.profile)
+            profile = scheduler.Scheduler(args.profile, args.interpolate, clock)
             
             # If a loadbank is connected then define this as the output
             if load:
@@ -713,6 +886,7 @@ if __name__ == "__main__":
         # Otherwise make the variable blank
         else:
             profile = ''
+            output = ''
         
         # Initiaise the ESC
         motor = esc.esc()
@@ -721,7 +895,7 @@ if __name__ == "__main__":
         motor.throttle = 0
         
         # Start timers
-        my_time = timer.My_Time()
+        my_time = timer.My_Time(clock)
         timeStart = time.time() # todo
         
         # Print the header to the screen
@@ -733,200 +907,21 @@ if __name__ == "__main__":
             # Set the fuel cell name
             display.name = "H100"
         
-        # Display a list of available user commands
-        print("Type command: [time, throttle, fc, elec, v, i, energy, temp, purg, fly] ")
+        # If argued, run the control loop at a fixed rate
+        if args.rate:
+            rate = timer.Fixed_Rate(args.rate)
+        else:
+            rate = ''
         
-        # Start a timer
-        performance_timer = time.time()
+        # Display a list of available user commands
+        print("Type command: [time, throttle, fc, elec, v, i, energy, temp, purg, fly, rate, log, pulse, bus] ")
         
         # Try to run the main code loop
         try:
-            while True:
-                
-                ## Handle the background processes
-                # Run the fuel cell controller
-                h100.run()
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, H100.__name__)
-                
-                # Run the timer TODO
-                my_time.run()
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, timer.My_Time.__name__)
-                
-                # If we are running a scheduled profile...
-                if profile:
-                    
-                    # Get the programmed setpoint
-                    setpoint = profile.run()
-                    
-                    # If the output is the digital loadbank...
-                    if "loadbank" in output and load:
-                        
-                        # and the setpoint is not in an error mode...
-                        if setpoint >= 0:
-                            
-                            # Turn the loadbank on
-                            load.load = True
-                            
-                            # Set the type of electrical profile we are running
-                            mode = load.mode
-                            
-                            # Set the setpoint for the electrical profile for now
-                            if "VOLTAGE" in mode:
-                                load.voltage_constant = str(setpoint)
-                            elif "CURRENT" in mode:
-                                load.current_constant = str(setpoint)
-                            elif "POWER" in mode:
-                                load.power_constant = str(setpoint)
-                                
-                        # Setpoint is in an error mode (eg profile finished) so turn off
-                        else:
-                            load.load = False
-                            
-                    # Otherwise assume a throttle profile, send this to the motor
-                    else:
-                        motor.throttle = setpoint
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, scheduler.Scheduler.__name__)
-        
-                # If there is a loadbank connected, update the sensor values
-                if load:
-                    load.update()
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, loadbank.TdiLoadbank.__name__)
-        
-                ## Handle the user interface
-                # Read typed in user data on the screen
-                request = _reader()
-                
-                # If something was typed in...
-                if request:
-                    
-                    # Split the argument from the value
-                    request = request.split(' ')
-                    
-                    # Determine the number of pieces of information
-                    req_len = len(request)
-                    
-                    # Strip away any whitespace
-                    for x in range(req_len):
-                        request[x] = request[x].strip()
-        
-                    # If only one piece of information, it is a request for data
-                    if req_len is 1:
-                        if request[0].startswith("time?"):
-                            _print_time(my_time, print, True)
-                        elif request[0].startswith("throttle?"):
-                            _print_throttle(motor, print, True)
-                        elif request[0].startswith("fc?"):
-                            _print_state(h100, print, True)
-                        elif request[0].startswith("elec?"):
-                            _print_electric(h100, load, print, True)
-                        elif request[0].startswith("v?"):
-                            _print_voltage(h100, load, print, True)
-                        elif request[0].startswith("i?"):
-                            _print_current(h100, load, print, True)
-                        elif request[0].startswith("energy?"):
-                            _print_energy(h100, print, True)
-                        elif request[0].startswith("temp?"):
-                            _print_temperature(h100, print, True)
-                        elif request[0].startswith("purg?"):
-                            _print_purge(h100, print, True)
-                        elif request[0].startswith("fly?"):
-                            if profile and profile.running:
-                                print("Currently flying")
-                            else:
-                                print("In the hangar")
-        
-                    # If there are two pieces of information it is a command to change something
-                    elif req_len is 2:
-                        if request[0].startswith("fc"):
-                            _new_state = request[1]
-                            print('Changing state to', _new_state)
-                            h100.state = _new_state
-                        elif request[0].startswith("fly"):
-                            profile.running = request[1]
-                        elif request[0].startswith("throttle"):
-                            if request[1].startswith("calibration"):
-                                motor.calibration()
-                            else:
-                                motor.throttle = request[1]
-        
-                    # Print a new line to the screen
-                    print()
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "UI")
-        
-                ## Handle the logfile
-                # Log time
-                _print_time(my_time, log.write)
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "log_time")
-        
-                # Log state
-                state = _print_state(h100, log.write)
-                
-                # Send state to LED display if connected
-                if display:
-                    display.state = state
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "log_state")
-        
-                # Log electrical data
-                electric = _print_electric(h100, load, log.write)
-                
-                # Send electrical data to LED display if connected
-                if display:
-                    display.voltage = electric[0]
-                    display.current = electric[1]
-                    display.power = electric[2]
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "log_electrical")
-        
-                # Log energy data
-                _print_energy(h100, log.write)
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "energy")
-        
-                # Log temperature data
-                temp = _print_temperature(h100, log.write)
-                
-                # Send temperature data to LED display if connected
-                if display:
-                    display.temperature = max(temp)
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "log_temp")
-        
-                # Log purge controller data
-                _print_purge(h100, log.write)
-        
-                # Update the performance monitor timer
-                performance_timer = _performance_monitor(args.timer, performance_timer, "log_purge")
-        
-                # Log a new line, end of this timestep
-                if log:
-                    log.write("\n")
-        
-                # If verbose is argued then print all data to screen
-                if args.verbose and not args.timer:
-                    _print_time(my_time, print)
-                    _print_state(h100, print)
-                    _print_electric(h100, load, print)
-                    _print_energy(h100, print)
-                    _print_temperature(h100, print)
-                    _print_purge(h100, print)
-                    print()
+            if args.asyncio:
+                asyncio.run(_run_async(args, h100, load, profile, output, motor, my_time, display, log, clock, rate))
+            else:
+                _run(args, h100, load, profile, output, motor, my_time, display, log, clock, rate)
         
         # Do the folowing it code crashes or keyboard exception is raised (Ctrl+C)
         finally:
@@ -935,6 +930,8 @@ if __name__ == "__main__":
     
     except KeyboardInterrupt:
         _shutdown(motor, h100, load, log, display)
+        outputs.close()
+        i2c.stop_worker(1)
         
     #######
     # End #
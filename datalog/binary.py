@@ -0,0 +1,246 @@
+##!/usr/bin/env python3
+
+# Binary columnar telemetry log format
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Binary log format, all little-endian:
+#
+#   Header
+#     magic    4s   b'H1LG'
+#     version  u16  1
+#     padding  2 bytes
+#     length   u32  length of the schema
+#     schema   JSON {"fields": [[name, type, unit], ...]} padded with
+#              spaces so the records start on an 8 byte boundary. Any
+#              other keys are metadata about the log, such as the
+#              version of the calibration table of a raw log
+#
+#   Records, one per timestep, all the same size
+#     each field packed in order as its type, with no padding
+#
+# Types are NumPy type strings so the reader can map the records straight
+# into a structured array. Writing only needs the standard library.
+
+# Import libraries
+import json, math, struct
+
+MAGIC = b'H1LG'
+VERSION = 1
+HEADER = struct.Struct('<4sH2xI')
+
+# Struct code for each type a field can be
+TYPES = {'<f8': 'd', '<f4': 'f', '<i4': 'i', '<u4': 'I', '<i2': 'h', '<u2': 'H', '<u1': 'B'}
+
+
+# Define class
+class Binary_Format:
+    # Code to run when class is created, each field is (name, type, unit).
+    # Widths are how many fields each cell of a record fills, so a cell
+    # that is short of numbers can't shift the fields after it. Without
+    # them each cell fills as many fields as it has numbers
+    def __init__(self, fields, metadata=None, widths=None):
+        for name, kind, unit in fields:
+            if kind not in TYPES:
+                raise ValueError('Field ' + name + ' has unsupported type ' + kind)
+                
+        self.__fields = [tuple(field) for field in fields]
+        self.__metadata = dict(metadata or {})
+        self.__widths = None if widths is None else list(widths)
+        self.__struct = struct.Struct('<' + ''.join(TYPES[kind] for name, kind, unit in fields))
+        
+        # Missing cells are NaN, or the error code -1 for whole numbers
+        self.__missing = [math.nan if kind[1] == 'f' else (-1 if kind[1] == 'i' else 0)
+                          for name, kind, unit in fields]
+        self.__integer = [kind[1] != 'f' for name, kind, unit in fields]
+        self.__values = list(self.__missing)
+
+    # Method to get the header to start the file with
+    def header(self):
+        schema = dict(self.__metadata, fields=self.__fields)
+        schema = json.dumps(schema).encode()
+        
+        # Pad the schema so the records are aligned
+        schema += b' ' * (-(HEADER.size + len(schema)) % 8)
+        
+        return HEADER.pack(MAGIC, VERSION, len(schema)) + schema
+
+    # Method to pack a record, the same record as is written to the TSV log.
+    # A text cell of several numbers (eg the loadbank mode "1 4") fills the
+    # fields of its width, any it is short of are missing (eg the unknown
+    # mode 999 is "999 nan")
+    def __call__(self, record):
+        values = self.__values
+        widths = self.__widths
+        x = 0
+        for c in range(len(record)):
+            cell = record[c]
+            words = cell.split() if type(cell) is str else (cell,)
+            
+            if widths is None:
+                width = len(words)
+            elif c < len(widths):
+                width = widths[c]
+            else:
+                break
+                
+            for w in range(width):
+                if w < len(words):
+                    x = self.__put(values, x, words[w])
+                elif x < len(values):
+                    values[x] = self.__missing[x]
+                    x += 1
+                
+        # Fill anything not in the record
+        for y in range(x, len(values)):
+            values[y] = self.__missing[y]
+            
+        return self.__struct.pack(*values)
+
+    # Method to put one value into the next field
+    def __put(self, values, x, value):
+        if x < len(values):
+            try:
+                value = float(value)
+                values[x] = int(value) if self.__integer[x] else value
+            except (ValueError, TypeError, OverflowError):
+                values[x] = self.__missing[x]
+        return x + 1
+
+    # Property - What are the fields?
+    @property
+    def fields(self):
+        return self.__fields
+
+    # Property - What else is known about the log?
+    @property
+    def metadata(self):
+        return self.__metadata
+
+    # Property - How many fields does each cell fill, None if as many as it has numbers?
+    @property
+    def widths(self):
+        return self.__widths
+
+    # Property - How many bytes is a record?
+    @property
+    def size(self):
+        return self.__struct.size
+
+
+# Function to list the fields controller.py logs each timestep as
+# (name, type, unit), in the order they are in each record
+def controller_fields(load=False):
+    fields = [("epoch",    "<f8", "s"),
+              ("duration", "<f8", "s"),
+              ("dt",       "<f4", "s"),
+              ("state",    "<i4", "")]
+    
+    # Electrical data, hybrid board then controller, for each output
+    for output in ("fc", "b", "out"):
+        fields += [("V_" + output + "_h", "<f4", "V"),
+                   ("V_" + output,        "<f4", "V"),
+                   ("I_" + output + "_h", "<f4", "A"),
+                   ("I_" + output,        "<f4", "A")]
+                   
+    if load:
+        fields += [("load_mode",  "<i4", ""),
+                   ("load_range", "<f4", ""),
+                   ("V_load",     "<f4", "V"),
+                   ("I_load",     "<f4", "A"),
+                   ("P_load",     "<f4", "W")]
+                   
+    fields += [("E_fc",  "<f8", "J"),
+               ("E_b",   "<f8", "J"),
+               ("E_out", "<f8", "J")]
+    
+    fields += [("T_h0", "<f4", "C"),
+               ("T_h1", "<f4", "C"),
+               ("T_0",  "<f4", "C"),
+               ("T_1",  "<f4", "C"),
+               ("T_2",  "<f4", "C"),
+               ("T_3",  "<f4", "C")]
+    
+    fields += [("MFC_flow", "<f4", "SLPM"),
+               ("MFC_mol",  "<f4", "mol/s"),
+               ("Pg_freq",  "<f4", "s"),
+               ("Pg_t",     "<f4", "s")]
+    
+    return fields
+
+# Function to list how many fields each cell of a controller.py record
+# fills, every cell one but the loadbank mode which is "mode range"
+def controller_widths(load=False):
+    widths = [1] * (4 + 12)
+    if load:
+        widths += [2, 1, 1, 1]
+    widths += [1] * (3 + 6 + 4)
+    
+    return widths
+
+# Function to list the fields controller.py logs each timestep in raw
+# mode, the ADC counts of the named channels rather than engineering units.
+# Only the ADC is calibrated so the temperatures and purge are as logged
+def raw_fields(channels):
+    fields = [("epoch",    "<f8", "s"),
+              ("duration", "<f8", "s"),
+              ("dt",       "<f4", "s"),
+              ("state",    "<i4", "")]
+    
+    fields += [(name, "<i4", "counts") for name in channels]
+    
+    fields += [("T_h0", "<f4", "C"),
+               ("T_h1", "<f4", "C"),
+               ("T_0",  "<f4", "C"),
+               ("T_1",  "<f4", "C"),
+               ("T_2",  "<f4", "C"),
+               ("T_3",  "<f4", "C")]
+    
+    fields += [("Pg_freq",  "<f4", "s"),
+               ("Pg_t",     "<f4", "s")]
+    
+    return fields
+
+# Function to open a new binary log and write its header
+def open_log(filename, fields, metadata=None, widths=None):
+    formatter = Binary_Format(fields, metadata, widths)
+    
+    fid = open(filename, 'wb')
+    fid.write(formatter.header())
+    
+    return fid, formatter
+
+# Function to read the whole schema of a binary log, fields and metadata
+def read_schema(fid):
+    magic, version, length = HEADER.unpack(fid.read(HEADER.size))
+    
+    if magic != MAGIC:
+        raise ValueError('Not a binary log')
+    if version != VERSION:
+        raise ValueError('Unsupported log version ' + str(version))
+        
+    schema = json.loads(fid.read(length).decode())
+    schema['fields'] = [tuple(field) for field in schema['fields']]
+    
+    return schema, HEADER.size + length
+
+# Function to read the fields of a binary log
+def read_header(fid):
+    schema, offset = read_schema(fid)
+    
+    return schema['fields'], offset
@@ -0,0 +1,210 @@
+##!/usr/bin/env python3
+
+# Buffered background data logger
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# The control loop hands over one record per timestep. Records wait in a
+# ring buffer that is allocated once, and a writer thread drains them to
+# the file in large blocks, so the loop never waits on the USB stick. If
+# the stick falls so far behind that the ring fills up, new records are
+# dropped and counted rather than blocking the loop.
+
+# Import libraries
+import threading
+
+
+# Function to format a record as a line of tab separated values
+def tsv(record):
+    cells = []
+    for cell in record:
+        if type(cell) is float:
+            cells.append("{0:.1f}".format(cell))
+        else:
+            cells.append(str(cell))
+    return '\t'.join(cells) + '\t\n'
+
+
+# Define class
+class Log_Writer:
+    # Code to run when class is created
+    def __init__(self, fid, size=4096, block=64, period=1.0, formatter=tsv):
+        self.__fid = fid
+        self.__formatter = formatter
+        self.__block = block
+        self.__period = period
+        
+        # Ring buffer
+        self.__ring = [None] * size
+        self.__head = 0
+        self.__depth = 0
+        self.__lock = threading.Condition()
+        
+        # Counters
+        self.__written = 0
+        self.__dropped = 0
+        self.__depth_max = 0
+        self.__errors = 0
+        self.__lost = 0
+        self.__error = None
+        self.__flush = False
+        self.__running = True
+        
+        # Start the writer thread
+        self.__thread = threading.Thread(target=self.__drain, name='log', daemon=True)
+        self.__thread.start()
+
+    # Method to queue a record, never blocks
+    def write_record(self, record):
+        with self.__lock:
+            # If the ring is full drop the record
+            if self.__depth == len(self.__ring):
+                self.__dropped += 1
+                return False
+                
+            # Put the record in the next free slot
+            self.__ring[(self.__head + self.__depth) % len(self.__ring)] = record
+            self.__depth += 1
+            self.__depth_max = max(self.__depth, self.__depth_max)
+            
+            # Wake the writer when there is a full block
+            if self.__depth >= self.__block:
+                self.__lock.notify()
+                
+        return True
+
+    # Method to write a string straight to the file (eg a header)
+    def write(self, text):
+        return self.write_record(_Text(text))
+
+    # Method to ask the writer to write everything queued now
+    def flush(self):
+        with self.__lock:
+            self.__flush = True
+            self.__lock.notify()
+
+    # Method to write everything queued then close the file. Returns -1 if
+    # anything couldn't be written
+    def close(self):
+        with self.__lock:
+            self.__running = False
+            self.__lock.notify()
+        self.__thread.join()
+        
+        try:
+            self.__fid.close()
+        except OSError as e:
+            self.__errors += 1
+            self.__error = e
+            
+        return -1 if self.__errors else 1
+
+    # Writer thread
+    def __drain(self):
+        while True:
+            with self.__lock:
+                # Sleep until there's a block to write, a flush, or the period is up
+                if self.__running and not self.__flush and self.__depth < self.__block:
+                    self.__lock.wait(self.__period)
+                    
+                # Take everything queued out of the ring
+                records = []
+                while self.__depth:
+                    records.append(self.__ring[self.__head])
+                    self.__ring[self.__head] = None
+                    self.__head = (self.__head + 1) % len(self.__ring)
+                    self.__depth -= 1
+                    
+                self.__flush = False
+                running = self.__running
+
+            # Format and write the block outside the lock
+            if records:
+                pieces = [r.text if type(r) is _Text else self.__formatter(r) for r in records]
+                
+                # Join as text or bytes, whichever the formatter makes. If
+                # the file can't be written (USB stick full or pulled out)
+                # the block is lost but the writer carries on, in case it
+                # comes back, and says so the first time
+                try:
+                    self.__fid.write(pieces[0][:0].join(pieces))
+                    self.__fid.flush()
+                    self.__written += len(records)
+                    self.__error = None
+                except OSError as e:
+                    if self.__error is None:
+                        print("Err: Log write failed, " + str(e))
+                    self.__errors += 1
+                    self.__lost += len(records)
+                    self.__error = e
+                
+            if not running:
+                return
+
+    # Property - How many records are waiting to be written?
+    @property
+    def depth(self):
+        return self.__depth
+
+    # Property - What's the most records that have been waiting?
+    @property
+    def depth_max(self):
+        return self.__depth_max
+
+    # Property - How many records have been written?
+    @property
+    def written(self):
+        return self.__written
+
+    # Property - How many records were lost because the ring was full?
+    @property
+    def dropped(self):
+        return self.__dropped
+
+    # Property - How many times couldn't the file be written?
+    @property
+    def errors(self):
+        return self.__errors
+
+    # Property - How many records were lost because the file couldn't be written?
+    @property
+    def lost(self):
+        return self.__lost
+
+    # Property - What was the last write error, None if the last write worked?
+    @property
+    def error(self):
+        return self.__error
+
+    # Method to describe the counters
+    def report(self):
+        report = "Log: depth {0:d}/{1:d} max {2:d} written {3:d} dropped {4:d}".format(
+            self.depth, len(self.__ring), self.depth_max, self.written, self.dropped)
+        if self.__errors:
+            report += " errors {0:d} lost {1:d}".format(self.__errors, self.__lost)
+            if self.__error is not None:
+                report += " (" + str(self.__error) + ")"
+        return report
+
+
+# Define class for text written as it is
+class _Text:
+    __slots__ = ['text']
+
+    def __init__(self, text):
+        self.text = text
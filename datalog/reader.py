@@ -0,0 +1,101 @@
+##!/usr/bin/env python3
+
+# Binary telemetry log reader
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Maps a binary log into a NumPy structured array, so a day long run opens
+# without reading the file. Needs NumPy, which the controller doesn't.
+#
+# Usage: python3 -m datalog.reader logs/*.bin [--tsv]
+
+# Import libraries
+import argparse, os, sys
+import numpy
+from datalog import binary
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='Binary log reader by Simon Howroyd 2015')
+
+    # Define aguments
+    parser.add_argument('source', type=str, nargs='+', help='Binary logs to read')
+    parser.add_argument('--tsv', action='store_true', help='Convert each log to tab separated values')
+
+    # Return what was argued
+    return parser.parse_args()
+
+# Function to get the fields of a binary log as (name, type, unit)
+def schema(filename):
+    with open(filename, 'rb') as fid:
+        return binary.read_header(fid)[0]
+
+# Function to get everything else the header of a binary log says
+def metadata(filename):
+    with open(filename, 'rb') as fid:
+        schema = binary.read_schema(fid)[0]
+        
+    del schema['fields']
+    return schema
+
+# Function to get the units of each field of a binary log
+def units(filename):
+    return {name: unit for name, kind, unit in schema(filename)}
+
+# Function to map a binary log as a structured array, one row per record
+def read(filename):
+    with open(filename, 'rb') as fid:
+        fields, offset = binary.read_header(fid)
+        
+    dtype = numpy.dtype([(name, kind) for name, kind, unit in fields])
+    
+    # Only whole records, the last may be part written if the power went
+    count = (os.path.getsize(filename) - offset) // dtype.itemsize
+    if count == 0:
+        return numpy.zeros(0, dtype)
+        
+    return numpy.memmap(filename, dtype, mode='r', offset=offset, shape=(count,))
+
+# Function to write a binary log as tab separated values with a header line
+def to_tsv(filename, destination):
+    data = read(filename)
+    
+    with open(destination, 'w') as fid:
+        fid.write('\t'.join(data.dtype.names) + '\n')
+        for record in data:
+            fid.write('\t'.join(str(cell) for cell in record.tolist()) + '\n')
+            
+    return len(data)
+
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+
+    for source in args.source:
+        if args.tsv:
+            destination = os.path.splitext(source)[0] + '.tsv'
+            count = to_tsv(source, destination)
+            print(source + ' -> ' + destination + ' (' + str(count) + ' records)')
+        else:
+            data = read(source)
+            print(source + ' (' + str(len(data)) + ' records)')
+            for name, kind, unit in schema(source):
+                print('    ' + name + ' [' + unit + '] ' + kind)
@@ -0,0 +1,78 @@
+import numpy, pytest
+from datalog import binary, reader
+from datalog.datalog import Log_Writer
+
+FIELDS = [("epoch", "<f8", "s"),
+          ("state", "<i4", ""),
+          ("load_mode", "<i4", ""),
+          ("load_range", "<f4", ""),
+          ("V_fc", "<f4", "V")]
+
+
+def write(tmp_path, records):
+    filename = str(tmp_path / "log.bin")
+    fid, formatter = binary.open_log(filename, FIELDS)
+    log = Log_Writer(fid, formatter=formatter)
+    for record in records:
+        log.write_record(record)
+    log.close()
+    return filename
+
+def test_records_read_back_as_a_structured_array(tmp_path):
+    filename = write(tmp_path, [[1.5e9 + x, 3, "1 4", 24.25 + x] for x in range(100)])
+    
+    data = reader.read(filename)
+    
+    assert isinstance(data, numpy.memmap)
+    assert data.dtype.names == ("epoch", "state", "load_mode", "load_range", "V_fc")
+    assert len(data) == 100
+    assert data["epoch"][99] == 1.5e9 + 99
+    assert data["state"][0] == 3
+    assert data["load_mode"][0] == 1 and data["load_range"][0] == 4
+    assert data["V_fc"][10] == pytest.approx(34.25)
+    assert reader.units(filename)["V_fc"] == "V"
+
+def test_missing_and_text_cells(tmp_path):
+    filename = write(tmp_path, [[1.0, "on", 999]])
+    
+    record = reader.read(filename)[0]
+    
+    assert record["state"] == -1
+    assert record["load_mode"] == 999
+    assert numpy.isnan(record["load_range"]) and numpy.isnan(record["V_fc"])
+
+def test_unknown_load_mode_does_not_shift_the_record(tmp_path):
+    filename = str(tmp_path / "log.bin")
+    fields = binary.controller_fields(True)
+    fid, formatter = binary.open_log(filename, fields, widths=binary.controller_widths(True))
+    assert sum(formatter.widths) == len(fields)
+    
+    # As controller.py logs it, the loadbank mode unknown
+    record = [1.5e9, 1.0, 0.1, 2] + [12.0] * 12 + [999, 30.0, 4.0, 120.0] \
+             + [0.0] * 3 + [25.0] * 6 + [0.5, 1e-4, 30.0, 0.5]
+    log = Log_Writer(fid, formatter=formatter)
+    log.write_record(record)
+    log.close()
+    
+    data = reader.read(filename)[0]
+    assert data["load_mode"] == 999 and numpy.isnan(data["load_range"])
+    assert data["V_load"] == 30.0 and data["P_load"] == 120.0
+    assert data["T_3"] == 25.0 and data["Pg_t"] == 0.5
+
+def test_part_written_record_is_ignored(tmp_path):
+    filename = write(tmp_path, [[1.0, 1, "1 4", 2.0]] * 3)
+    with open(filename, 'ab') as fid:
+        fid.write(b'\0' * 5)
+        
+    assert len(reader.read(filename)) == 3
+
+def test_header_keeps_records_aligned():
+    assert len(binary.Binary_Format(FIELDS).header()) % 8 == 0
+
+def test_metadata_is_kept_in_the_header(tmp_path):
+    filename = str(tmp_path / "log.bin")
+    fid, formatter = binary.open_log(filename, FIELDS, {"calibration": "v2", "lsb": [0.5]})
+    fid.close()
+    
+    assert reader.metadata(filename) == {"calibration": "v2", "lsb": [0.5]}
+    assert reader.schema(filename) == FIELDS
@@ -0,0 +1,90 @@
+import io, threading, time
+from datalog.datalog import Log_Writer, tsv
+
+
+# A file that holds its writes until told to let them through
+class Slow_File(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.writes = 0
+
+    def write(self, text):
+        self.release.wait()
+        self.writes += 1
+        return super().write(text)
+
+    def close(self):
+        self.contents = self.getvalue()
+        super().close()
+
+
+# A file on a USB stick that fills up after a number of writes
+class Full_File(io.StringIO):
+    def __init__(self, writes):
+        super().__init__()
+        self.writes = writes
+
+    def write(self, text):
+        if self.writes <= 0:
+            raise OSError(28, 'No space left on device')
+        self.writes -= 1
+        return super().write(text)
+
+
+def test_records_are_written_in_order_as_tab_separated_lines():
+    fid = Slow_File()
+    fid.release.set()
+    log = Log_Writer(fid, size=8, block=4)
+    
+    for x in range(6):
+        log.write_record([float(x), x, "on"])
+    log.close()
+    
+    assert fid.contents == ''.join(tsv([float(x), x, "on"]) for x in range(6))
+    assert fid.contents.splitlines()[1] == "1.0\t1\ton\t"
+    assert log.written == 6
+    assert log.dropped == 0
+
+def test_full_ring_drops_records_instead_of_blocking():
+    fid = Slow_File()
+    log = Log_Writer(fid, size=4, block=1)
+    
+    # The writer is stuck on the first block, so the ring fills up
+    results = [log.write_record([x]) for x in range(20)]
+    
+    assert not all(results)
+    assert log.dropped > 0
+    assert log.depth <= 4
+    
+    fid.release.set()
+    log.close()
+    
+    assert log.written + log.dropped == 20
+    assert log.depth == 0
+
+def test_blocks_are_written_together():
+    fid = Slow_File()
+    log = Log_Writer(fid, size=64, block=64, period=10)
+    
+    for x in range(10):
+        log.write_record([x])
+    fid.release.set()
+    log.close()
+    
+    assert fid.writes == 1
+
+def test_write_errors_are_counted_and_reported():
+    fid = Full_File(1)
+    log = Log_Writer(fid, size=8, block=2)
+    
+    for x in range(6):
+        log.write_record([x])
+        log.flush()
+        time.sleep(0.02)
+    
+    # The writer is still going after the first error
+    assert log.written == 1 and log.errors >= 1
+    assert log.written + log.lost == 6
+    assert 'errors' in log.report() and 'No space' in log.report()
+    assert log.close() == -1
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+# Energy, charge and hydrogen integration
+
+# Copyright (C) 2015  Simon Howroyd
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Totals the energy and charge of each output and the hydrogen used, by the
+# trapezium rule between the timestamps of successive ticks. A reading of
+# -1 is an error so no area is added either side of it.
+#
+# The totals can be kept in a checkpoint file, saved every so often and
+# read back when the controller starts, so a long test doesn't lose them
+# if the controller is restarted.
+
+# Import libraries
+import json, os, time
+
+# Lower heating value of hydrogen, J/mol
+LHV = 241.8e3
+
+
+# Define class
+class Energy():
+    # Code to run when class is created. The clock gives the time in
+    # seconds, usually the controller's timer.Clock
+    def __init__(self, channels=3, clock=time.monotonic, checkpoint='', period=60.0):
+        self.__clock = clock
+        self.__checkpoint = checkpoint
+        self.__period = period
+
+        # Totals
+        self.__joules = [0.0] * channels
+        self.__coulombs = [0.0] * channels
+        self.__moles = 0.0
+
+        # Last readings, None until there is a good one
+        self.__time = None
+        self.__power = [None] * channels
+        self.__current = [None] * channels
+        self.__flow = None
+
+        # Carry on from the checkpoint if there is one
+        self.__saved = clock()
+        if checkpoint and os.path.exists(checkpoint):
+            self.load(checkpoint)
+
+    # Method to add the area under one reading since the last
+    @staticmethod
+    def _trapezium(last, now, dt):
+        if last is None or dt <= 0:
+            return 0.0
+        return 0.5 * (last + now) * dt
+
+    # Method to add one tick of readings, power (W) and current (A) of each
+    # channel and hydrogen flow (mol/s)
+    def update(self, power, current, flow):
+        now = self.__clock()
+        dt = 0.0 if self.__time is None else now - self.__time
+        self.__time = now
+
+        for x in range(len(self.__joules)):
+            if power[x] >= 0.0:
+                self.__joules[x] += self._trapezium(self.__power[x], power[x], dt)
+                self.__power[x] = power[x]
+            else:
+                self.__power[x] = None
+
+            if current[x] >= 0.0:
+                self.__coulombs[x] += self._trapezium(self.__current[x], current[x], dt)
+                self.__current[x] = current[x]
+            else:
+                self.__current[x] = None
+
+        if flow >= 0.0:
+            self.__moles += self._trapezium(self.__flow, flow, dt)
+            self.__flow = flow
+        else:
+            self.__flow = None
+
+        # Checkpoint every so often
+        if self.__checkpoint and now - self.__saved >= self.__period:
+            self.save()
+
+    # Method to write the totals to the checkpoint file. The file is
+    # replaced in one go so a power cut leaves the old or new totals
+    def save(self, filename=''):
+        filename = filename or self.__checkpoint
+        self.__saved = self.__clock()
+        if not filename:
+            return 0
+
+        try:
+            with open(filename + '.tmp', 'w') as fid:
+                json.dump({'joules': self.__joules,
+                           'coulombs': self.__coulombs,
+                           'moles': self.__moles,
+                           'saved': time.time()}, fid)
+            os.replace(filename + '.tmp', filename)
+            return 1
+
+        except OSError:
+            return -1
+
+    # Method to read the totals from a checkpoint file
+    def load(self, filename=''):
+        try:
+            with open(filename or self.__checkpoint) as fid:
+                totals = json.load(fid)
+
+            self.__joules[:] = totals['joules'][:len(self.__joules)]
+            self.__coulombs[:] = totals['coulombs'][:len(self.__coulombs)]
+            self.__moles = totals['moles']
+            return 1
+
+        except (OSError, ValueError, KeyError):
+            return -1
+
+    # Method to zero the totals
+    def reset(self):
+        for x in range(len(self.__joules)):
+            self.__joules[x] = 0.0
+            self.__coulombs[x] = 0.0
+        self.__moles = 0.0
+
+    # Property - What's the energy of each channel in joules?
+    @property
+    def joules(self):
+        return self.__joules
+
+    # Property - What's the energy of each channel in watt hours?
+    @property
+    def watt_hours(self):
+        return [joules / 3600.0 for joules in self.__joules]
+
+    # Property - What's the charge of each channel in coulombs?
+    @property
+    def coulombs(self):
+        return self.__coulombs
+
+    # Property - What's the charge of each channel in amp hours?
+    @property
+    def amp_hours(self):
+        return [coulombs / 3600.0 for coulombs in self.__coulombs]
+
+    # Property - How much hydrogen has been used in moles?
+    @property
+    def moles(self):
+        return self.__moles
+
+    # Property - What's the efficiency of the fuel cell, the electrical
+    # energy out of the first channel over the energy in the hydrogen used?
+    @property
+    def efficiency(self):
+        if self.__moles <= 0.0:
+            return 0.0
+        return self.__joules[0] / (self.__moles * LHV)
@@ -0,0 +1,60 @@
+import json, pytest
+from energy import energy
+from timer.timer import Virtual_Clock
+
+
+def run(integrator, clock, ticks):
+    for t, power, current, flow in ticks:
+        clock.set(t)
+        integrator.update(power, current, flow)
+
+def test_trapezium_between_ticks():
+    clock = Virtual_Clock()
+    integrator = energy.Energy(1, clock)
+    
+    # Ramp from 0 to 100 W over 2 s is 100 J, at uneven ticks
+    run(integrator, clock, [(0.0, [0.0], [0.0], 0.0),
+                            (0.5, [25.0], [1.0], 0.001),
+                            (2.0, [100.0], [4.0], 0.001)])
+    
+    assert integrator.joules[0] == pytest.approx(100.0)
+    assert integrator.amp_hours[0] == pytest.approx(4.0 / 3600.0)
+    assert integrator.moles == pytest.approx(0.5 * 0.001 * 0.5 + 0.001 * 1.5)
+
+def test_errors_add_nothing_either_side():
+    clock = Virtual_Clock()
+    integrator = energy.Energy(1, clock)
+    
+    run(integrator, clock, [(0.0, [10.0], [1.0], 0.0),
+                            (1.0, [-1], [-1], -1),
+                            (2.0, [10.0], [1.0], 0.0),
+                            (3.0, [10.0], [1.0], 0.0)])
+    
+    assert integrator.joules[0] == pytest.approx(10.0)
+
+def test_efficiency():
+    clock = Virtual_Clock()
+    integrator = energy.Energy(1, clock)
+    
+    run(integrator, clock, [(0.0, [120.9], [0.0], 0.001),
+                            (10.0, [120.9], [0.0], 0.001)])
+    
+    # 1209 J from 0.01 mol of hydrogen
+    assert integrator.efficiency == pytest.approx(1209.0 / (0.01 * energy.LHV))
+
+def test_totals_survive_a_restart(tmp_path):
+    checkpoint = str(tmp_path / "energy.json")
+    clock = Virtual_Clock()
+    integrator = energy.Energy(1, clock, checkpoint, period=5.0)
+    
+    run(integrator, clock, [(t, [10.0], [1.0], 0.0) for t in range(7)])
+    
+    # Saved at 5 s
+    assert json.load(open(checkpoint))["joules"] == [50.0]
+    
+    integrator.save()
+    clock = Virtual_Clock(100.0)
+    restarted = energy.Energy(1, clock, checkpoint)
+    run(restarted, clock, [(100.0, [10.0], [1.0], 0.0), (101.0, [10.0], [1.0], 0.0)])
+    
+    assert restarted.joules[0] == pytest.approx(70.0)
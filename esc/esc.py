@@ -21,7 +21,7 @@
 
 # Import libraries
 from time import sleep
-from quick2wire.i2c import I2CMaster, writing_bytes
+from quick2wire.i2c import perform, writing_bytes, Transaction, PRIORITY_ACTUATOR
 
 
 # Define class
@@ -30,15 +30,16 @@ class esc:
     def __init__(self, address=0x2c):
         self.__address = address
         self.__throttle = 0
+        
+        # The throttle write, compiled once with the value updated in place
+        self.__write = Transaction(writing_bytes(address, 0))
 
     # Method to send throttle to Arduino
-    @staticmethod
-    def __set(address, value):
+    def __set(self, value):
+        self.__write.buffers[0][0] = value
         try:
-            # Using the I2C databus...
-            with I2CMaster(1) as master:
-                master.transaction(
-                    writing_bytes(address, value))
+            # Using the I2C databus, ahead of any sensor reads...
+            perform(self.__write, 1, PRIORITY_ACTUATOR)
                 
             # Return result
             return value
@@ -72,7 +73,7 @@ class esc:
 
         # Send the accepted throttle to the Arduino
         try:
-            self.__throttle = self.__set(self.__address, setpoint)
+            self.__throttle = self.__set(setpoint)
         
         # If that fails (disconnected) then ignore
         except Exception as e:
@@ -86,16 +87,16 @@ class esc:
         self.throttle = 0
 
         input("Disconnect ESC then press enter...")
-        self.__set(self.__address, 100)
+        self.__set(100)
         sleep(1)
 
         input("Connect ESC then press enter...")
         sleep(2)
-        self.__set(self.__address, 0)
+        self.__set(0)
         sleep(2)
-        self.__set(self.__address, 100)
+        self.__set(100)
         sleep(2)
-        self.__set(self.__address, 0)
+        self.__set(0)
 
         input("Calibration complete, press enter to continue...")
 
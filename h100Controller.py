@@ -21,13 +21,15 @@
 
 # Import libraries
 import sys, time
-import pifacedigitalio
+from collections import deque
+import numpy
 from hybrid import hybrid
 from adc import adcpi
 from temperature import tmp102
 from switch import switch
 from timer import timer
-from mfc import mfc
+from calibration import calibration
+from energy import energy
 
 
 # Function to mimic an 'enum'. Won't be needed after Python3.4 update
@@ -51,11 +53,11 @@ class PurgeControl():
         print("\nSelected purge strategy %s\n" % self.__user_purge)
         return
 
-    # Method to update the class data
-    def updateNow(self, v, i, p):
-        self.v = v
-        self.i = i
-        self.p = p        
+    # Method to update the class data from this tick's snapshot
+    def updateNow(self, snapshot):
+        self.v = snapshot.voltage[0]
+        self.i = snapshot.current[0]
+        self.p = snapshot.power[0]
 
     # Method to update the class' last data
     def updateLast(self):
@@ -100,9 +102,65 @@ class PurgeControl():
 
 
 # Define class
-class H100():
+class Snapshot():
+    # Everything the controller measured and decided in one tick. There is
+    # one per controller, made once and filled in place each tick, so the
+    # logger, display and purge controller all read the same tick's data
+    # without anything being allocated. Attributes are named as the H100
+    # properties so either can be read the same way
+    __slots__ = ['tick', 'time', 'state',
+                 'voltage', 'current', 'voltageHybrid', 'currentHybrid',
+                 'power', 'energy', 'temperature',
+                 'charge', 'hydrogen', 'efficiency',
+                 'flow_rate', 'flow_moles', 'purge_frequency', 'purge_time',
+                 'counts']
+
     # Code to run when class is created
-    def __init__(self, user_purge):
+    def __init__(self):
+        self.tick            = 0
+        self.time            = 0.0
+        self.state           = 'off'
+        self.voltage         = [0.0] * 3
+        self.current         = [0.0] * 3
+        self.voltageHybrid   = [0.0] * 3
+        self.currentHybrid   = [0.0] * 3
+        self.power           = [0.0] * 3
+        self.energy          = [0.0] * 3
+        self.temperature     = [0.0] * 6
+        self.charge          = [0.0] * 3
+        self.hydrogen        = 0.0
+        self.efficiency      = 0.0
+        self.flow_rate       = 0.0
+        self.flow_moles      = 0.0
+        self.purge_frequency = 0.0
+        self.purge_time      = 0.0
+        self.counts          = []
+
+
+#############################################################################
+
+
+# Define class
+class H100():
+    # Name of each raw ADC channel in the sweep, the last is the mass flow
+    # meter which gives both the flow rate and molar flow rate
+    CHANNELS = ('V_fc', 'V_b', 'V_out', 'I_fc', 'I_b', 'I_out',
+                'V_fc_h', 'V_b_h', 'V_out_h', 'I_fc_h', 'I_b_h', 'I_out_h', 'MFC')
+
+    # Code to run when class is created. The clock is shared with the rest
+    # of the control loop, which ticks it (see timer.Clock). Without one
+    # the controller has its own and ticks it each run. The energy totals
+    # are kept in the checkpoint file, if given, across restarts. Given a
+    # switch.Edge_Scheduler the timed outputs are fired by it on time
+    # rather than polled each run. Given the hybrid board's INT line as a
+    # gpio Pin its inputs are only read when they change
+    def __init__(self, user_purge, clock=None, table=None, checkpoint='', outputs=None, interrupt=None):
+        self.__tick = clock is None
+        self.__clock = clock = clock or timer.Clock()
+        
+        # Calibration for the raw ADC readings, by default from calibration/h100.json
+        self.__calibration = table or calibration.default('h100')
+        
         # Start the ADCPI
         self.__Adc1 = adcpi.MCP3424(0x6A)
         self.__Adc2 = adcpi.MCP3424(0x6B)
@@ -110,17 +168,29 @@ class H100():
         self.__Adc3 = adcpi.MCP3424(0x68)
         self.__Adc4 = adcpi.MCP3424(0x6C)
 
+        # Read all the ADC channels we need in one sweep of the four chips
+        self.__sweep = adcpi.Sweep((self.__Adc1, 0), # Voltage
+                                   (self.__Adc1, 2),
+                                   (self.__Adc2, 0),
+                                   (self.__Adc1, 1), # Current
+                                   (self.__Adc1, 3),
+                                   (self.__Adc2, 1),
+                                   (self.__Adc4, 2), # Hybrid voltage
+                                   (self.__Adc4, 0),
+                                   (self.__Adc4, 1),
+                                   (self.__Adc3, 2), # Hybrid current
+                                   (self.__Adc3, 0),
+                                   (self.__Adc3, 1),
+                                   (self.__Adc2, 0)) # Mass flow
+
         # Start the hybrid board
-        self.__hybrid = hybrid.Hybrid()
+        self.__hybrid = hybrid.Hybrid(interrupt)
 
         # Start temperature sensors
         self.__Temperature = tmp102.Tmp102()
 
-        # Start the mass flow controller
-        self.__Mfc = mfc.mfc()
-        
-        # Start timers
-        self.__timer = timer.My_Time()
+        # Start the energy, charge and hydrogen totals
+        self.__integrator = energy.Energy(3, clock, checkpoint)
 
         # Set start and stop duration
         self.__start_time = 3  # Seconds
@@ -144,8 +214,11 @@ class H100():
         self.__purge_frequency = 30
         self.__purge_time = 0.5
         
+        # Purge frequency forced by the user or a profile, zero is off
+        self.__purge_override = 0
+        
         # Set the current time
-        self.__time_change = time.time()
+        self.__time_change = self.__clock()
         
         # Start the piface for input switch functionality
 #        self.__pfio = pifacedigitalio.PiFaceDigital()
@@ -154,71 +227,110 @@ class H100():
                                                       
         # Define state
         self.STATE = enum(startup='startup', on='on', shutdown='shutdown', off='off', error='error')
+        STATE = self.STATE
+        
+        # Transition table, the new state for each state and event. The
+        # off switch always shuts down, even from off or error
+        self.__transitions = {(STATE.off,      'on'):      STATE.startup,
+                              (STATE.startup,  'timeout'): STATE.on,
+                              (STATE.shutdown, 'timeout'): STATE.off,
+                              (STATE.error,    'reset'):   STATE.off}
+        for state in (STATE.off, STATE.startup, STATE.on, STATE.shutdown, STATE.error):
+            self.__transitions[(state, 'off')] = STATE.shutdown
+            if state is not STATE.error:
+                self.__transitions[(state, 'fault')] = STATE.error
+        
+        # How long a state lasts before it times out
+        self.__timeouts = {STATE.startup:  self.__start_time,
+                           STATE.shutdown: self.__stop_time}
+        
+        # Routine run every tick in each state
+        self.__dispatch = {STATE.off:      self._state_off,
+                           STATE.startup:  self._state_startup,
+                           STATE.on:       self._state_on,
+                           STATE.shutdown: self._state_shutdown,
+                           STATE.error:    self._state_error}
+        
+        # Actions run once on entering or leaving a state
+        self.__entry = {STATE.on:  self._enter_on,
+                        STATE.off: self._enter_off}
+        self.__exit = {}
+        
+        # Recent transitions as (time, from, to, event)
+        self.__events = deque(maxlen=100)
 
         # Define output switches
-        self.__fan   = switch.Switch(self.__hybrid.fan_on,   self.__hybrid.fan_off)
-        self.__h2    = switch.Switch(self.__hybrid.h2_on,    self.__hybrid.h2_off)
-        self.__purge = switch.Switch(self.__hybrid.purge_on, self.__hybrid.purge_off)
-
-        # Define variables
-        self.__currentHybrid = [0.0] * 3
-        self.__voltageHybrid = [0.0] * 3
-        self.__current       = [0.0] * 3
-        self.__voltage       = [0.0] * 3
-        self.__power         = [0.0] * 3
-        self.__energy        = [0.0] * 3
-        self.__temperature   = [0.0] * 6
-        self.__flow_rate     = 0.0
-        self.__flow_moles    = 0.0
+        written = self.__hybrid.written
+        self.__fan   = switch.Switch(self.__hybrid.fan_on,   self.__hybrid.fan_off,   clock, outputs, written)
+        self.__h2    = switch.Switch(self.__hybrid.h2_on,    self.__hybrid.h2_off,    clock, outputs, written)
+        self.__purge = switch.Switch(self.__hybrid.purge_on, self.__hybrid.purge_off, clock, outputs, written)
+
+        # Define variables, the sensor data lives in the snapshot
+        self.__snapshot      = Snapshot()
+        self.__currentHybrid = self.__snapshot.currentHybrid
+        self.__voltageHybrid = self.__snapshot.voltageHybrid
+        self.__current       = self.__snapshot.current
+        self.__voltage       = self.__snapshot.voltage
+        self.__power         = self.__snapshot.power
+        self.__energy        = self.__snapshot.energy
+        self.__temperature   = self.__snapshot.temperature
         self.__state         = self.STATE.off
+        self.__snapshot.counts[:] = self.__sweep.counts
+
+        # Raw and calibrated ADC readings, reused every tick
+        self.__raw        = numpy.zeros(len(self.__sweep.counts))
+        self.__calibrated = numpy.zeros(len(self.__calibration.names))
 
         # Software switches
         self.__on    = 0
         self.__off   = 0
         self.__reset = 0
 
-        # State change flag
-        self.__state_change = 0
-
-    # Method to run the controller
-    def run(self):
-        # Update the hybrid
-        self.__hybrid.update()
-
-        # Update the timer
-        self.__timer.run()
-        
-        # Update the sensors
-        self._update_sensors()
+    # Method to run the controller. Given a record of recorded sensor
+    # data, that is used instead of the hardware (see sim.replay)
+    def run(self, record=None):
+        # Read the clock once for this tick if it is ours
+        if self.__tick:
+            self.__clock.tick()
+            
+        # Hold the hybrid board's output changes to write once this tick
+        self.__hybrid.begin()
+        try:
+            # Update the hybrid
+            if record is None:
+                self.__hybrid.update()
+
+            # Update the sensors
+            self._update_sensors(record)
+
+            # Have any timers changed?
+            self._check_timers()
+            
+            # Have any switches been pressed?
+            self._check_switches()
+            
+            # Have any errors occured?
+            self._check_errors()
 
-        # Have any timers changed?
-        self._check_timers()
-        
-        # Have any switches been pressed?
-        self._check_switches()
+            # STATE MACHINE, run the routine of the state we are in
+            self.__dispatch[self.__state]()
+            
+        # Write the outputs if they changed
+        finally:
+            self.__hybrid.flush()
         
-        # Have any errors occured?
-        self._check_errors()
-
-        # STATE MACHINE
-        if self.__state is self.STATE.off:
-            # Run the off method
-            self._state_off()
-        elif self.__state is self.STATE.on:
-            # Run the on method
-            self._state_on()
-        elif self.__state is self.STATE.startup:
-            # Run the startup method
-            self._state_startup()
-        elif self.__state is self.STATE.shutdown:
-            # Run the shutdown method
-            self._state_shutdown()
-        elif self.__state is self.STATE.error:
-            # Run the error method
-            self._state_error()
-
-        # Reset state change flag
-        self.__state_change = 0
+        # Finish this tick's snapshot
+        self._take_snapshot()
+
+    # Method to fill in the rest of the snapshot at the end of a tick
+    def _take_snapshot(self):
+        snapshot = self.__snapshot
+        snapshot.tick           += 1
+        snapshot.time            = self.__clock()
+        snapshot.state           = self.__state
+        snapshot.purge_frequency = self.__purge_frequency
+        snapshot.purge_time      = self.__purge_time
+        return snapshot
 
     # Method to shutdown
     def shutdown(self):
@@ -230,10 +342,14 @@ class H100():
         
         # Wait until turned off **blocking**
         while self.__state is not self.STATE.off:
+            self.__clock.tick()
             self.run()
 
         self.__hybrid.shutdown()
 
+        # Keep the energy totals
+        self.__integrator.save()
+
         # Deactivate user switches
 #        self._switch_interrupt.deactivate()
         
@@ -295,11 +411,55 @@ class H100():
     def energy(self):
         return self.__energy
 
+    # Property - What's the charge of each output in amp hours?
+    @property
+    def charge(self):
+        return self.__snapshot.charge
+
+    # Property - How much hydrogen has been used in moles?
+    @property
+    def hydrogen(self):
+        return self.__snapshot.hydrogen
+
+    # Property - What's the fuel cell efficiency so far?
+    @property
+    def efficiency(self):
+        return self.__snapshot.efficiency
+
     # Property - What's the temperature?
     @property
     def temperature(self):
         return self.__temperature
 
+    # Property - What calibration table is used?
+    @property
+    def calibration(self):
+        return self.__calibration
+
+    # Property - How many volts is one raw count of each channel?
+    @property
+    def lsb(self):
+        return self.__sweep.lsb
+
+    # Property - How long should the purge be, how long was the last, what's
+    # the worst error so far and how many edges couldn't be written?
+    @property
+    def purge_pulse(self):
+        return (self.__purge.pulse_commanded,
+                self.__purge.pulse_actual,
+                self.__purge.pulse_error_max,
+                self.__purge.edges_failed)
+
+    # Property - What were the recent state changes, as (time, from, to, event)?
+    @property
+    def transitions(self):
+        return self.__events
+
+    # Property - What happened in the last tick?
+    @property
+    def snapshot(self):
+        return self.__snapshot
+
     # Property - What's the purge frequency?
     @property
     def purge_frequency(self):
@@ -322,6 +482,16 @@ class H100():
         # Set new purge frequency
         self.__purge_frequency = purge_frequency
 
+    # Property - What's the purge frequency override?
+    @property
+    def purge_override(self):
+        return self.__purge_override
+
+    # Property - Override the purge controller, zero or less hands back control
+    @purge_override.setter
+    def purge_override(self, purge_frequency):
+        self.__purge_override = max(purge_frequency, 0)
+
     # Property - What's the purge duration?
     @property
     def purge_time(self):
@@ -333,12 +503,29 @@ class H100():
         if 0 < purge_time < 10:  # TODO max purge time
             self.__purge_time = purge_time
 
-    # Method to change state
-    def _state_change(self, state):
-        # Check if we want to change state and that we haven't already changed
-        if state and not self.__state_change:
-            self.__time_change = time.time()  # Update timer
-            self.__state_change = 1
+    # Method to handle an event, changing state if the transition table
+    # has one for this state
+    def _event(self, event):
+        state = self.__transitions.get((self.__state, event))
+        if state is None:
+            return 0
+            
+        # Leave the old state
+        action = self.__exit.get(self.__state)
+        if action:
+            action()
+            
+        # Remember when and why the state changed
+        self.__time_change = self.__clock()
+        self.__events.append((self.__time_change, self.__state, state, event))
+        self.__state = state
+        
+        # Enter the new state
+        action = self.__entry.get(state)
+        if action:
+            action()
+            
+        return 1
 
     # Method to switch on
     def _switch_on(self):
@@ -362,6 +549,16 @@ class H100():
     ##############
     #  ROUTINES  #
     ##############
+    # Entering On
+    def _enter_on(self):
+        # Tell the user the fuel cell is now on
+        print('FC On\n')
+
+    # Entering Off
+    def _enter_off(self):
+        # Tell the user the fuel cell is now off
+        print('FC Off\n')
+
     # State Off Routine
     def _state_off(self):
 #       self._purge_controller() # not needed #
@@ -402,12 +599,12 @@ class H100():
     # Property - What's the mass flow rate?
     @property
     def flow_rate(self):
-        return self.__flow_rate
+        return self.__snapshot.flow_rate
 
     # Property - What's the mass flow rate?
     @property
     def flow_moles(self):
-        return self.__flow_moles
+        return self.__snapshot.flow_moles
 
     ##############
     #INT. GETTERS#
@@ -438,139 +635,33 @@ class H100():
                 voltage[x] = abs(voltage[x] * 1000 / 60.7) - 0.096
         return voltage
 
-    # Method to get Current
-    @staticmethod
-    def _get_current(adc, channel):
-        # Get current and calibrate
-        current = abs(adc.get(channel) * 1000 / 6.89) * 1.075
-        if current > 1000.0: current = 0.0 #TODO
-        
-        # Sensor only valid above a certain value
-#        if current < 0.475:  # TODO can this be improved?
-#            current = 0  # Account for opamp validity
-            
-        return current
-
-    # method to get Voltage
-    @staticmethod
-    def _get_voltage(adc, channel):
-        voltage = abs(adc.get(channel) * 1000 / 60.7)
-        if voltage > 1000.0: voltage = 0.0 #TODO
-        return voltage
-
-    # Method to get Current
-    @staticmethod
-    def _get_current2(adc, channel):
-        # Get current and calibrate
-        current = abs(adc.get(channel))# * 1000 / 1)
-        if current > 1000.0: current = 0.0 #TODO
-        
-        # Sensor only valid above a certain value
-#        if current < 0.475:  # TODO can this be improved?
-#            current = 0  # Account for opamp validity
-            
-        return current
-
-    # method to get Voltage
-    @staticmethod
-    def _get_voltage2(adc, channel):
-        voltage = abs(adc.get(channel))# * 1000.0 / 186.0) - 0.096
-        if voltage > 1000.0: voltage = 0.0 #TODO
-        return voltage
-
-    # Method to get Energy
-    @staticmethod
-    def _get_energy(my_timer, power):
-        # Energy is power x time
-        energy = my_timer.delta * power
-        return energy
-
     # Method to get Temperature
     @staticmethod
-    def _get_temperature(Hybrid, temperature):
-        t = [Hybrid.t1,
-             Hybrid.t2,
-             temperature.get(0x48),
-             temperature.get(0x49),
-             temperature.get(0x4a),
-             temperature.get(0x4b)]
+    def _get_temperature(Hybrid, temperature, t):
+        t[0] = Hybrid.t1
+        t[1] = Hybrid.t2
+        t[2] = temperature.get(0x48)
+        t[3] = temperature.get(0x49)
+        t[4] = temperature.get(0x4a)
+        t[5] = temperature.get(0x4b)
         return t
 
-    # Method to get mass flow rate
-    @staticmethod
-    def _getFlowRate(mfc, adc, ch):
-        return mfc.get(adc, ch)
-        
-    # Method to get mass flow rate
-    @staticmethod
-    def _getFlowMoles(mfc, adc, ch):
-        return mfc.getMoles(adc, ch)
-        
     # Method to check if any timers have expired
     def _check_timers(self):
-        # Calculate time since last state change
-        delta = time.time() - self.__time_change
-        
-        # If currently in startup...
-        if self.__state is self.STATE.startup:
-            
-            # and we have expired the startup duration...
-            if delta >= self.__start_time:
-                # Change state to on
-                self.__state = self.STATE.on
-                self._state_change(True)
-                
-                # Tell the user the fuel cell is now on
-                print('FC On\n')
-                
-        # or if we are in shutdown...
-        elif self.__state is self.STATE.shutdown:
-            
-            # and we have expired the shutdown duration...
-            if delta >= self.__stop_time:
-                # # Change state to off
-                self.__state = self.STATE.off
-                self._state_change(True)
-                
-                # Tell the user the fuel cell is now off
-                print('FC Off\n')
+        # If this state times out and has been on long enough...
+        timeout = self.__timeouts.get(self.__state)
+        if timeout and self.__clock() - self.__time_change >= timeout:
+            self._event('timeout')
 
     # Method to check if any software switches have been activated
     def _check_switches(self):
-        # If the on switch has been triggered...
+        # Only one switch is handled, on then off then reset
         if self.__on:
-            
-            # and we are currently off...
-            if self.__state is self.STATE.off:
-                # Change state to startup
-                self.__state = self.STATE.startup
-                
-                # Flag that there has been a state change
-                self._state_change(True)
-                
-        # or the off switch has been triggered...
+            self._event('on')
         elif self.__off:
-            
-            # and we are currently no off or in error...
-            if (self.__state is not self.STATE.off) or (self.__state is not self.STATE.error):
-                
-                # Change state to shutdown
-                self.__state = self.STATE.shutdown
-                
-                # Flag that there has been a state change
-                self._state_change(True)
-                
-        # or the reset switch has been triggered...     
+            self._event('off')
         elif self.__reset:
-            
-            # and we are currently in error...
-            if self.__state is self.STATE.error:
-                
-                # Clear the error by setting state to off
-                self.__state = self.STATE.off
-                
-                # Flag that there has been a state change
-                self._state_change(True)
+            self._event('reset')
         
         # Clear all state change request flags
         self.__on = 0
@@ -581,20 +672,14 @@ class H100():
     def _check_errors(self):
         # If the temperature is above the cutoff...
         if max(self.__temperature) > self.__cutoff_temperature:
-            
-            # Change state to error
-            self.__state = self.STATE.error
-            self._state_change(True)
+            self._event('fault')
             
             # Tell user there is a temperature error
             print(time.asctime() + ' ' + "TEMPERATURE CUTOFF")
             
         # If the voltage is too high...
         if self.__voltage[0] > self.__maximum_voltage:
-            
-            # Change state to error
-            self.__state = self.STATE.error
-            self._state_change(True)
+            self._event('fault')
             
             # Tell user there is an overvoltage error
             print(time.asctime() + ' ' + "VOLTAGE MAXIMUM CUTOFF")
@@ -603,69 +688,76 @@ class H100():
 #        if self.__voltage[0] < self.__minimum_voltage:
 #
 #            # Change state to error
-#            self.__state = self.STATE.error
-#            self._state_change(True)
+#            self._event('fault')
 #            
 #            # Tell user there is an undervoltage error
 #            sys.stderr.write(time.asctime() + ' ' + "VOLTAGE MINIMUM CUTOFF")
 
     # Method to update sensor data
-    def _update_sensors(self):
-        # ADC
-        self.__voltage[0] = self._get_voltage(self.__Adc1, 0)
-        self.__voltage[1] = self._get_voltage(self.__Adc1, 2)
-        self.__voltage[2] = self._get_voltage(self.__Adc2, 0)
-        self.__current[0] = self._get_current(self.__Adc1, 1)
-        self.__current[1] = self._get_current(self.__Adc1, 3)
-        self.__current[2] = self._get_current(self.__Adc2, 1)
-
-        self.__voltageHybrid[0] = self._get_voltage2(self.__Adc4, 2)
-        self.__voltageHybrid[1] = self._get_voltage2(self.__Adc4, 0)
-        self.__voltageHybrid[2] = self._get_voltage2(self.__Adc4, 1)
-        self.__currentHybrid[0] = self._get_current2(self.__Adc3, 2)
-        self.__currentHybrid[1] = self._get_current2(self.__Adc3, 0)
-        self.__currentHybrid[2] = self._get_current2(self.__Adc3, 1)
-
-        self.__flow_rate  = self._getFlowRate(self.__Mfc, self.__Adc2, 0)
-        self.__flow_moles = self._getFlowMoles(self.__Mfc, self.__Adc2, 0)
-
-        self.__temperature = self._get_temperature(self.__hybrid, self.__Temperature)
-
-        return
-        # HYBRID
-#        self.__voltageHybrid = self._get_voltageHybrid(self.__hybrid)
-#        self.__currentHybrid = self._get_currentHybrid(self.__hybrid)
-
-        # Power FC
-        if self.__voltage[0] >=0.0 and  self.__current[1] >=0.0:
-            self.__power[0] = self.__voltage[0] * self.__current[1]
-        else:
-            self.__power[0] = -1
-
-        # Power Batt
-        if self.__voltage[1] >=0.0 and  self.__current[2] >=0.0:
-            self.__power[1] = self.__voltage[1] * self.__current[2]
-        else:
-            self.__power[1] = -1
-
-        # Power Out
-        if self.__voltage[2] >=0.0 and  self.__current[4] >=0.0:
-            self.__power[2] = self.__voltage[2] * self.__current[4]
+    def _update_sensors(self, record=None):
+        # Replay recorded data
+        if record is not None:
+            self._replay_sensors(record)
         else:
-            self.__power[2] = -1
+            self._read_sensors()
 
+        # Power of each output, -1 if either reading is an error
         for x in range(3):
-            energy = self._get_energy(self.__timer, self.__power[x])
-            self.__energy[x] += energy # Cumulative
-
+            if self.__voltage[x] >= 0.0 and self.__current[x] >= 0.0:
+                self.__power[x] = self.__voltage[x] * self.__current[x]
+            else:
+                self.__power[x] = -1
+
+        # Add this tick to the energy, charge and hydrogen totals
+        integrator = self.__integrator
+        integrator.update(self.__power, self.__current, self.__snapshot.flow_moles)
+        
+        self.__energy[:] = integrator.joules
+        charge, coulombs = self.__snapshot.charge, integrator.coulombs
+        for x in range(len(charge)):
+            charge[x] = coulombs[x] / 3600.0
+        self.__snapshot.hydrogen = integrator.moles
+        self.__snapshot.efficiency = integrator.efficiency
+
+    # Method to read the sensors
+    def _read_sensors(self):
+        # ADC, calibrated all at once into the same arrays every tick
+        self.__raw[:] = self.__sweep.run()
+        self.__calibration.apply(self.__raw, self.__calibrated)
+        self.__snapshot.counts[:] = self.__sweep.counts
         
+        item = self.__calibrated.item
+        for x in range(3):
+            self.__voltage[x]       = item(x)
+            self.__current[x]       = item(x + 3)
+            self.__voltageHybrid[x] = item(x + 6)
+            self.__currentHybrid[x] = item(x + 9)
+
+        self.__snapshot.flow_rate  = item(12)
+        self.__snapshot.flow_moles = item(13)
+
+        self._get_temperature(self.__hybrid, self.__Temperature, self.__temperature)
+
+    # Method to take sensor data from a recorded log rather than the hardware
+    def _replay_sensors(self, record):
+        self.__voltage[:]       = record.voltage
+        self.__current[:]       = record.current
+        self.__voltageHybrid[:] = record.voltageHybrid
+        self.__currentHybrid[:] = record.currentHybrid
+        self.__temperature[:]   = record.temperature
+        self.__snapshot.flow_rate  = record.flow_rate
+        self.__snapshot.flow_moles = record.flow_moles
+
     # Method to run the purge controller
     def _purge_controller(self):
         # Update the purge controller sensor data
-        self.__Purge_Controller.updateNow(self.__voltage[0], self.__current[0], self.__power[0])
+        self.__Purge_Controller.updateNow(self.__snapshot)
         
-        # Pick one of these four controllers
-        self.purge_frequency = self.__Purge_Controller.getPurgeFreq()
+        # Pick one of these four controllers, unless overridden
+        if self.__purge_override:
+            self.purge_frequency = self.__purge_override
+        else:
+            self.purge_frequency = self.__Purge_Controller.getPurgeFreq()
 
         # Print results
 #        print('Freq: ',self.purge_frequency,'  Time: ',self.purge_time)
@@ -3,20 +3,51 @@
 
 # Must call the update method on each loop of the main code
 
-import sys
+import sys, threading, time
+import numpy
 sys.path.append("..") # Adds higher directory to python modules path.
 import quick2wire.i2c as i2c
-from adc.adcpi import MCP3424
+from quick2wire.selector import Selector, PRIORITY_INPUT, ERROR
+from adc.adcpi import MCP3424, Sweep
+from calibration import calibration
 
 class HybridIo:
-    def __init__(self):
+    # Outputs are set in a shadow of the output register. Outside a batch
+    # a change is written straight away, but between begin() and flush()
+    # every change made by that thread is held and written as one, and
+    # nothing is written if the outputs end up as they were. Callbacks
+    # given to written() are called by flush() with the time.monotonic()
+    # the held changes landed, or straight away if nothing is held. They
+    # are called outside the lock so they may take locks of their own.
+    #
+    # The expander pulls its INT line low when an input changes, until the
+    # inputs are read. Given that line as a quick2wire.gpio.Pin (falling
+    # edge) the inputs are only read again when it has fired, or after
+    # poll seconds in case an edge was missed. Without one, or if the pin
+    # can't be opened, the inputs are read every update
+    def __init__(self, interrupt=None, poll=1.0):
         self.__address = 0x20
+        self.__interrupt = None
+        self.__selector = None
+        self.__poll = poll
+        self.__read_time = None
+        self.__reads = 0
+        self.__skipped = 0
         
-        self.__bit_register       = [0b01000100, 0b00000000]
+        self.__bit_register       = bytearray([0b01000100, 0b00000000]) # Last read
         self.__direction_register = [0b00011100, 0b00000000] # Output is 0, input is 1
+        self.__output             = [0b01000100, 0b00000000] # Shadow
+        self.__written            = None                     # Last written
+        self.__lock               = threading.RLock()
+        self.__batch              = None
+        self.__writes             = 0
+        self.__landed             = []
+        self.__written_time       = None
+        self.__input_read         = i2c.Transaction(*self.input_messages())
+        self.__output_write       = i2c.Transaction(i2c.writing(self.__address, [2, 0, 0]))
 
         try:
-            with i2c.I2CMaster(1) as bus:
+            with i2c.shared_master(1) as bus:
                 bus.transaction(
                     i2c.writing(self.__address, [6, self.__direction_register[0], self.__direction_register[1]]))
         except IOError:
@@ -25,6 +56,17 @@ class HybridIo:
 
         self.change_output()
 
+        # Watch the INT line if there is one
+        if interrupt is not None:
+            try:
+                interrupt.open()
+                self.__selector = Selector()
+                self.__selector.add(interrupt, getattr(interrupt, '__events__', PRIORITY_INPUT | ERROR))
+                self.__interrupt = interrupt
+            except (IOError, OSError):
+                print("Err: No hybridIO interrupt, polling the inputs")
+                self.__selector = None
+
 
         # IO register. > means output, < means input.
         # Port 0:       Port 1:
@@ -38,16 +80,72 @@ class HybridIo:
         # 7: <CHG       GND>
         
     def update(self):
-        try:
-            with i2c.I2CMaster(1) as bus:
-                data = bus.transaction(
-                        i2c.writing_bytes(self.__address, 0),
-                        i2c.reading(self.__address, 2))[0]
-            self.__bit_register = data
+        now = time.monotonic()
+        
+        # The inputs haven't changed since they were last read
+        if (self.__selector is not None and self.__read_time is not None
+                and now - self.__read_time < self.__poll and not self._changed()):
+            self.__skipped += 1
             return self.__bit_register
+            
+        try:
+            data = i2c.perform(self.__input_read, 1)
         except IOError:
  #           print("Err: No hybridIO detected")
+            data = None
+            
+        return self.inputs(data)
+
+    # Method to get the messages that read the inputs, to be sent in a
+    # batch with other devices' messages (see quick2wire.i2c.Batch)
+    def input_messages(self):
+        return [i2c.writing_bytes(self.__address, 0),
+                i2c.reading(self.__address, 2)]
+
+    # Method called with the inputs read. They are copied as the buffer
+    # they were read into is reused
+    def inputs(self, results):
+        if results is None:
+            self.__read_time = None
             return -1
+            
+        self.__bit_register[:] = results[0]
+        self.__read_time = time.monotonic()
+        self.__reads += 1
+        return self.__bit_register
+
+    # Method to check for INT edges since the last look, reading the pin
+    # to clear each one
+    def _changed(self):
+        changed = False
+        while True:
+            self.__selector.wait(0)
+            if self.__selector.ready is None:
+                return changed
+            self.__interrupt.get()
+            changed = True
+
+    # Method to stop watching the INT line
+    def close(self):
+        if self.__selector is not None:
+            self.__selector.close()
+            self.__interrupt.close()
+            self.__selector = None
+
+    # Property - Are the inputs read every update, rather than on INT?
+    @property
+    def polled(self):
+        return self.__selector is None
+
+    # Property - How many times have the inputs been read?
+    @property
+    def reads(self):
+        return self.__reads
+
+    # Property - How many updates didn't need to read the inputs?
+    @property
+    def skipped(self):
+        return self.__skipped
 
     def get_charger_state_string(self):
         x = "Chg: "
@@ -65,33 +163,54 @@ class HybridIo:
         else: x += "4.1V/cell "
         return x
 
+    # Method to hold output changes made by this thread until flush()
+    def begin(self):
+        self.__batch = threading.get_ident()
+
+    # Method to end a batch, writing the outputs if they have changed
+    def flush(self):
+        with self.__lock:
+            self.__batch = None
+            result, now = self.__output, time.monotonic()
+            if self.__output != self.__written:
+                result, now = self.change_output(), self.__written_time
+                
+            # Held changes have landed, unless the write failed
+            landed = []
+            if result != -1:
+                landed, self.__landed = self.__landed, []
+                
+        for callback in landed:
+            callback(now)
+        return result
+
     @property
     def power1(self):
-        return self._get_bit(self.bit_register[1], 0)
+        return self._get_bit(self.__output[1], 0)
     @power1.setter
     def power1(self, state):
         self.bit_register = [1, 0, state]
     @property
     def power2(self):
-        return self._get_bit(self.bit_register[1], 1)
+        return self._get_bit(self.__output[1], 1)
     @power2.setter
     def power2(self, state):
         self.bit_register = [1, 1, state]
     @property
     def power3(self):
-        return self._get_bit(self.bit_register[1], 2)
+        return self._get_bit(self.__output[1], 2)
     @power3.setter
     def power3(self, state):
         self.bit_register = [1, 2, state]
     @property
     def power4(self):
-        return self._get_bit(self.bit_register[1], 3)
+        return self._get_bit(self.__output[1], 3)
     @power4.setter
     def power4(self, state):
         self.bit_register = [1, 3, state]
     @property
     def power5(self):
-        return self._get_bit(self.bit_register[1], 4)
+        return self._get_bit(self.__output[1], 4)
     @power5.setter
     def power5(self, state):
         self.bit_register = [1, 4, state]
@@ -99,7 +218,7 @@ class HybridIo:
     @property
     def SHDN(self):
         # High is shutdown, low is OK to start charging
-        return self._get_bit(self.bit_register[0], 5)
+        return self._get_bit(self.__output[0], 5)
     @SHDN.setter
     def SHDN(self, state):
         # High is shutdown, low is OK to start charging
@@ -107,7 +226,7 @@ class HybridIo:
     @property
     def CELLS(self):
         # High is 4cell, low is 3cell
-        return self._get_bit(self.bit_register[0], 0)
+        return self._get_bit(self.__output[0], 0)
     @CELLS.setter
     def CELLS(self, state):
         # High is 4cell, low is 3cell
@@ -115,7 +234,7 @@ class HybridIo:
     @property
     def CHEM(self):
         # High is 4.2v/cell, low is 4.1v/cell
-        return self._get_bit(self.bit_register[0], 1)
+        return self._get_bit(self.__output[0], 1)
     @CHEM.setter
     def CHEM(self, state):
         # High is 4.2v/cell, low is 4.1v/cell
@@ -143,7 +262,9 @@ class HybridIo:
        
     @property
     def bit_register(self):
-        return self.__bit_register
+        # Inputs as last read, outputs as set
+        return [(self.__bit_register[x] & self.__direction_register[x])
+                | (self.__output[x] & ~self.__direction_register[x] & 0xFF) for x in range(2)]
     @bit_register.setter
     def bit_register(self, data):#port, bit, state):
         try:
@@ -151,40 +272,61 @@ class HybridIo:
         except ValueError:
             raise ValueError("Invalid HybridIO register command")
         else:
-            if state is 1:
-                # Set bit high
-                if port is 0:
-                    self.__bit_register = [self.__bit_register[0] | (1 << bit), self.__bit_register[1]]
-                elif port is 1:
-                    self.__bit_register = [self.__bit_register[0], self.__bit_register[1] | (1 << bit)]
-                else:
-                    print("Bad port request")
-            elif state is 0:
-                if bool( (self.__bit_register[port] >> bit) & 0b00000001) is True:
-                    # Set bit low
-                    if port is 0:
-                        self.__bit_register = [self.__bit_register[0] ^ (1 << bit), self.__bit_register[1]]
-                    elif port is 1:
-                        self.__bit_register = [self.__bit_register[0], self.__bit_register[1] ^ (1 << bit)]
-                    else:
-                        print("Bad port request")
-                else:
-                    # Bit already set
-                    return
-            else:
+            if port not in (0, 1):
+                print("Bad port request")
+                return
+            if state not in (0, 1):
                 # State must be 1 or 0
                 print("Error in bit register setter")
-            self.change_output()
+                return
+                
+            with self.__lock:
+                if state:
+                    self.__output[port] |= 1 << bit
+                else:
+                    self.__output[port] &= ~(1 << bit) & 0xFF
+                    
+                # Write now unless this thread is batching
+                if self.__batch != threading.get_ident() and self.__output != self.__written:
+                    self.change_output()
 
     def change_output(self):
-        try:
-            with i2c.I2CMaster(1) as bus:
-                bus.transaction(
-                    i2c.writing(self.__address, bytearray([2, self.__bit_register[0], self.__bit_register[1]])))
-            return self.__bit_register
-        except IOError:
-#            print("Err: No hybridIO detected")
+        with self.__lock:
+            try:
+                # Ahead of any sensor reads waiting for the bus
+                write = self.__output_write.buffers[0]
+                write[1], write[2] = self.__output[0], self.__output[1]
+                i2c.perform(self.__output_write, 1, i2c.PRIORITY_ACTUATOR)
+                self.__written = list(self.__output)
+                self.__writes += 1
+                self.__written_time = time.monotonic()
+                return self.__written
+            except IOError:
+#                print("Err: No hybridIO detected")
+                return -1
+
+    # Property - Have the outputs as set been written, or are they held for
+    # this thread's flush? -1 if a write failed
+    @property
+    def applied(self):
+        with self.__lock:
+            if self.__output == self.__written or self.__batch == threading.get_ident():
+                return 1
             return -1
+
+    # Method to call callback with the time the outputs as set landed. If
+    # they are held it waits for a flush that writes them
+    def written(self, callback):
+        with self.__lock:
+            if self.__batch == threading.get_ident():
+                self.__landed.append(callback)
+                return
+        callback(time.monotonic())
+
+    # Property - How many times have the outputs been written?
+    @property
+    def writes(self):
+        return self.__writes
         
     @staticmethod
     def _get_bit(register, bit):
@@ -196,6 +338,7 @@ class Charge_Controller:
     def __init__(self):
         self.__address = 0x2F
         self.__current = 0.0
+        self.__write   = i2c.Transaction(i2c.writing_bytes(self.__address, 0))
         self.current   = 0.0
 
     @staticmethod
@@ -213,19 +356,16 @@ class Charge_Controller:
         if (cur > 4.0 or cur < 0.0):
             raise ValueError
         else:
-            if self.__changecurrent([self.__address,
-                                     self.current_to_hex(cur)]) >= 0:
+            if self.__changecurrent(self.current_to_hex(cur)) >= 0:
                 self.__current = cur
             
     # Method to change the I2C POT resistance
-    @staticmethod
-    def __changecurrent(config):
+    def __changecurrent(self, value):
+        self.__write.buffers[0][0] = value
         try:
             # Using the I2C databus...
-            with i2c.I2CMaster(1) as master:
-                master.transaction(
-                    i2c.writing_bytes(config[0], config[1]))
-            return config[1]
+            i2c.perform(self.__write, 1, i2c.PRIORITY_ACTUATOR)
+            return value
                     
         # If I2C error return
         except IOError:
@@ -233,13 +373,18 @@ class Charge_Controller:
             return -1
 
 class Adc:
-    def __init__(self, res=12):
+    def __init__(self, res=12, table=None):
         self.__adc1 = MCP3424(0x68, res)
         self.__adc2 = MCP3424(0x6C, res)
 
-        self.__voltage_scale   = 5.458;
-        self.__charge_i_scale  = 1 / 33.36 / 0.025
-        self.__fc_i_scale      = -220.0 / 40.21 / 0.01
+        # Both chips convert at once
+        self.__sweep = Sweep((self.__adc1, 0), (self.__adc1, 1, 8), (self.__adc1, 2), (self.__adc1, 3),
+                             (self.__adc2, 0), (self.__adc2, 1),    (self.__adc2, 2), (self.__adc2, 3))
+
+        # Calibration, by default from calibration/h100.json
+        self.__calibration = table or calibration.default('hybrid')
+        self.__raw         = numpy.zeros(8)
+        self.__calibrated  = numpy.zeros(len(self.__calibration.names))
 
         self.__t1              = 0.0
         self.__t2              = 0.0
@@ -252,21 +397,25 @@ class Adc:
         
         self.update()
         
+    # Read other devices with the ADCs (see adcpi.Sweep.attach)
+    def attach(self, messages, callback):
+        self.__sweep.attach(messages, callback)
+
     def update(self):
-        # ADC 1
-        self.__charge_current  = self.__adc1.get(0) #* self.__charge_i_scale
-        self.__output_current  = self.__adc1.get(1,8)# - 5.1 # * 0.0267 # Must subtract Vcc/2 scaled
-        self.__fc_current      = (self.__adc1.get(2) * 3.817)# - 2.04) / -0.0157
-        self.__t1              = self.__adc1.get(3)
+        self.__raw[:] = self.__sweep.run()
+        item = self.__calibration.apply(self.__raw, self.__calibrated).item
+        
+        self.__charge_current  = item(0)
+        self.__output_current  = item(1)
+        self.__fc_current      = item(2)
+        self.__t1              = item(3)
+        self.__battery_voltage = item(4)
+        self.__output_voltage  = item(5)
+        self.__fc_voltage      = item(6)
+        self.__t2              = item(7)
 
 #        print(str(self.__fc_current)[:5] + ' ' + str(self.__charge_current)[:5] + ' ' + str(self.__output_current)[:5])
 
-        # ADC 2
-        self.__battery_voltage = self.__adc2.get(0) * self.__voltage_scale
-        self.__output_voltage  = self.__adc2.get(1) * self.__voltage_scale
-        self.__fc_voltage      = self.__adc2.get(2) * self.__voltage_scale
-        self.__t2              = self.__adc2.get(3) * self.__voltage_scale
-
 #        if self.__battery_voltage >= 0.0: self.__battery_voltage *= self.__voltage_scale
 #        if self.__output_voltage >= 0.0:  self.__output_voltage  *= self.__voltage_scale
 #        if self.__fc_voltage >= 0.0:      self.__fc_voltage      *= self.__voltage_scale_fc
@@ -300,9 +449,14 @@ class Adc:
         return self.__t2
 
 class Hybrid:
-    def __init__(self):
-        self.__io      = HybridIo()
+    def __init__(self, interrupt=None):
+        self.__io      = HybridIo(interrupt)
         self.__adc     = Adc()
+        
+        # Without INT the inputs are read every update, in the same ioctl
+        # as the first of the ADC conversions
+        if self.__io.polled:
+            self.__adc.attach(self.__io.input_messages(), self.__io.inputs)
         self.__charger = Charge_Controller()
         self.__charger.current = 1.0 # Probably not needed
         self.__charger_state = False
@@ -313,10 +467,18 @@ class Hybrid:
 
     def shutdown(self):
         self.__io.SHDN = 1
+
+    # Hold output changes until flush(), to write them once per tick
+    def begin(self):
+        self.__io.begin()
+    def flush(self):
+        return self.__io.flush()
+    def written(self, callback):
+        self.__io.written(callback)
         
     def update(self):
-        # Input/Outputs
-        if not self.__io.update(): return -1
+        # Input/Outputs, unless they are read with the ADCs
+        if not self.__io.polled and not self.__io.update(): return -1
         # ADCs
         self.__adc.update()
 
@@ -348,12 +510,13 @@ class Hybrid:
 
 #        print(self.charger_state)
         
-    def fan_on(self):    self.__io.power1 = 1
-    def fan_off(self):   self.__io.power1 = 0
-    def h2_on(self):     self.__io.power2 = 1
-    def h2_off(self):    self.__io.power2 = 0
-    def purge_on(self):  self.__io.power3 = 1
-    def purge_off(self): self.__io.power3 = 0
+    # Output switches, each returns -1 if the change couldn't be written
+    def fan_on(self):    self.__io.power1 = 1; return self.__io.applied
+    def fan_off(self):   self.__io.power1 = 0; return self.__io.applied
+    def h2_on(self):     self.__io.power2 = 1; return self.__io.applied
+    def h2_off(self):    self.__io.power2 = 0; return self.__io.applied
+    def purge_on(self):  self.__io.power3 = 1; return self.__io.applied
+    def purge_off(self): self.__io.power3 = 0; return self.__io.applied
         
     # Turn charger on/off
     @property
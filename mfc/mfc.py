@@ -21,6 +21,7 @@
 
 # Import libraries
 from time import sleep
+from calibration import calibration
 #from quick2wire.i2c import I2CMaster, reading
 
 # Define class
@@ -29,13 +30,20 @@ class mfc:
     def _getRaw(fun, ch):
         return fun.get(ch)
 
+    # Method to convert a raw reading to a flow rate (calibration/h100.json)
+    @staticmethod
+    def rate(raw):
+        return calibration.default('h100').apply_one('MFC_flow', raw)
+
+    # Method to convert a raw reading to a molar flow rate
+    # TODO should be *125.718/134.82 (density H2 at 1.5bar)
+    def moles(self, raw):
+        return calibration.default('h100').apply_one('MFC_mol', raw)
+
     # External getter
     def get(self, fun, ch):
-        raw = self._getRaw(fun, ch)
-        rate = raw/5.0*1.5 
-        return rate
+        return self.rate(self._getRaw(fun, ch))
 
     # External getter
     def getMoles(self, fun, ch):
-        rate = self.get(fun,ch)*(7.0/6280.0)  # TODO should be *125.718/134.82 (density H2 at 1.5bar)
-        return rate
+        return self.moles(self._getRaw(fun, ch))
@@ -1,5 +1,9 @@
 import sys
-from ctypes import create_string_buffer, sizeof, string_at
+import threading
+import errno
+import heapq
+import time
+from ctypes import create_string_buffer, sizeof, string_at, cast, POINTER, c_ubyte
 
 import posix
 from fcntl import ioctl
@@ -79,6 +83,565 @@ class I2CMaster(object):
 
         return [i2c_msg_to_bytes(m) for m in msgs if (m.flags & I2C_M_RD)]
 
+    def perform(self, transaction):
+        """
+        Perform a precompiled I2C I/O transaction.
+
+        Nothing is allocated: the transaction's message array is handed
+        straight to the kernel, which reads into its buffers.
+
+        Arguments:
+        transaction -- a Transaction.
+
+        Returns: the transaction's results, a memoryview for each read
+                 operation performed.
+        """
+        ioctl(self.fd, I2C_RDWR, transaction.ioctl_arg)
+        return transaction.results
+
+
+class SharedI2CMaster(I2CMaster):
+    """A long-lived, lock-protected I2CMaster shared by every driver on a bus.
+
+    Shared masters are not created directly but obtained from the
+    shared_master function, which hands out one instance per bus
+    number for the lifetime of the process.  The bus device is opened
+    once, on first use, instead of once per transaction.
+
+    Used in a with statement, a SharedI2CMaster holds its lock for
+    the duration of the block rather than closing the bus at the end
+    of it, so a driver can perform several dependent transactions
+    without another thread's messages being interleaved.  Single
+    calls to transaction are always performed under the lock.
+
+    For example:
+
+        from quick2wire.i2c import shared_master, writing
+
+        with shared_master(1) as i2c:
+            i2c.transaction(
+                writing(0x20, bytes([0x01, 0xFF])))
+    """
+
+    def __init__(self, n=default_bus, extra_open_flags=0):
+        """Creates a shared master for a bus without opening the device.
+
+        Arguments:
+        n                -- the number of the bus.
+        extra_open_flags -- extra flags passed to posix.open when
+                            the I2C bus device file is opened.
+        """
+        self.n = n
+        self.fd = None
+        self._extra_open_flags = extra_open_flags
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+    def open(self):
+        """Opens the bus device if it is not already open.
+
+        Raises:
+        IOError -- the bus device could not be opened.
+        """
+        with self._lock:
+            if self.fd is None:
+                self.fd = posix.open("/dev/i2c-%i" % self.n, posix.O_RDWR | self._extra_open_flags)
+
+    def close(self):
+        """
+        Closes the I2C bus device.  It is reopened on the next transaction.
+        """
+        with self._lock:
+            if self.fd is not None:
+                posix.close(self.fd)
+                self.fd = None
+
+    def transaction(self, *msgs):
+        """
+        Perform an I2C I/O transaction while holding the bus lock.
+
+        Arguments:
+        *msgs -- I2C messages created by one of the reading, reading_into,
+                 writing or writing_bytes functions.
+
+        Returns: a list of byte sequences, one for each read operation
+                 performed.
+
+        Raises:
+        IOError -- the bus device could not be opened or the transfer failed.
+        """
+        with self._lock:
+            self.open()
+            return super(SharedI2CMaster, self).transaction(*msgs)
+
+    def perform(self, transaction):
+        """
+        Perform a precompiled I2C I/O transaction while holding the bus lock.
+
+        Arguments:
+        transaction -- a Transaction.
+
+        Returns: the transaction's results, a memoryview for each read
+                 operation performed.
+
+        Raises:
+        IOError -- the bus device could not be opened or the transfer failed.
+        """
+        with self._lock:
+            self.open()
+            return super(SharedI2CMaster, self).perform(transaction)
+
+
+_shared_masters = {}
+_shared_masters_lock = threading.Lock()
+
+
+def shared_master(n=default_bus):
+    """Returns the process-wide SharedI2CMaster for bus n, creating it if needed."""
+    with _shared_masters_lock:
+        master = _shared_masters.get(n)
+        if master is None:
+            master = _shared_masters[n] = SharedI2CMaster(n)
+        return master
+
+
+def install_shared_master(master, n=default_bus):
+    """Makes master the process-wide shared master for bus n.
+
+    Drivers look their master up on every transaction, so this swaps
+    the bus under every driver at once, for example to run them
+    against a simulated bus.  The master should behave like a
+    SharedI2CMaster.
+
+    Returns: the previous shared master for bus n, or None.
+    """
+    with _shared_masters_lock:
+        previous = _shared_masters.get(n)
+        _shared_masters[n] = master
+        return previous
+
+
+def close_shared_masters():
+    """Closes the bus devices of all shared masters."""
+    with _shared_masters_lock:
+        for master in _shared_masters.values():
+            master.close()
+
+
+class Transaction(object):
+    """An I2C I/O transaction compiled once and performed many times.
+
+    The ctypes message array and ioctl argument are built when the
+    transaction is created, and each read is exposed as a memoryview
+    of its message's buffer, so performing the transaction allocates
+    nothing.  This suits the fixed reads a driver makes over and over.
+
+    The results are views, not copies: they hold the data of the last
+    time the transaction was performed and are overwritten by the next.
+    Copy anything that must be kept for longer.
+
+    Every message's buffer is also exposed, so a write whose bytes
+    change, such as a register value, can be updated in place and the
+    transaction performed again without building new messages.
+
+    For example:
+
+        from quick2wire.i2c import Transaction, shared_master, reading
+
+        read = Transaction(reading(0x48, 2))
+        msb, lsb = shared_master(1).perform(read)[0]
+
+        write = Transaction(writing_bytes(0x2C, 0))
+        write.buffers[0][0] = 50
+        shared_master(1).perform(write)
+    """
+
+    def __init__(self, *msgs):
+        """Compiles a transaction.
+
+        Arguments:
+        *msgs -- I2C messages created by one of the reading, reading_into,
+                 writing or writing_bytes functions.
+        """
+        self.msgs = msgs
+        self.ioctl_arg = i2c_rdwr_ioctl_data(msgs=(i2c_msg * len(msgs))(*msgs), nmsgs=len(msgs))
+        self.buffers = [i2c_msg_to_view(m) for m in msgs]
+        self.results = [view for view, m in zip(self.buffers, msgs) if (m.flags & I2C_M_RD)]
+
+    def __len__(self):
+        return len(self.msgs)
+
+
+# Most messages the kernel will take in one I2C_RDWR ioctl
+I2C_RDWR_IOCTL_MAX_MSGS = 42
+
+
+class Batch(object):
+    """Performs the transactions of several drivers in as few ioctls as possible.
+
+    Each driver adds a group of messages and a callback.  When the
+    batch is run the groups are sent together, in the order they were
+    added, in one I2C_RDWR ioctl (or more if there are too many
+    messages for one), and each callback is given the data read by its
+    own group.  Groups should be independent of each other, for example
+    to different devices.
+
+    If the combined transfer fails, for example because one device
+    doesn't acknowledge, the groups are retried one at a time so only
+    the callbacks of the groups that failed are given None.
+
+    A batch is built once and run as often as needed.  It is compiled
+    into Transactions on its first run, so later runs allocate nothing:
+    reading messages are read into the same buffers each time and each
+    callback is given memoryviews of them, valid until the next run.
+
+    For example:
+
+        from quick2wire.i2c import Batch, reading, writing_bytes
+
+        batch = Batch()
+        batch.add([writing_bytes(0x20, 0), reading(0x20, 2)], port.inputs)
+        batch.add([writing_bytes(0x68, 0x90)], adc.started)
+        batch.run()
+    """
+
+    def __init__(self, n=default_bus):
+        """Creates an empty batch for bus n.
+
+        Arguments:
+        n -- the number of the bus, whose shared master is looked up
+             each time the batch is run.
+        """
+        self.n = n
+        self._groups = []
+        self._msgs = []
+        self._chunks = None
+        self.ioctls = 0
+
+    def add(self, msgs, callback=None):
+        """Adds a group of messages to the batch.
+
+        Arguments:
+        msgs     -- I2C messages created by one of the reading,
+                    reading_into, writing or writing_bytes functions.
+        callback -- called after each run with a list of memoryviews,
+                    one for each read in the group, or None if the
+                    group's transfer failed.
+        """
+        group = Transaction(*msgs)
+        self._groups.append((group, callback))
+        self._msgs.extend(group.msgs)
+        self._chunks = None
+
+    def __len__(self):
+        return len(self._groups)
+
+    def run(self, master=None):
+        """Performs every group then calls their callbacks.
+
+        Arguments:
+        master -- the SharedI2CMaster to use, by default the shared
+                  master of the batch's bus.  It is held for the whole
+                  run so no other thread's messages come in between.
+
+        Returns: True if every group succeeded.
+        """
+        master = master or shared_master(self.n)
+
+        if self._chunks is None:
+            self._chunks = [Transaction(*self._msgs[x:x + I2C_RDWR_IOCTL_MAX_MSGS])
+                            for x in range(0, len(self._msgs), I2C_RDWR_IOCTL_MAX_MSGS)]
+
+        try:
+            with master:
+                for chunk in self._chunks:
+                    self.ioctls += 1
+                    master.perform(chunk)
+        except IOError:
+            return self._run_each(master)
+
+        for group, callback in self._groups:
+            if callback is not None:
+                callback(group.results)
+        return True
+
+    def _run_each(self, master):
+        ok = True
+        for group, callback in self._groups:
+            try:
+                self.ioctls += 1
+                results = master.perform(group)
+            except IOError:
+                results = None
+                ok = False
+
+            if callback is not None:
+                callback(results)
+        return ok
+
+
+# Request priorities, the lower first
+PRIORITY_ACTUATOR = 0
+PRIORITY_SENSOR = 1
+
+
+class Request(object):
+    """A piece of work queued for a Worker.
+
+    Requests are made by Worker.submit and waited on with wait.
+    """
+
+    def __init__(self, work, priority, deadline):
+        self.work = work
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.started = None
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """Waits for the request to be performed.
+
+        Returns: what the work returned, the results of a Transaction,
+                 or whether every group of a Batch succeeded.
+
+        Raises:
+        IOError -- the transfer failed, or the request wasn't started
+                   by its deadline or done within timeout seconds
+                   (errno ETIMEDOUT).
+        Exception -- anything else the work raised.
+        """
+        if not self._done.wait(timeout):
+            raise IOError(errno.ETIMEDOUT, "I2C request not performed in time")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+
+class Worker(object):
+    """Performs all the I/O of one bus from a thread of its own, most urgent first.
+
+    Drivers hand the worker Transactions, Batches or functions of the
+    master and wait for them to be done.  Requests are performed in
+    order of priority, so an actuator write doesn't wait behind a queue
+    of sensor reads, then of deadline, then in the order they came.
+    A request not started by its deadline is dropped and its caller
+    given an IOError, as the result would be too late to use.  A
+    transfer already on the bus is never interrupted.
+
+    The time each request waited in the queue is kept for each
+    priority, see the stats method.
+
+    Workers are not usually created directly but started for a bus
+    with the start_worker function, after which the perform function
+    sends everything for that bus through it.
+    """
+
+    # Seconds a request may wait before it is dropped, by priority
+    TIMEOUTS = {PRIORITY_ACTUATOR: 0.1, PRIORITY_SENSOR: 1.0}
+
+    # Seconds perform waits beyond a request's deadline for it to be done
+    MARGIN = 1.0
+
+    def __init__(self, n=default_bus, timeouts=None):
+        """Starts the worker thread for bus n.
+
+        Arguments:
+        n        -- the number of the bus, whose shared master is
+                    looked up for each request.
+        timeouts -- seconds a request of each priority may wait,
+                    by default Worker.TIMEOUTS.
+        """
+        self.n = n
+        self.timeouts = dict(self.TIMEOUTS if timeouts is None else timeouts)
+        self._queue = []
+        self._count = 0
+        self._lock = threading.Condition()
+        self._running = True
+        self._stats = {}
+        self._thread = threading.Thread(target=self._run, name='i2c-%i' % n, daemon=True)
+        self._thread.start()
+
+    def submit(self, work, priority=PRIORITY_SENSOR, timeout=None):
+        """Queues work for the bus.
+
+        Arguments:
+        work     -- a Transaction or Batch, or a function called with
+                    the master.
+        priority -- PRIORITY_ACTUATOR or PRIORITY_SENSOR.
+        timeout  -- seconds the request may wait to be started, by
+                    default the worker's timeout for its priority.
+
+        Returns: the Request.
+        """
+        if timeout is None:
+            timeout = self.timeouts.get(priority)
+        deadline = float('inf') if timeout is None else time.monotonic() + timeout
+        request = Request(work, priority, deadline)
+
+        with self._lock:
+            if not self._running or not self._thread.is_alive():
+                raise IOError(errno.ESHUTDOWN, "I2C worker for bus %i is closed" % self.n)
+            self._count += 1
+            heapq.heappush(self._queue, (priority, deadline, self._count, request))
+            self._lock.notify()
+        return request
+
+    def perform(self, work, priority=PRIORITY_SENSOR, timeout=None):
+        """Queues work for the bus and waits for it to be done.
+
+        Work from the worker's own thread, such as a callback, is
+        performed there and then.  Otherwise the wait is given up
+        MARGIN seconds after the request's deadline (or after the
+        longest timeout if it has none), so a stuck worker can't hold
+        the caller for ever.
+
+        Returns: as Request.wait.
+
+        Raises:
+        IOError -- as Request.wait, or the worker is closed.
+        """
+        if threading.current_thread() is self._thread:
+            return _perform(shared_master(self.n), work)
+
+        request = self.submit(work, priority, timeout)
+        if request.deadline == float('inf'):
+            wait = max(self.timeouts.values() or [0.0])
+        else:
+            wait = request.deadline - request.submitted
+        return request.wait(max(wait, 0.0) + self.MARGIN)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._running and not self._queue:
+                    self._lock.wait()
+                if not self._queue:
+                    return
+                request = heapq.heappop(self._queue)[3]
+
+            now = time.monotonic()
+            if now > request.deadline:
+                self._record(request.priority, now - request.submitted, expired=True)
+                request._finish(error=IOError(errno.ETIMEDOUT, "I2C request expired in the queue"))
+                continue
+
+            request.started = now
+            self._record(request.priority, now - request.submitted)
+            # Whatever goes wrong goes back to the caller, the worker
+            # carries on serving the other requests
+            try:
+                request._finish(_perform(shared_master(self.n), request.work))
+            except Exception as e:
+                request._finish(error=e)
+
+    def _record(self, priority, latency, expired=False):
+        with self._lock:
+            stats = self._stats.get(priority)
+            if stats is None:
+                stats = self._stats[priority] = {'requests': 0, 'expired': 0, 'latency_total': 0.0,
+                                                 'latency_max': 0.0, 'depth_max': 0}
+            stats['requests'] += 1
+            stats['expired'] += expired
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['depth_max'] = max(stats['depth_max'], len(self._queue) + 1)
+
+    def stats(self):
+        """Returns the queue metrics, a dict for each priority seen.
+
+        Each gives the number of requests taken from the queue, how
+        many of those had expired, the mean and longest time in seconds
+        they waited and the deepest the queue was when one was taken.
+        """
+        with self._lock:
+            return {priority: {'requests': s['requests'],
+                               'expired': s['expired'],
+                               'latency_mean': s['latency_total'] / s['requests'],
+                               'latency_max': s['latency_max'],
+                               'depth_max': s['depth_max']}
+                    for priority, s in self._stats.items()}
+
+    def close(self):
+        """Stops the worker once the requests already queued are done."""
+        with self._lock:
+            self._running = False
+            self._lock.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+def _perform(master, work):
+    if isinstance(work, Transaction):
+        return master.perform(work)
+    if isinstance(work, Batch):
+        return work.run(master)
+    return work(master)
+
+
+_workers = {}
+
+
+def start_worker(n=default_bus, timeouts=None):
+    """Starts a Worker for bus n, if it hasn't got one, and returns it."""
+    with _shared_masters_lock:
+        worker = _workers.get(n)
+        if worker is None:
+            worker = _workers[n] = Worker(n, timeouts)
+        return worker
+
+
+def stop_worker(n=default_bus):
+    """Stops the Worker of bus n, if it has one.
+
+    Returns: the stopped Worker, or None.
+    """
+    with _shared_masters_lock:
+        worker = _workers.pop(n, None)
+    if worker is not None:
+        worker.close()
+    return worker
+
+
+def worker(n=default_bus):
+    """Returns the Worker of bus n, or None if it hasn't got one."""
+    return _workers.get(n)
+
+
+def perform(work, n=default_bus, priority=PRIORITY_SENSOR, timeout=None):
+    """Performs work on bus n, through its Worker if one has been started.
+
+    Without a worker the work is performed there and then on the
+    shared master, and priority and timeout are ignored.  Don't call
+    this while holding the shared master, as the worker couldn't take
+    it.
+
+    Arguments:
+    work     -- a Transaction or Batch, or a function called with the
+                master.
+    priority -- PRIORITY_ACTUATOR or PRIORITY_SENSOR.
+    timeout  -- seconds the request may wait to be started.
+
+    Returns: as Request.wait.
+    """
+    w = _workers.get(n)
+    if w is None:
+        return _perform(shared_master(n), work)
+    return w.perform(work, priority, timeout)
+
 
 def reading(addr, n_bytes):
     """An I2C I/O message that reads n_bytes bytes of data"""
@@ -113,3 +676,11 @@ def _new_i2c_msg(addr, flags, buf):
 
 def i2c_msg_to_bytes(m):
     return string_at(m.buf, m.len)
+
+
+def i2c_msg_to_view(m):
+    """A memoryview of an I2C I/O message's buffer, without copying it.
+
+    The view does not keep the message alive.
+    """
+    return memoryview(cast(m.buf, POINTER(c_ubyte * m.len)).contents).cast('B')
@@ -0,0 +1,33 @@
+from quick2wire.i2c import shared_master, install_shared_master, SharedI2CMaster, writing_bytes
+import pytest
+
+
+def test_shared_master_is_one_instance_per_bus():
+    assert shared_master(98) is shared_master(98)
+    assert shared_master(98) is not shared_master(99)
+    assert isinstance(shared_master(98), SharedI2CMaster)
+
+
+def test_shared_master_does_not_open_bus_until_first_transaction():
+    assert shared_master(97).fd is None
+
+
+def test_shared_master_stays_usable_after_with_statement():
+    master = shared_master(96)
+
+    with master:
+        with master:
+            pass
+
+    with pytest.raises(IOError):
+        master.transaction(writing_bytes(0x20, 0))
+
+    assert master.fd is None
+
+
+def test_installed_master_replaces_shared_master():
+    original = shared_master(95)
+    replacement = SharedI2CMaster(95)
+
+    assert install_shared_master(replacement, 95) is original
+    assert shared_master(95) is replacement
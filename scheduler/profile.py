@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+# Flight profile compiler and binary profile loader
+
+# Copyright (C) 2015  Simon Howroyd
+#
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+#
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+#
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Binary profile format, all little-endian:
+#
+#   Header (32 bytes)
+#     magic    4s   b'H1PF'
+#     version  u16  1
+#     columns  u16  number of setpoint columns
+#     count    u32  number of records
+#     dt       f64  time between records, 0 if they aren't evenly spaced
+#     checksum u32  CRC-32 of the data
+#     padding  4 bytes
+#
+#   Data, one block per column so each can be read in place
+#     count x f64 times
+#     count x f64 setpoints, for each column
+#
+# Usage: python3 -m scheduler.profile profiles/*.txt
+#        python3 -m scheduler.profile --verify profiles/*.bin
+
+# Import libraries
+import argparse, mmap, os, struct, sys, zlib
+from array import array
+
+MAGIC = b'H1PF'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIdI4x')
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='Flight profile compiler by Simon Howroyd 2015')
+
+    # Define aguments
+    parser.add_argument('source', type=str, nargs='+', help='Text profiles to compile')
+    parser.add_argument('--verify', action='store_true', help='Check compiled profiles against their checksums instead')
+    parser.add_argument('--out', type=str, default='', help='Output directory (default is beside the source)')
+
+    # Return what was argued
+    return parser.parse_args()
+
+# Function to check if a file is a compiled profile
+def is_binary(filename):
+    with open(filename, 'rb') as fid:
+        return fid.read(len(MAGIC)) == MAGIC
+
+# Function to find the time between records, zero if not evenly spaced
+def _find_dt(times):
+    if len(times) < 2:
+        return 0.0
+
+    dt = (times[-1] - times[0]) / (len(times) - 1)
+    for x in range(1, len(times)):
+        if abs(times[x] - times[x-1] - dt) > 1e-6:
+            return 0.0
+
+    return dt
+
+# Function to get the data of the arrays as little-endian bytes
+def _to_bytes(arrays):
+    data = []
+    for column in arrays:
+        column = array('d', column)
+        if sys.byteorder != 'little':
+            column.byteswap()
+        data.append(column.tobytes())
+    return b''.join(data)
+
+# Function to write a profile to a binary file
+def write(filename, times, columns):
+    data = _to_bytes([times] + list(columns))
+    header = HEADER.pack(MAGIC, VERSION, len(columns), len(times), _find_dt(times), zlib.crc32(data))
+
+    with open(filename, 'wb') as fid:
+        fid.write(header)
+        fid.write(data)
+
+# Function to compile a text profile to a binary file
+def compile_profile(source, destination):
+    # Import here so the loader doesn't depend on the scheduler
+    from scheduler.scheduler import Scheduler
+
+    times, columns = Scheduler._load(source)
+    write(destination, times, columns)
+
+    return len(times)
+
+# Function to read a header
+def _read_header(buf):
+    if len(buf) < HEADER.size:
+        raise ValueError('Profile is too short for a header')
+
+    magic, version, columns, count, dt, checksum = HEADER.unpack_from(buf)
+
+    if magic != MAGIC:
+        raise ValueError('Not a compiled profile')
+    if version != VERSION:
+        raise ValueError('Unsupported profile version ' + str(version))
+
+    return columns, count, dt, checksum
+
+# Function to memory map a binary profile. The arrays returned read
+# straight from the page cache so opening takes the same time whatever
+# the size of the profile. A file too short for its header is refused
+# now rather than failing part way through a flight; the data is only
+# checked against its checksum by verify()
+def load(filename):
+    with open(filename, 'rb') as fid:
+        buf = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+    columns, count, dt, checksum = _read_header(buf)
+
+    size = (columns + 1) * count * 8
+    if len(buf) < HEADER.size + size:
+        raise ValueError('Profile is truncated, ' + str(len(buf) - HEADER.size)
+                         + ' of ' + str(size) + ' bytes of data')
+
+    # Cut the data into a view for the times and one for each column
+    data = memoryview(buf)[HEADER.size:HEADER.size + size]
+
+    views = [data[x * count * 8:(x + 1) * count * 8] for x in range(columns + 1)]
+
+    # Zero-copy on little-endian machines (the Raspberry Pi), otherwise swap
+    if sys.byteorder == 'little':
+        views = [view.cast('d') for view in views]
+    else:
+        views = [array('d', view.tobytes()) for view in views]
+        for view in views:
+            view.byteswap()
+
+    return views[0], views[1:]
+
+# Function to check a binary profile's data against its checksum. This
+# reads the whole file so is done when compiling or asked for, not on load
+def verify(filename):
+    with open(filename, 'rb') as fid:
+        buf = fid.read()
+
+    try:
+        columns, count, dt, checksum = _read_header(buf)
+    except ValueError:
+        return False
+
+    size = (columns + 1) * count * 8
+    if len(buf) < HEADER.size + size:
+        return False
+
+    return zlib.crc32(buf[HEADER.size:HEADER.size + size]) == checksum
+
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+
+    # Check compiled profiles before a flight
+    if args.verify:
+        bad = [source for source in args.source if not verify(source)]
+        for source in args.source:
+            print(source + (' BAD' if source in bad else ' ok'))
+        sys.exit(1 if bad else 0)
+
+    for source in args.source:
+        # Name the binary file after the text file
+        name = os.path.splitext(os.path.basename(source))[0] + '.bin'
+        destination = os.path.join(args.out or os.path.dirname(source), name)
+
+        count = compile_profile(source, destination)
+        if not verify(destination):
+            sys.exit(destination + ' does not match its checksum')
+        print(source + ' -> ' + destination + ' (' + str(count) + ' records)')
@@ -21,66 +21,160 @@
 
 # Import libraries
 import time
+from array import array
+from bisect import bisect_left
+from scheduler import profile
 
 
 # Define class
 class Scheduler():
-    # Code to run when class is created
-    def __init__(self, filename):
+    # Code to run when class is created. The clock gives the time in
+    # seconds, usually the controller's timer.Clock
+    def __init__(self, filename, interpolation='step', clock=time.monotonic):
+        if interpolation not in self.INTERPOLATION:
+            raise ValueError('Interpolation must be one of ' + ', '.join(self.INTERPOLATION))
+            
         self.__filename = filename
-        self.__last_line = ''
-        self.__this_line = ''
-        self.__start_time = time.time()
+        self.__clock = clock
+        self.__interpolate = getattr(self, '_' + interpolation)
+        self.__times = array('d')
+        self.__columns = [array('d')]
+        self.__setpoints = [-1]
+        self.__cursor = 0
+        self.__start_time = clock()
         self.__running = 0
         self.__setpoint = 0
         self.__setpoint_last = -1
 
-    # Method to read a line
-    def _get_line(self, pointer=1):
-        # If we want to re-read the last line...
-        if pointer is -1:
-            # Move the cursor backwards to the start of the last line
-            self.__fid.seek( self.__fid.tell() - len(self.__this_line) )
-            
-        # Save our last line
-        self.__last_line = self.__this_line
+    # Ways to find a setpoint between two records
+    INTERPOLATION = ('step', 'linear', 'cubic')
+
+    # Method to parse a profile file into an array of times and an array
+    # for each column of setpoints
+    @staticmethod
+    def _load(filename):
+        times = array('d')
+        columns = []
         
-        # Update our current line
-        self.__this_line = self.__fid.readline()
+        with open(filename) as fid:
+            for line in fid:
+                # The profile ends at the first line that isn't a record
+                try:
+                    record = list(map(float, line.split()))
+                except ValueError:
+                    break
+                    
+                # The first record sets the number of columns
+                if not columns:
+                    columns = [array('d') for x in range(len(record) - 1)]
+                    
+                if not columns or len(record) - 1 < len(columns):
+                    break
+                    
+                times.append(record[0])
+                for column, setpoint in zip(columns, record[1:]):
+                    column.append(setpoint)
 
-        # Return the line as single row of columns
-        return list( map(float,self.__this_line.split()) )
+        return times, columns or [array('d')]
 
     # Method to find the setpoint relative to system time
     def _find_now(self):
         # Calculate time since start of schedule
-        psuedo_time = time.time() - self.__start_time
+        psuedo_time = self.__clock() - self.__start_time
         
-        # Check if the current setpoint has expired
-        try:
-            if list( map(float,self.__this_line.split()) )[0] > psuedo_time:
-                # If it hasn't expired, return this setpoint
-                return list( map(float,self.__this_line.split()) )[1]
-                
-        # If there is an IndexError it is the first record so ignore
-        except (IndexError):
-            pass
+        times = self.__times
+        i = self.__cursor
         
-        # The current setpoint has expired so get the next one
-        try:
-           x = self._get_line()
-           
-           # Find the next non-expired setpoint
-           while float(x[0]) < psuedo_time:
-               x = self._get_line()
-               pass  # Check next line
-           
-        # An exception of these types means end of test
-        except (IndexError, ValueError):
+        # The setpoint is that of the first record not yet expired. Time
+        # usually moves on by a record or less per call, so check the
+        # records either side of the cursor before searching
+        if i < len(times) and times[i] >= psuedo_time and (i == 0 or times[i-1] < psuedo_time):
+            pass
+        elif i + 1 < len(times) and times[i] < psuedo_time <= times[i+1]:
+            i += 1
+        else:
+            # The time has jumped so search for it
+            i = bisect_left(times, psuedo_time)
+            
+        # Remember where we are for next time
+        self.__cursor = i
+
+        # Past the last record means end of test
+        if i >= len(times):
+            for x in range(len(self.__setpoints)):
+                self.__setpoints[x] = -1
             return -1
             
-        # Return this new unexpired setpoint
-        return x[1]
+        # Find the setpoint of every column at this time
+        for x in range(len(self.__columns)):
+            self.__setpoints[x] = self.__interpolate(times, self.__columns[x], i, psuedo_time)
+            
+        # Return the first column's setpoint
+        return self.__setpoints[0]
+
+    # Method to hold each record's setpoint until its time
+    @staticmethod
+    def _step(times, column, i, t):
+        return column[i]
+
+    # Method to draw a straight line between records
+    @staticmethod
+    def _linear(times, column, i, t):
+        if i == 0:
+            return column[0]
+            
+        fraction = (t - times[i-1]) / (times[i] - times[i-1])
+        return column[i-1] + fraction * (column[i] - column[i-1])
+
+    # Method to draw a smooth curve through the records (cubic Hermite
+    # spline with monotone slopes, Fritsch-Butland, so it never goes beyond
+    # the records either side. Below zero would read as an error)
+    @staticmethod
+    def _cubic(times, column, i, t):
+        if i == 0:
+            return column[0]
+            
+        # Gradient from a record to the next, flat if they're at one time
+        def secant(k):
+            h = times[k+1] - times[k]
+            return (column[k+1] - column[k]) / h if h > 0 else 0.0
+            
+        # Slope at a record, one sided at each end of the profile, flat at
+        # a peak or trough, otherwise a weighted harmonic mean of the two
+        # gradients either side
+        def slope(k):
+            if k == 0:
+                return secant(0)
+            if k == len(times) - 1:
+                return secant(k - 1)
+                
+            d0, d1 = secant(k - 1), secant(k)
+            if d0 * d1 <= 0:
+                return 0.0
+                
+            h0, h1 = times[k] - times[k-1], times[k+1] - times[k]
+            return 3 * (h0 + h1) / ((2*h1 + h0) / d0 + (h1 + 2*h0) / d1)
+            
+        h = times[i] - times[i-1]
+        u = (t - times[i-1]) / h
+        
+        setpoint = ((2*u**3 - 3*u**2 + 1) * column[i-1]
+                    + (u**3 - 2*u**2 + u) * h * slope(i-1)
+                    + (-2*u**3 + 3*u**2) * column[i]
+                    + (u**3 - u**2) * h * slope(i))
+        
+        # Keep rounding from taking it past the records either side
+        return min(max(setpoint, min(column[i-1], column[i])), max(column[i-1], column[i]))
+
+    # Property - What are the setpoints of every column?
+    @property
+    def setpoints(self):
+        return self.__setpoints
+
+    # Property - How many columns of setpoints are there?
+    @property
+    def columns(self):
+        return len(self.__columns)
 
     # Property - Is the schedule currently running?
     @property
@@ -103,11 +197,17 @@ class Scheduler():
         # Tell the user we are trying to start
         print("Firing up the engines...")
         
-        # Open the profile file
-        self.__fid = open(self.__filename)
+        # Map a compiled profile, or read the whole of a text profile now,
+        # so there is no parsing while flying
+        if profile.is_binary(self.__filename):
+            self.__times, self.__columns = profile.load(self.__filename)
+        else:
+            self.__times, self.__columns = self._load(self.__filename)
+        self.__setpoints = [-1] * len(self.__columns)
+        self.__cursor = 0
         
         # Set the schedule start time
-        self.__start_time = time.time()
+        self.__start_time = self.__clock()
         
         # Put the setpoint to zero for safety
         self.__setpoint = 0
@@ -126,9 +226,6 @@ class Scheduler():
         # Set the class flag to stopped
         self.__running = 0
         
-        # Close the profile file
-        self.__fid.close()
-        
         # Tell the user we have stopped running
         print("Back in hangar!\n")
 
@@ -0,0 +1,129 @@
+from scheduler import scheduler
+from scheduler import profile as schedule_profile
+from timer import timer
+import pytest
+
+
+@pytest.fixture
+def profile(tmpdir):
+    path = tmpdir.join("profile.txt")
+    path.write("0.0\t0\n0.2\t10\n0.4\t20\n0.6\t30\n0.8\t40\n")
+    return str(path)
+
+
+def run_at(profile, times, interpolation='step'):
+    clock = timer.Virtual_Clock(1000.0)
+
+    schedule = scheduler.Scheduler(profile, interpolation, clock)
+    schedule.running = 1
+
+    setpoints = []
+    for t in times:
+        clock.set(1000.0 + t)
+        setpoints.append(schedule.run())
+    return schedule, setpoints
+
+
+def test_setpoint_is_that_of_first_record_not_yet_expired(profile):
+    schedule, setpoints = run_at(profile, [0.0, 0.1, 0.15, 0.3, 0.5, 0.7])
+
+    assert setpoints == [0, 10, 10, 20, 30, 40]
+
+
+def test_time_can_jump_backwards_and_forwards(profile):
+    schedule, setpoints = run_at(profile, [0.7, 0.1, 0.5])
+
+    assert setpoints == [40, 10, 30]
+
+
+def test_schedule_stops_after_last_record(profile):
+    schedule, setpoints = run_at(profile, [0.5, 0.9])
+
+    assert setpoints == [30, -1]
+    assert not schedule.running
+
+
+def test_linear_interpolation_between_records(profile):
+    schedule, setpoints = run_at(profile, [0.0, 0.1, 0.5], 'linear')
+
+    assert setpoints == pytest.approx([0, 5, 25])
+
+
+def test_cubic_interpolation_passes_through_straight_lines(profile):
+    schedule, setpoints = run_at(profile, [0.1, 0.35, 0.7], 'cubic')
+
+    assert setpoints == pytest.approx([5, 17.5, 35])
+
+
+def test_cubic_interpolation_does_not_overshoot_a_sparse_ramp(tmpdir):
+    path = tmpdir.join("ramp.txt")
+    path.write("0\t0\n10\t0\n20\t50\n30\t50\n")
+    times = [x * 0.5 for x in range(60)]
+
+    schedule, setpoints = run_at(str(path), times, 'cubic')
+
+    # Never below zero, which would read as an error and end the flight
+    assert schedule.running
+    assert all(0 <= setpoint <= 50 for setpoint in setpoints)
+    assert setpoints[:21] == [0] * 21 and setpoints[40:] == [50] * 20
+    assert setpoints == sorted(setpoints)
+
+
+def test_cubic_interpolation_copes_with_records_at_one_time(tmpdir):
+    path = tmpdir.join("step.txt")
+    path.write("0\t0\n10\t20\n10\t20\n10\t40\n20\t40\n")
+
+    schedule, setpoints = run_at(str(path), [5.0, 15.0], 'cubic')
+
+    assert 0 <= setpoints[0] <= 20 and setpoints[1] == pytest.approx(40)
+
+
+def test_every_column_is_played_from_one_time_base(tmpdir):
+    path = tmpdir.join("multi.txt")
+    path.write("0.0\t0\t1\t30\n1.0\t10\t2\t20\n")
+
+    schedule, setpoints = run_at(str(path), [0.5])
+
+    assert schedule.columns == 3
+    assert schedule.setpoints == [10, 2, 20]
+
+
+
+def test_compiled_profile_plays_the_same_as_text(profile, tmpdir):
+    compiled = str(tmpdir.join("profile.bin"))
+    schedule_profile.compile_profile(profile, compiled)
+
+    assert schedule_profile.is_binary(compiled)
+    assert schedule_profile.verify(compiled)
+
+    times = [0.0, 0.1, 0.7, 0.3, 0.9]
+    assert run_at(compiled, times)[1] == run_at(profile, times)[1]
+
+
+def test_truncated_compiled_profile_is_refused(profile, tmpdir):
+    compiled = str(tmpdir.join("profile.bin"))
+    schedule_profile.compile_profile(profile, compiled)
+    with open(compiled, 'rb') as fid:
+        data = fid.read()
+
+    # Short by a whole record or by part of one
+    for cut in (16, 3):
+        with open(compiled, 'wb') as fid:
+            fid.write(data[:-cut])
+        with pytest.raises(ValueError):
+            schedule_profile.load(compiled)
+
+
+def test_corrupt_compiled_profile_fails_verify(profile, tmpdir):
+    compiled = str(tmpdir.join("profile.bin"))
+    schedule_profile.compile_profile(profile, compiled)
+    with open(compiled, 'r+b') as fid:
+        fid.seek(-1, 2)
+        fid.write(b'\xff')
+
+    assert not schedule_profile.verify(compiled)
+
+    # Truncated is never a match either
+    with open(compiled, 'r+b') as fid:
+        fid.truncate(40)
+    assert not schedule_profile.verify(compiled)
@@ -0,0 +1,166 @@
+##!/usr/bin/env python3
+
+# Simulated I2C databus
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# A bus master that hands each I2C message to a simulated device instead
+# of the kernel, so the drivers, the H100 controller and the control loop
+# run on any Linux box. Install it in place of the shared master and every
+# driver uses it from then on:
+#
+#     from sim import bus
+#     bus.install(bus.h100_bus())
+
+# Import libraries
+import ctypes, errno, time
+import quick2wire.i2c as i2c
+from quick2wire.i2c_ctypes import I2C_M_RD
+from sim import devices
+
+
+# Define class
+class Simulated_Bus(i2c.SharedI2CMaster):
+    # Code to run when class is created. Speed is the bus clock in Hz, zero
+    # makes transfers take no time
+    def __init__(self, n=1, devices=(), clock=time.monotonic, speed=0):
+        super().__init__(n)
+        self.__devices = {}
+        self.__clock = clock
+        self.__speed = speed
+        
+        # Bus usage counters
+        self.__transactions = 0
+        self.__messages = 0
+        self.__bytes = 0
+        self.__errors = 0
+        
+        for device in devices:
+            self.add(device)
+
+    # Method to connect a device to the bus
+    def add(self, device):
+        device.clock = self.__clock
+        self.__devices[device.address] = device
+        return device
+
+    # Method to disconnect a device from the bus
+    def remove(self, address):
+        return self.__devices.pop(address, None)
+
+    # Method to find the device at an address
+    def device(self, address):
+        return self.__devices[address]
+
+    # There is no bus device to open or close
+    def open(self):
+        pass
+        
+    def close(self):
+        pass
+
+    # Method to perform a transaction on the simulated devices
+    def transaction(self, *msgs):
+        with self._lock:
+            self.__transactions += 1
+            results = []
+            
+            for m in msgs:
+                self.__messages += 1
+                self.__bytes += m.len
+                
+                # Nothing acknowledges an empty address, as the kernel reports
+                device = self.__devices.get(m.addr)
+                if device is None:
+                    self.__errors += 1
+                    raise IOError(errno.EREMOTEIO, 'No simulated device at ' + format(m.addr, '02x'))
+                    
+                if m.flags & I2C_M_RD:
+                    data = bytes(device.read(m.len))
+                    ctypes.memmove(m.buf, data, m.len)
+                    results.append(data)
+                else:
+                    device.write(ctypes.string_at(m.buf, m.len))
+            
+            # Take as long as the transfer would, 9 clocks per byte plus the
+            # address, start and stop
+            if self.__speed:
+                time.sleep(sum(9 * (m.len + 1) + 2 for m in msgs) / self.__speed)
+                
+            return results
+
+    # Method to perform a precompiled transaction, the simulated devices
+    # reading into its buffers as the kernel would
+    def perform(self, transaction):
+        self.transaction(*transaction.msgs)
+        return transaction.results
+
+    # Property - What devices are connected, by address?
+    @property
+    def devices(self):
+        return self.__devices
+
+    # Property - How many transactions (ioctls) have there been?
+    @property
+    def transactions(self):
+        return self.__transactions
+
+    # Property - How many messages have there been?
+    @property
+    def messages(self):
+        return self.__messages
+
+    # Property - How many bytes have been moved?
+    @property
+    def bytes(self):
+        return self.__bytes
+
+    # Property - How many messages went to an empty address?
+    @property
+    def errors(self):
+        return self.__errors
+
+    # Method to zero the counters
+    def reset(self):
+        self.__transactions = self.__messages = self.__bytes = self.__errors = 0
+
+
+# Function to build a bus with every device on the H100 rig
+def h100_bus(n=1, clock=time.monotonic, speed=0):
+    return Simulated_Bus(n, [
+        # Controller ADCs
+        devices.MCP3424(0x6A), devices.MCP3424(0x6B),
+        # Hybrid board ADCs
+        devices.MCP3424(0x68), devices.MCP3424(0x6C),
+        # Temperature sensors
+        devices.TMP102(0x48), devices.TMP102(0x49), devices.TMP102(0x4A), devices.TMP102(0x4B),
+        # Hybrid board
+        devices.HybridIo(0x20),
+        devices.Pot(0x2F),
+        # Motor controller
+        devices.Esc(0x2C)], clock, speed)
+
+# Function to make every driver use a simulated bus
+def install(bus):
+    return i2c.install_shared_master(bus, bus.n)
+
+# Function to put the previous bus back
+def remove(bus, previous):
+    if previous is None:
+        previous = i2c.SharedI2CMaster(bus.n)
+    i2c.install_shared_master(previous, bus.n)
@@ -0,0 +1,227 @@
+##!/usr/bin/env python3
+
+# Simulated I2C devices
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Each device answers the messages its driver sends. Inputs are set as
+# numbers, or as functions called with no arguments each time the value
+# is needed (eg a model of the fuel cell).
+
+# Import libraries
+import time
+
+
+# Function to get the value of an input
+def _value(source):
+    return source() if callable(source) else source
+
+
+# Define class
+class Device:
+    # Code to run when class is created
+    def __init__(self, address):
+        self.address = address
+        self.clock = time.monotonic
+        self.reads = 0
+        self.writes = 0
+
+    # Method to receive the bytes of a write message
+    def write(self, data):
+        self.writes += 1
+
+    # Method to send the bytes of a read message
+    def read(self, length):
+        self.reads += 1
+        return bytes(length)
+
+
+# Define class
+class MCP3424(Device):
+    # Conversion time in seconds for each resolution
+    CONVERSION_TIME = {12: 1 / 240.0, 14: 1 / 60.0, 16: 1 / 15.0, 18: 1 / 3.75}
+
+    # Code to run when class is created, inputs are the voltage on each channel
+    def __init__(self, address, inputs=(0.0, 0.0, 0.0, 0.0)):
+        super().__init__(address)
+        self.inputs = list(inputs)
+        self.__config = 0x90
+        self.__started = None
+        self.__conversions = 0
+
+    # Method to write the configuration register, which starts a conversion
+    # if the RDY bit is set or the chip is in continuous mode
+    def write(self, data):
+        super().write(data)
+        self.__config = data[-1]
+        
+        if self.__config & 0x80 or self.__config & 0x10:
+            self.__started = self.clock()
+            self.__conversions += 1
+
+    # Method to read the output register then the configuration register.
+    # RDY reads high until the conversion is done
+    def read(self, length):
+        super().read(length)
+        resolution = self.resolution
+        config = self.__config & 0x7F
+        
+        if self.__started is None or self.clock() - self.__started < self.CONVERSION_TIME[resolution]:
+            config |= 0x80
+            
+        # Convert the input to a signed count, full scale is 2.048V
+        gain = 1 << (self.__config & 0x03)
+        full = 1 << (resolution - 1)
+        count = int(round(_value(self.inputs[self.channel]) * gain * full / 2.048))
+        count = max(-full, min(full - 1, count))
+        
+        # Send the count big endian, 3 bytes at 18bit, then the config
+        width = 3 if resolution == 18 else 2
+        data = (count & ((1 << (8 * width)) - 1)).to_bytes(width, 'big') + bytes([config])
+        
+        # The config byte repeats if more is read
+        return (data + bytes([config]) * length)[:length]
+
+    # Property - Which channel is selected?
+    @property
+    def channel(self):
+        return (self.__config >> 5) & 0x03
+
+    # Property - What resolution is selected?
+    @property
+    def resolution(self):
+        return 12 + 2 * ((self.__config >> 2) & 0x03)
+
+    # Property - How many conversions have been started?
+    @property
+    def conversions(self):
+        return self.__conversions
+
+
+# Define class
+class TMP102(Device):
+    # Code to run when class is created
+    def __init__(self, address, temperature=20.0):
+        super().__init__(address)
+        self.temperature = temperature
+
+    # Method to read the temperature register, 12bit in 0.0625C steps
+    def read(self, length):
+        super().read(length)
+        count = int(round(_value(self.temperature) / 0.0625)) & 0xFFF
+        return (bytes([count >> 4, (count & 0x0F) << 4]) * length)[:length]
+
+
+# Define class
+class HybridIo(Device):
+    # Code to run when class is created. Registers are in pairs, one for each
+    # port: input, output, polarity inversion and direction (input is 1)
+    def __init__(self, address=0x20, inputs=(0b11011100, 0b00000000)):
+        super().__init__(address)
+        self.inputs = list(inputs)
+        self.__registers = [0x00, 0x00, 0xFF, 0xFF, 0x00, 0x00, 0xFF, 0xFF]
+        self.__pointer = 0
+        self.__changes = 0
+
+    # Method to write the register pointer then any registers from there
+    def write(self, data):
+        super().write(data)
+        self.__pointer = data[0] & 0x07
+        
+        for byte in data[1:]:
+            if self.__pointer in (2, 3) and self.__registers[self.__pointer] != byte:
+                self.__changes += 1
+            if self.__pointer not in (0, 1):
+                self.__registers[self.__pointer] = byte
+            self.__next()
+
+    # Method to read registers from the pointer
+    def read(self, length):
+        super().read(length)
+        data = []
+        for x in range(length):
+            data.append(self.__register(self.__pointer))
+            self.__next()
+        return bytes(data)
+
+    # Method to move the pointer to the other register of the pair
+    def __next(self):
+        self.__pointer = self.__pointer ^ 1
+
+    # Method to get a register, the input registers read the pins
+    def __register(self, pointer):
+        if pointer in (0, 1):
+            return self.pin(pointer)
+        return self.__registers[pointer]
+
+    # Method to get the level of a port's pins, inputs from outside and
+    # outputs from the output register
+    def pin(self, port):
+        direction = self.__registers[6 + port]
+        return (_value(self.inputs[port]) & direction) | (self.__registers[2 + port] & ~direction & 0xFF)
+
+    # Property - What are the output registers?
+    @property
+    def outputs(self):
+        return self.__registers[2:4]
+
+    # Property - What are the direction registers?
+    @property
+    def direction(self):
+        return self.__registers[6:8]
+
+    # Property - How many times has an output changed?
+    @property
+    def changes(self):
+        return self.__changes
+
+
+# Define class
+class Pot(Device):
+    # Code to run when class is created
+    def __init__(self, address=0x2F):
+        super().__init__(address)
+        self.wiper = 0x80
+
+    # Method to move the wiper
+    def write(self, data):
+        super().write(data)
+        self.wiper = data[-1]
+
+    # Method to read the wiper
+    def read(self, length):
+        super().read(length)
+        return bytes([self.wiper]) * length
+
+
+# Define class
+class Esc(Device):
+    # Code to run when class is created
+    def __init__(self, address=0x2C):
+        super().__init__(address)
+        self.throttle = 0
+
+    # Method to receive a throttle
+    def write(self, data):
+        super().write(data)
+        self.throttle = data[-1]
+
+    # Method to read the throttle back
+    def read(self, length):
+        super().read(length)
+        return bytes([self.throttle]) * length
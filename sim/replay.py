@@ -0,0 +1,206 @@
+##!/usr/bin/env python3
+
+# Replay a recorded controller log through the H100 controller
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# Feeds each record of a flight's log to H100.run() in place of the
+# sensors, on a virtual clock set to the time it was recorded. The state
+# changes the pilot made are made again, so the purge controller sees the
+# flight as it happened and a new purge strategy can be compared with the
+# one that flew, as fast as the computer can go.
+#
+# Usage: python3 -m sim.replay logs/150601-120000-controller-test.tsv --purge power
+
+# Import libraries
+import argparse, time
+from datalog import binary
+from sim import bus
+from timer import timer
+
+# State codes as logged by controller.py
+STATES = {1: 'off', 2: 'startup', 3: 'on', 4: 'shutdown', -1: 'error'}
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='Controller log replay by Simon Howroyd 2015')
+
+    # Define aguments
+    parser.add_argument('log', type=str, help='Controller log (tsv or bin)')
+    parser.add_argument('--purge', type=str, default='horizon', help='Purge controller to replay with')
+    parser.add_argument('--out', type=str, default='', help='Save the replayed purge decisions as tsv')
+
+    # Return what was argued
+    return parser.parse_args()
+
+
+# Define class
+class Record:
+    # One timestep of recorded sensor data, as H100 keeps it
+    __slots__ = ['time', 'state', 'voltage', 'current', 'voltageHybrid', 'currentHybrid',
+                 'temperature', 'flow_rate', 'flow_moles', 'purge_frequency']
+
+    # Code to run when class is created, get finds a field by name
+    def __init__(self, get):
+        self.time            = get('epoch')
+        self.state           = int(get('state'))
+        self.voltage         = [get('V_fc'), get('V_b'), get('V_out')]
+        self.current         = [get('I_fc'), get('I_b'), get('I_out')]
+        self.voltageHybrid   = [get('V_fc_h'), get('V_b_h'), get('V_out_h')]
+        self.currentHybrid   = [get('I_fc_h'), get('I_b_h'), get('I_out_h')]
+        self.temperature     = [get('T_h0'), get('T_h1'), get('T_0'), get('T_1'), get('T_2'), get('T_3')]
+        self.flow_rate       = get('MFC_flow')
+        self.flow_moles      = get('MFC_mol')
+        self.purge_frequency = get('Pg_freq')
+
+
+# Function to read the records of a tab separated log. Lines that don't
+# have the right number of numbers are skipped, as benchDecoder does
+def read_tsv(filename):
+    names = {}
+    for load in (False, True):
+        fields = binary.controller_fields(load)
+        names[len(fields)] = {fields[x][0]: x for x in range(len(fields))}
+        
+    with open(filename) as fid:
+        for line in fid:
+            # The loadbank mode "1 4" is two numbers in one cell
+            try:
+                cells = [float(cell) for cell in line.split()]
+            except ValueError:
+                continue
+                
+            index = names.get(len(cells))
+            if index:
+                yield Record(lambda name: cells[index[name]])
+
+# Function to read the records of a binary log
+def read_binary(filename):
+    # Import here so only binary logs need NumPy
+    from datalog import reader
+    
+    for row in reader.read(filename):
+        yield Record(lambda name: float(row[name]))
+
+# Function to read the records of either kind of log
+def read_log(filename):
+    with open(filename, 'rb') as fid:
+        if fid.read(len(binary.MAGIC)) == binary.MAGIC:
+            return read_binary(filename)
+    return read_tsv(filename)
+
+
+# Define class
+class Replay:
+    # Code to run when class is created
+    def __init__(self, purge='horizon'):
+        # Nothing real is driven, the outputs go to a simulated bus
+        self.__bus = bus.h100_bus()
+        self.__previous = bus.install(self.__bus)
+        
+        # Time only moves as the records say
+        self.__clock = timer.Virtual_Clock(time.time())
+        
+        from h100Controller import H100
+        self.__h100 = H100(purge, self.__clock)
+        self.__state = 1
+        self.__purges = 0
+
+    # Method to put the bus back
+    def close(self):
+        bus.remove(self.__bus, self.__previous)
+
+    # Method to replay one record, returns the replayed state and purge frequency
+    def step(self, record):
+        self.__clock.set(record.time)
+        
+        # Make the same state changes as were made in flight
+        if record.state != self.__state:
+            if record.state == 2:
+                self.__h100.state = 'on'
+            elif record.state == 4:
+                self.__h100.state = 'off'
+            elif record.state == 1 and self.__state == -1:
+                self.__h100.state = 'reset'
+            self.__state = record.state
+            
+        # Run the controller on the recorded sensor data
+        purging = self.__purging()
+        self.__h100.run(record)
+        if self.__purging() and not purging:
+            self.__purges += 1
+        
+        return self.__h100.state, self.__h100.purge_frequency
+
+    # Method to replay every record, returns a row for each of
+    # (time, logged state, replayed state, logged frequency, replayed frequency)
+    def run(self, records):
+        results = []
+        for record in records:
+            state, frequency = self.step(record)
+            results.append((record.time, STATES.get(record.state, '?'), state,
+                            record.purge_frequency, frequency))
+        return results
+
+    # Method to check if the purge valve is open
+    def __purging(self):
+        return bool(self.__bus.device(0x20).outputs[1] & 0b100)
+
+    # Property - How many purges have been replayed?
+    @property
+    def purges(self):
+        return self.__purges
+
+    # Property - What's the controller?
+    @property
+    def h100(self):
+        return self.__h100
+
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+    
+    replay = Replay(args.purge)
+    try:
+        start = time.perf_counter()
+        results = replay.run(read_log(args.log))
+        wall = time.perf_counter() - start
+    finally:
+        replay.close()
+        
+    if not results:
+        print("No records in " + args.log)
+        raise SystemExit(1)
+        
+    if args.out:
+        with open(args.out, 'w') as fid:
+            for row in results:
+                fid.write("{0:.3f}\t{1}\t{2}\t{3:.2f}\t{4:.2f}\n".format(*row))
+    
+    flown = results[-1][0] - results[0][0]
+    changed = sum(1 for row in results if abs(row[3] - row[4]) > 1e-6)
+    
+    print("Records\t\t\t{0:d}".format(len(results)))
+    print("Flight\t\t\t{0:.1f} s replayed in {1:.2f} s ({2:.0f}x)".format(flown, wall, flown / wall if wall else 0))
+    print("Purges replayed\t\t{0:d}".format(replay.purges))
+    print("Mean frequency\t\tlogged {0:.2f} s, replayed {1:.2f} s".format(
+        sum(row[3] for row in results) / len(results), sum(row[4] for row in results) / len(results)))
+    print("Records changed\t\t{0:d}".format(changed))
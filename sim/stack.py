@@ -0,0 +1,375 @@
+##!/usr/bin/env python3
+
+# Horizon H-100 fuel cell stack model
+
+# Copyright (C) 2015  Simon Howroyd
+# 
+#     This program is free software: you can redistribute it and/or modify
+#     it under the terms of the GNU General Public License as published by
+#     the Free Software Foundation, either version 3 of the License, or
+#     (at your option) any later version.
+# 
+#     This program is distributed in the hope that it will be useful,
+#     but WITHOUT ANY WARRANTY; without even the implied warranty of
+#     MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#     GNU General Public License for more details.
+# 
+#     You should have received a copy of the GNU General Public License
+#     along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+#############################################################################
+
+# A lumped model of the stack, good enough to compare purge strategies and
+# flight profiles rather than to design a stack. Every state is a NumPy
+# array with one element per stack, so many stacks (eg one per purge
+# strategy or parameter set) are stepped at once:
+#
+#   Voltage      open circuit less activation, ohmic and concentration
+#                losses per cell, with the ohmic loss falling as the
+#                membrane warms up and rising as it dries out
+#   Flooding     water and nitrogen build up in the dead-ended anode while
+#                current flows, costing voltage until a purge blows it out
+#   Hydration    product water wets the membrane, the dry hydrogen feed
+#                slowly dries it and each purge dries it faster, so
+#                purging too often costs as much as flooding
+#   Temperature  one thermal mass heated by the losses and cooled by
+#                natural convection plus the fan
+#   Hydrogen     consumed at the Faraday rate plus what each purge vents
+#
+# Over a step flooding, hydration and temperature each move as x' = ax + b,
+# so simulate() runs a whole profile without a Python loop over time. The
+# affine steps are composed by a prefix scan, log2(steps) array operations,
+# and hydrogen is a cumulative sum. Temperature is coupled to the voltage
+# through the membrane resistance, so it is found by a few passes, each
+# taking the voltage from the temperatures of the pass before. The passes
+# only settle quickly over a short time, so long profiles are run in
+# chunks of simulated time, still far fewer than there are steps.
+#
+# Stack_Plant connects a stack to the simulated I2C databus so the H100
+# controller reads it through its own ADCs and temperature sensors, and
+# drives its fan and purge valve through the hybrid board.
+
+# Usage: python3 -m sim.stack --hours 100 --current 8.3 --period 10 30 60
+
+# Import libraries
+import argparse
+import numpy
+from sim import devices
+
+FARADAY = 96485.0         # C/mol
+MOLAR_VOLUME = 22.414     # Standard litres per mole
+THERMONEUTRAL = 1.25      # V per cell, heat + power for liquid water product
+ADC_VOLTS = 2.495         # ADC driver volts for each volt on the chip pin
+
+
+# Inspect user input arguments
+def _parse_commandline():
+    # Define the parser
+    parser = argparse.ArgumentParser(description='H-100 stack model purge comparison by Simon Howroyd 2015')
+
+    # Define aguments
+    parser.add_argument('--hours', type=float, default=1.0, help='Time to simulate')
+    parser.add_argument('--current', type=float, default=8.3, help='Stack current in amps')
+    parser.add_argument('--dt', type=float, default=0.1, help='Time step in seconds')
+    parser.add_argument('--period', type=float, nargs='+', default=[10, 30, 60], help='Purge periods to compare in seconds')
+    parser.add_argument('--duration', type=float, default=0.5, help='Purge valve open time in seconds')
+
+    # Return what was argued
+    return parser.parse_args()
+
+
+# Define class
+class H100_Stack:
+    # Default parameters, any of them can be given as an array to give each
+    # stack its own value
+    PARAMETERS = {
+        'cells': 20,                  # Number of cells
+        'area': 22.5,                 # Active area, cm2
+        'ocv': 0.95,                  # Open circuit voltage, V/cell
+        'tafel': 0.04,                # Activation loss slope, V
+        'exchange': 0.002,            # Exchange current density, A/cm2
+        'resistance': 0.35,           # Area specific resistance at 30C, ohm.cm2
+        'activation_energy': 1268.0,  # Membrane conductivity temperature factor, K
+        'mass_transport': 3e-5,       # Concentration loss coefficient, V
+        'mass_exponent': 8.0,         # Concentration loss exponent, cm2/A
+        'flood_rate': 0.03,           # Flooding per A/cm2 per second
+        'flood_loss': 0.08,           # Voltage lost when fully flooded, V/cell
+        'hydration_rate': 0.05,       # Membrane wetting per A/cm2 per second
+        'drying_rate': 0.002,         # Membrane drying by the feed, 1/s
+        'purge_drying': 0.2,          # Extra drying while purging, 1/s
+        'dry_resistance': 1.5,        # Extra resistance when fully dry, fraction
+        'purge_time_constant': 0.1,   # Time for a purge to clear flooding, s
+        'purge_flow': 1e-3,           # Hydrogen vented while purging, mol/s
+        'heat_capacity': 900.0,       # Thermal mass, J/K
+        'convection': 0.5,            # Natural cooling, W/K
+        'fan_cooling': 8.0,           # Extra cooling with the fan on, W/K
+        'ambient': 20.0,              # Ambient temperature, C
+    }
+
+    # Passes simulate() makes to settle the temperature, over chunks of
+    # this many seconds
+    PASSES = 6
+    CHUNK = 600.0
+
+    # Code to run when class is created, n stacks with parameters as keywords
+    def __init__(self, n=1, **parameters):
+        unknown = set(parameters) - set(self.PARAMETERS)
+        if unknown:
+            raise ValueError('Unknown stack parameters ' + ', '.join(sorted(unknown)))
+            
+        self.__n = n
+        for name, default in self.PARAMETERS.items():
+            setattr(self, name, numpy.broadcast_to(numpy.asarray(parameters.get(name, default), float), (n,)))
+        
+        # States
+        self.temperature = numpy.array(self.ambient, float)
+        self.flooding = numpy.zeros(n)
+        self.hydration = numpy.ones(n)
+        self.moles = numpy.zeros(n)
+        self.current = numpy.zeros(n)
+        self.voltage = self.polarisation(self.current, self.temperature, self.flooding, self.hydration)
+
+    # Method to find the stack voltage for a current (vectorised)
+    def polarisation(self, current, temperature, flooding, hydration=1.0):
+        j = numpy.maximum(current, 0.0) / self.area
+        
+        activation = self.tafel * numpy.log1p(j / self.exchange)
+        resistance = self.resistance * numpy.exp(self.activation_energy * (1 / (temperature + 273.15) - 1 / 303.15))
+        resistance = resistance * (1.0 + self.dry_resistance * (1.0 - hydration))
+        concentration = self.mass_transport * numpy.expm1(self.mass_exponent * j)
+        
+        cell = self.ocv - activation - resistance * j - concentration - flooding * self.flood_loss
+        
+        return self.cells * numpy.maximum(cell, 0.0)
+
+    # Method to find how flooding and hydration move over a step of dt, each
+    # as x' = ax + b. Inputs are one per stack or steps x stacks
+    def _wetting(self, dt, current, purge):
+        j = current / self.area
+        purging = purge > 0
+        
+        # Flooding builds with current and decays exponentially while purging
+        build = numpy.minimum(self.flood_rate * j * dt, 1.0)
+        flooding = (numpy.where(purging, numpy.exp(-dt / self.purge_time_constant), 1.0 - build),
+                    numpy.where(purging, 0.0, build))
+        
+        # Hydration settles exponentially to where wetting balances drying
+        wetting = self.hydration_rate * j
+        rate = wetting + self.drying_rate + self.purge_drying * purge
+        a = numpy.exp(-rate * dt)
+        settled = numpy.divide(wetting, rate, out=numpy.zeros(a.shape), where=rate > 0)
+        hydration = (a, settled * (1.0 - a))
+        
+        return flooding, hydration
+
+    # Method to find how temperature moves over a step of dt with the fan,
+    # as T' = aT + b + heat * c for the heat in watts
+    def _cooling(self, dt, fan):
+        conductance = self.convection + self.fan_cooling * fan
+        c = dt / self.heat_capacity
+        return 1.0 - conductance * c, conductance * self.ambient * c, c
+
+    # Method to find the heat of the energy not turned into electricity
+    def _heat(self, voltage, current):
+        return (THERMONEUTRAL * self.cells - voltage) * current
+
+    # Method to move every stack on by dt seconds. Current is in amps, fan
+    # and purge are on (1) or off (0), each for all stacks or one per stack
+    def step(self, dt, current, fan=0, purge=0):
+        current = numpy.broadcast_to(numpy.maximum(numpy.asarray(current, float), 0.0), (self.__n,))
+        fan = numpy.broadcast_to(numpy.asarray(fan, float), (self.__n,))
+        purge = numpy.broadcast_to(numpy.asarray(purge, float), (self.__n,))
+        
+        # Water in the anode and the membrane
+        (a, b), (c, d) = self._wetting(dt, current, purge)
+        self.flooding = a * self.flooding + b
+        self.hydration = c * self.hydration + d
+        
+        # Electrical
+        self.current = numpy.array(current)
+        self.voltage = self.polarisation(current, self.temperature, self.flooding, self.hydration)
+        
+        # Thermal, heat is the energy not turned into electricity
+        a, b, c = self._cooling(dt, fan)
+        self.temperature = a * self.temperature + b + self._heat(self.voltage, current) * c
+        
+        # Hydrogen used
+        self.moles = self.moles + (self.cells * current / (2 * FARADAY) + self.purge_flow * purge) * dt
+        
+        return self.voltage
+
+    # Method to run every stack through arrays of inputs, one row per step.
+    # Returns the voltage, temperature, flooding, hydration and cumulative
+    # hydrogen after each step, each an array of steps x stacks
+    def simulate(self, dt, current, fan=0, purge=0):
+        steps = len(current)
+        current = numpy.maximum(self.__rows(current, steps), 0.0)
+        fan = self.__rows(fan, steps)
+        purge = self.__rows(purge, steps)
+        
+        names = ('voltage', 'temperature', 'flooding', 'hydration', 'moles')
+        results = {name: numpy.empty((steps, self.__n)) for name in names}
+        chunk = max(int(self.CHUNK / dt), 1)
+        for start in range(0, steps, chunk):
+            rows = slice(start, start + chunk)
+            for name, values in self.__simulate(dt, current[rows], fan[rows], purge[rows]).items():
+                results[name][rows] = values
+                
+        return results
+
+    # Method to run a chunk of steps, carrying on from the last
+    def __simulate(self, dt, current, fan, purge):
+        steps = len(current)
+        
+        # Water doesn't depend on temperature so is found in one go
+        (a, b), (c, d) = self._wetting(dt, current, purge)
+        flooding = _affine(a, b, self.flooding)
+        hydration = _affine(c, d, self.hydration)
+        
+        # Temperature from the voltage at the temperatures of the last pass,
+        # starting from them all as they are now
+        a, b, c = self._cooling(dt, fan)
+        temperature = numpy.broadcast_to(self.temperature, (steps, self.__n))
+        for x in range(self.PASSES):
+            before = numpy.concatenate((self.temperature[numpy.newaxis], temperature[:-1]))
+            voltage = self.polarisation(current, before, flooding, hydration)
+            temperature = _affine(a, b + self._heat(voltage, current) * c, self.temperature)
+            
+        # Hydrogen used
+        moles = self.moles + numpy.cumsum((self.cells * current / (2 * FARADAY) + self.purge_flow * purge) * dt, axis=0)
+        
+        # Carry on from the last step
+        self.flooding = flooding[-1].copy()
+        self.hydration = hydration[-1].copy()
+        self.temperature = temperature[-1].copy()
+        self.voltage = voltage[-1].copy()
+        self.current = current[-1].copy()
+        self.moles = moles[-1].copy()
+            
+        return {'voltage': voltage, 'temperature': temperature, 'flooding': flooding,
+                'hydration': hydration, 'moles': moles}
+
+    # Method to spread an input over steps x stacks, a 1D input is one value per step
+    def __rows(self, values, steps):
+        values = numpy.asarray(values, float)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        return numpy.broadcast_to(values, (steps, self.__n))
+
+    # Property - What's the hydrogen flow of each stack in standard litres per minute?
+    @property
+    def flow(self):
+        return (self.cells * self.current / (2 * FARADAY)) * 60 * MOLAR_VOLUME
+
+    # Property - How many stacks are there?
+    @property
+    def n(self):
+        return self.__n
+
+
+# Function to run x' = ax + b from x0 for every step (along the first axis)
+# at once, giving x after each. Prefix i of the scan is the composition of
+# the first i + 1 steps, found by composing with the prefix 1, 2, 4... back
+def _affine(a, b, x0):
+    a = numpy.array(a, float)
+    b = numpy.array(b, float)
+    shift = 1
+    while shift < len(a):
+        b[shift:] += a[shift:] * b[:-shift]
+        a[shift:] *= a[:-shift]
+        shift *= 2
+    return a * x0 + b
+
+
+# Function to make a purge valve signal, open for duration every period
+def purge_schedule(steps, dt, period, duration):
+    t = numpy.arange(steps) * dt
+    return (numpy.mod(t, period) < duration).astype(float)
+
+
+# Define class
+class Stack_Plant:
+    # Connects one stack of a model to the simulated devices on a bus. The
+    # load is the stack current in amps, or a function giving it
+    def __init__(self, bus, stack=None, load=0.0, index=0):
+        self.__bus = bus
+        self.__clock = bus.device(0x6A).clock
+        self.__stack = stack or H100_Stack()
+        self.__index = index
+        self.__time = self.__clock()
+        self.load = load
+        
+        # Controller ADCs, as the calibrations in H100 read them back
+        adc1 = bus.device(0x6A)
+        adc1.inputs[0] = lambda: self.voltage * 60.7 / 1000 / ADC_VOLTS
+        adc1.inputs[1] = lambda: self.current * 6.89 / 1000 / 1.075 / ADC_VOLTS
+        bus.device(0x6B).inputs[0] = lambda: self.flow * 5.0 / 1.5 / ADC_VOLTS
+        
+        # Hybrid board ADCs, as hybrid.Adc reads them back
+        bus.device(0x6C).inputs[2] = lambda: self.voltage / 5.458 / ADC_VOLTS
+        bus.device(0x68).inputs[2] = lambda: self.current / 3.817 / ADC_VOLTS
+        
+        # Stack temperature sensors
+        for address in (0x48, 0x49, 0x4A, 0x4B):
+            bus.device(address).temperature = lambda: self.temperature
+
+    # Method to bring the model up to the bus clock, using the fan and
+    # purge valve outputs of the hybrid board as they are now
+    def update(self):
+        now = self.__clock()
+        dt = now - self.__time
+        if dt > 0:
+            outputs = self.__bus.device(0x20).outputs[1]
+            load = devices._value(self.load)
+            self.__stack.step(dt, load, outputs & 0b001, (outputs >> 2) & 0b1)
+            self.__time = now
+
+    # Property - What's the stack voltage?
+    @property
+    def voltage(self):
+        self.update()
+        return float(self.__stack.voltage[self.__index])
+
+    # Property - What's the stack current?
+    @property
+    def current(self):
+        self.update()
+        return float(self.__stack.current[self.__index])
+
+    # Property - What's the stack temperature?
+    @property
+    def temperature(self):
+        self.update()
+        return float(self.__stack.temperature[self.__index])
+
+    # Property - What's the hydrogen flow in standard litres per minute?
+    @property
+    def flow(self):
+        self.update()
+        return float(self.__stack.flow[self.__index])
+
+    # Property - What's the model?
+    @property
+    def stack(self):
+        return self.__stack
+
+
+# Main run function
+if __name__ == "__main__":
+    args = _parse_commandline()
+    
+    steps = int(args.hours * 3600 / args.dt)
+    stack = H100_Stack(len(args.period))
+    
+    # One stack for each purge period, all stepped together
+    purge = numpy.stack([purge_schedule(steps, args.dt, period, args.duration) for period in args.period], axis=1)
+    results = stack.simulate(args.dt, numpy.full(steps, args.current), 1, purge)
+    
+    # Energy out against the hydrogen's lower heating value
+    energy = results['voltage'].sum(axis=0) * args.current * args.dt
+    efficiency = energy / (stack.moles * 241800.0)
+    
+    print("Purge period\tMean voltage\tHydrogen\tEfficiency")
+    for x in range(len(args.period)):
+        print("{0:.1f} s\t\t{1:.2f} V\t\t{2:.3f} mol\t{3:.1f} %".format(
+            args.period[x], results['voltage'][:, x].mean(), stack.moles[x], 100 * efficiency[x]))
@@ -0,0 +1,60 @@
+import pytest
+from datalog import binary
+from datalog.datalog import Log_Writer, tsv
+from sim.replay import Replay, read_log
+
+
+# Write a log of a short flight, off then startup then on
+def flight(ticks, load=False):
+    rows = []
+    for k in range(ticks):
+        state = 1 if k < 10 else (2 if k < 50 else 3)
+        electric = [12.0, 14.0, 5.0, 6.0] * 3
+        if load:
+            electric += ["1 4", 14.0, 6.0, 84.0]
+        rows.append([1.43e9 + k * 0.1, k * 0.1, 0.1, state] + electric
+                    + [0.0] * 3 + [25.0] * 6 + [0.5, 1e-4, 30.0, 0.5])
+    return rows
+
+def test_tsv_and_binary_logs_read_the_same(tmp_path):
+    rows = flight(20, load=True)
+    with open(str(tmp_path / "log.tsv"), 'w') as fid:
+        fid.write("Junk header\n")
+        fid.writelines(tsv(row) for row in rows)
+    fid, formatter = binary.open_log(str(tmp_path / "log.bin"), binary.controller_fields(True),
+                                     widths=binary.controller_widths(True))
+    log = Log_Writer(fid, formatter=formatter)
+    for row in rows:
+        log.write_record(row)
+    log.close()
+    
+    text = list(read_log(str(tmp_path / "log.tsv")))
+    packed = list(read_log(str(tmp_path / "log.bin")))
+    
+    assert len(text) == len(packed) == 20
+    assert text[15].state == packed[15].state == 2
+    assert text[15].voltage == packed[15].voltage == [14.0, 14.0, 14.0]
+    assert packed[0].time == pytest.approx(1.43e9)
+
+def test_replay_recomputes_purge_decisions_on_recorded_time(tmp_path):
+    filename = str(tmp_path / "log.tsv")
+    with open(filename, 'w') as fid:
+        fid.writelines(tsv(row) for row in flight(1000))
+        
+    replay = Replay('polar')
+    try:
+        results = replay.run(read_log(filename))
+    finally:
+        replay.close()
+    
+    # Startup takes 3 seconds of recorded time, not of real time
+    assert results[10][2] == 'startup'
+    assert results[39][2] == 'startup'
+    assert results[41][2] == 'on'
+    
+    # Polar purges at 10 x (14.0 - (21 - 1.2 x 6.0)) = 2s, limited to 5s
+    assert results[-1][3] == 30.0
+    assert results[-1][4] == 5
+    
+    # 95 seconds on purging every 5 seconds
+    assert replay.purges == pytest.approx(95 / 5.5, abs=1)
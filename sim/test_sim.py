@@ -0,0 +1,415 @@
+import time, pytest
+from adc import adcpi
+from temperature import tmp102
+from esc import esc
+from hybrid import hybrid
+from sim import bus, devices
+from quick2wire import i2c
+from quick2wire.eventfd import Semaphore
+from quick2wire.selector import INPUT, LEVEL
+
+
+# A clock that only moves when told to
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sim():
+    simulated = bus.h100_bus()
+    previous = bus.install(simulated)
+    yield simulated
+    bus.remove(simulated, previous)
+
+
+def test_adc_reads_input_voltage(sim):
+    sim.device(0x68).inputs[2] = 1.0
+    
+    adc = adcpi.MCP3424(0x68)
+    
+    assert adc.get(2) == pytest.approx(2.495)
+    assert adc.timeouts == 0
+
+def test_adc_is_not_ready_until_conversion_time():
+    clock = Clock()
+    chip = devices.MCP3424(0x68)
+    chip.clock = clock
+    
+    chip.write(bytes([0x90]))
+    assert chip.read(3)[-1] & 0x80
+    
+    clock.now = 1 / 240.0
+    assert not chip.read(3)[-1] & 0x80
+
+def test_adc_18bit_negative_count():
+    clock = Clock()
+    chip = devices.MCP3424(0x68, inputs=[-0.5, 0, 0, 0])
+    chip.clock = clock
+    chip.write(bytes([0x9C]))
+    clock.now = 1.0
+    
+    data = chip.read(4)
+    
+    assert int.from_bytes(data[:3], 'big', signed=True) == -0.5 * (1 << 17) / 2.048
+    assert data[3] == 0x9C & 0x7F
+
+def test_temperature_and_esc(sim):
+    sim.device(0x49).temperature = 31.5
+    motor = esc.esc()
+    motor.throttle = 42
+    
+    assert tmp102.Tmp102.get(0x49) == 31.5
+    assert sim.device(0x2C).throttle == 42
+
+def test_hybrid_io_outputs_and_inputs(sim):
+    io = hybrid.HybridIo()
+    io.power1 = 1
+    
+    assert sim.device(0x20).outputs[1] & 0b1
+    # Only ICL, LOBAT and ACP are inputs, the rest read back the outputs
+    assert io.update() == bytes([0b01011100, 0b00000001])
+    assert io.FAULT and io.ACP and not io.SHDN
+
+def test_hybrid_io_reports_an_output_not_written(sim):
+    io = hybrid.HybridIo()
+    io.power3 = 1
+    assert io.applied == 1
+    
+    sim.remove(0x20)
+    io.power3 = 0
+    assert io.applied == -1
+    
+    # Held for this thread's flush isn't a failure
+    sim.add(devices.HybridIo(0x20))
+    io.begin()
+    io.power3 = 1
+    assert io.applied == 1
+    io.flush()
+
+def test_hybrid_io_writes_a_batch_once(sim):
+    io = hybrid.HybridIo()
+    writes = sim.device(0x20).writes
+    
+    io.begin()
+    io.power1 = 1
+    io.power3 = 1
+    io.SHDN = 1
+    assert sim.device(0x20).writes == writes
+    io.flush()
+    
+    assert sim.device(0x20).writes == writes + 1
+    assert sim.device(0x20).outputs == [0b01100100, 0b00000101]
+    
+    # Nothing changed in the end so nothing is written
+    io.begin()
+    io.power1 = 0
+    io.power1 = 1
+    io.SHDN = 1
+    io.flush()
+    io.CELLS = 0
+    
+    assert sim.device(0x20).writes == writes + 1
+    assert io.writes == 2
+
+def test_held_switch_edges_are_timed_when_flushed(sim):
+    from switch import switch
+    io = hybrid.HybridIo()
+    purge = switch.Switch(lambda: setattr(io, 'power3', 1) or io.applied,
+                          lambda: setattr(io, 'power3', 0) or io.applied,
+                          Clock(), written=io.written)
+    
+    # The tick clock doesn't move, only the writes at flush time the pulse
+    io.begin()
+    purge.write(True)
+    time.sleep(0.05)
+    io.flush()
+    io.begin()
+    time.sleep(0.05)
+    purge.write(False)
+    time.sleep(0.05)
+    io.flush()
+    
+    assert 0.1 <= purge.pulse_actual < 0.2
+
+def test_h100_only_writes_outputs_that_change(sim):
+    from h100Controller import H100
+    
+    h100 = H100('horizon')
+    h100.run()
+    writes = sim.device(0x20).writes
+    
+    for x in range(5):
+        h100.run()
+        
+    # Only the register pointer is written, to read the inputs each tick
+    assert sim.device(0x20).writes == writes + 5
+
+# An INT line that fires when told to
+class Interrupt:
+    __trigger__ = LEVEL
+    __events__ = INPUT
+    
+    def __init__(self):
+        self.semaphore = Semaphore(blocking=False)
+
+    def open(self):
+        pass
+
+    def close(self):
+        self.semaphore.close()
+
+    def fileno(self):
+        return self.semaphore.fileno()
+
+    def get(self):
+        return self.semaphore.wait()
+
+
+def test_hybrid_io_only_reads_inputs_after_an_interrupt(sim):
+    interrupt = Interrupt()
+    io = hybrid.HybridIo(interrupt)
+    
+    io.update()
+    sim.device(0x20).inputs[0] = 0b00000000
+    
+    # No edge so the last inputs are kept
+    assert io.update() == bytes([0b01011100, 0b00000000])
+    assert io.ACP
+    
+    interrupt.semaphore.signal()
+    assert io.update() == bytes([0b01000000, 0b00000000])
+    assert not io.ACP
+    assert io.update() == bytes([0b01000000, 0b00000000])
+    
+    assert (io.reads, io.skipped) == (2, 2)
+    io.close()
+
+def test_hybrid_io_polls_without_an_interrupt(sim):
+    io = hybrid.HybridIo()
+    
+    for x in range(3):
+        io.update()
+        
+    assert (io.reads, io.skipped) == (3, 0)
+
+def test_batch_sends_every_group_in_one_ioctl(sim):
+    results = []
+    batch = i2c.Batch(1)
+    batch.add([i2c.writing_bytes(0x48, 0), i2c.reading(0x48, 2)], results.append)
+    batch.add([i2c.writing_bytes(0x68, 0x90)], results.append)
+    batch.add([i2c.reading(0x49, 2)], results.append)
+    sim.device(0x48).temperature = 25.0
+    
+    assert batch.run()
+    
+    assert sim.transactions == 1 and batch.ioctls == 1
+    assert results[0] == [bytes([25, 0])] and results[1] == [] and len(results[2][0]) == 2
+
+def test_batch_isolates_a_missing_device(sim):
+    results = []
+    batch = i2c.Batch(1)
+    batch.add([i2c.writing_bytes(0x68, 0x90)], results.append)
+    batch.add([i2c.writing_bytes(0x6E, 0x90)], results.append)
+    
+    assert not batch.run()
+    
+    assert results == [[], None]
+
+def test_transaction_reads_into_the_same_buffers(sim):
+    read = i2c.Transaction(i2c.writing_bytes(0x48, 0), i2c.reading(0x48, 2))
+    sim.device(0x48).temperature = 25.0
+    
+    results = sim.perform(read)
+    assert results is read.results and results[0] == bytes([25, 0])
+    
+    # Performed again the same views hold the new data
+    sim.device(0x48).temperature = 30.0
+    assert sim.perform(read)[0] is results[0] and results[0] == bytes([30, 0])
+
+@pytest.fixture
+def worker(sim):
+    yield i2c.start_worker(1)
+    i2c.stop_worker(1)
+
+def test_worker_puts_actuators_ahead_of_sensors(sim, worker):
+    import threading
+    busy, order = threading.Event(), []
+    worker.submit(lambda master: busy.wait(1.0))
+    
+    # Queued while the bus is busy, the actuator write goes first
+    read = worker.submit(lambda master: order.append('read'), i2c.PRIORITY_SENSOR)
+    write = worker.submit(lambda master: order.append('write'), i2c.PRIORITY_ACTUATOR)
+    busy.set()
+    read.wait(1.0), write.wait(1.0)
+    
+    assert order == ['write', 'read']
+    assert worker.stats()[i2c.PRIORITY_ACTUATOR]['requests'] == 1
+
+def test_worker_drops_requests_past_their_deadline(sim, worker):
+    import threading
+    busy = threading.Event()
+    worker.submit(lambda master: busy.wait(1.0))
+    late = worker.submit(i2c.Transaction(i2c.reading(0x48, 2)), timeout=0.0)
+    busy.set()
+    
+    with pytest.raises(IOError):
+        late.wait(1.0)
+    assert worker.stats()[i2c.PRIORITY_SENSOR]['expired'] == 1
+
+def test_worker_survives_a_request_that_raises(sim, worker):
+    sim.device(0x48).temperature = 25.0
+    
+    with pytest.raises(ZeroDivisionError):
+        worker.perform(lambda master: 1 / 0)
+    
+    # The worker is still serving
+    assert worker._thread.is_alive()
+    assert tmp102.Tmp102.get(0x48) == 25.0
+
+def test_worker_perform_gives_up_on_a_stuck_worker(sim, worker):
+    import threading, time
+    busy = threading.Event()
+    worker.submit(lambda master: busy.wait(5.0))
+    
+    # Still stuck long after its deadline, the caller gives up
+    start = time.monotonic()
+    with pytest.raises(IOError):
+        worker.perform(i2c.Transaction(i2c.reading(0x48, 2)), i2c.PRIORITY_ACTUATOR, timeout=0.0)
+    busy.set()
+    assert time.monotonic() - start < 2 * worker.MARGIN
+
+def test_drivers_use_the_worker(sim, worker):
+    sim.device(0x48).temperature = 25.0
+    
+    assert tmp102.Tmp102.get(0x48) == 25.0
+    motor = esc.esc()
+    motor.throttle = 50
+    assert motor.throttle == 50
+    assert worker.stats()[i2c.PRIORITY_ACTUATOR]['requests'] == 1
+
+def test_writes_reuse_their_compiled_transactions(sim, monkeypatch):
+    motor, adc, io = esc.esc(), adcpi.MCP3424(0x68), hybrid.HybridIo()
+    sim.device(0x68).inputs[1:3] = [0.5, 0.25]
+    
+    # Nothing is compiled once the drivers are made
+    compiled = []
+    init = i2c.Transaction.__init__
+    monkeypatch.setattr(i2c.Transaction, '__init__', lambda self, *msgs: compiled.append(msgs) or init(self, *msgs))
+    
+    motor.throttle = 10
+    motor.throttle = 60
+    assert adc.get(1) == pytest.approx(0.5 * 2.495, abs=0.01)
+    assert adc.get(2) == pytest.approx(0.25 * 2.495, abs=0.01)
+    io.power1 = 1
+    io.power3 = 1
+    
+    assert compiled == []
+    assert sim.device(0x2C).throttle == 60
+    assert sim.device(0x20).outputs[1] & 0b101 == 0b101
+
+def test_sweep_takes_two_ioctls_a_round(sim):
+    adc1, adc2 = adcpi.MCP3424(0x68), adcpi.MCP3424(0x6C)
+    sweep = adcpi.Sweep(*[(adc, x) for x in range(4) for adc in (adc1, adc2)])
+    inputs = []
+    sweep.attach([i2c.writing_bytes(0x20, 0), i2c.reading(0x20, 2)], inputs.append)
+    sim.device(0x68).inputs[3] = 1.0
+    
+    assert sweep.run()[6] == pytest.approx(2.495)
+    
+    # Four rounds, each started in one ioctl and read in another
+    assert sweep.rounds == 4 and sweep.ioctls == 8
+    assert len(inputs) == 1 and len(inputs[0][0]) == 2
+
+def test_missing_device_is_an_io_error(sim):
+    sim.remove(0x48)
+    
+    assert tmp102.Tmp102.get(0x48) == -1
+    assert sim.errors == 1
+
+def test_h100_runs_on_the_simulated_bus(sim):
+    from h100Controller import H100
+    
+    sim.device(0x6A).inputs[0] = 0.5
+    sim.device(0x4A).temperature = 45.0
+    
+    h100 = H100('horizon')
+    h100.run()
+    
+    assert h100.voltage[0] == pytest.approx(0.5 * 2.495 * 1000 / 60.7, rel=1e-3)
+    assert h100.temperature[4] == 45.0
+    assert sim.errors == 0
+
+def test_h100_fills_one_snapshot_in_place(sim):
+    from h100Controller import H100
+    
+    h100 = H100('horizon')
+    snapshot = h100.snapshot
+    temperature = snapshot.temperature
+    sim.device(0x4B).temperature = 27.0
+    
+    h100.run()
+    h100.run()
+    
+    assert h100.snapshot is snapshot
+    assert snapshot.temperature is temperature and h100.temperature is temperature
+    assert snapshot.temperature[5] == 27.0
+    assert snapshot.tick == 2
+    assert snapshot.state == h100.state == 'off'
+    assert snapshot.purge_frequency == h100.purge_frequency
+
+def test_h100_state_machine(sim):
+    from h100Controller import H100
+    from timer.timer import Virtual_Clock
+    
+    clock = Virtual_Clock()
+    h100 = H100('horizon', clock)
+    
+    def tick(t):
+        clock.set(t)
+        h100.run()
+        return h100.state
+        
+    h100.state = 'on'
+    assert tick(0.0) == 'startup'
+    assert tick(2.9) == 'startup'
+    assert tick(3.0) == 'on'
+    
+    # Off always shuts down, even when already off
+    h100.state = 'off'
+    assert tick(4.0) == 'shutdown'
+    assert tick(7.0) == 'off'
+    h100.state = 'off'
+    assert tick(8.0) == 'shutdown'
+    
+    # Too hot is an error until reset
+    sim.device(0x48).temperature = 50.0
+    assert tick(9.0) == 'error'
+    h100.state = 'on'
+    assert tick(10.0) == 'error'
+    sim.device(0x48).temperature = 20.0
+    h100.state = 'reset'
+    assert tick(11.0) == 'off'
+    
+    assert [(t, old, new) for t, old, new, event in h100.transitions][:3] == \
+        [(0.0, 'off', 'startup'), (3.0, 'startup', 'on'), (4.0, 'on', 'shutdown')]
+    assert h100.transitions[-1][1:] == ('error', 'off', 'reset')
+
+def test_sweep_keeps_the_raw_counts(sim):
+    sim.device(0x68).inputs[:2] = [1.0, 0.5]
+    adc = adcpi.MCP3424(0x68)
+    sweep = adcpi.Sweep((adc, 1), (adc, 0))
+    
+    volts = sweep.run()
+    
+    assert sweep.counts == [500, 1000]
+    assert volts == pytest.approx([c * l for c, l in zip(sweep.counts, sweep.lsb)])
+
+def test_failed_reading_has_no_count(sim):
+    adc = adcpi.MCP3424(0x6E)
+    
+    assert adc.get(0) == -1
+    assert adc.count == adcpi.NO_COUNT
@@ -0,0 +1,95 @@
+import numpy, pytest
+from sim import bus
+from sim.stack import H100_Stack, Stack_Plant, purge_schedule, FARADAY
+
+
+def test_polarisation_falls_from_open_circuit():
+    stack = H100_Stack()
+    current = numpy.linspace(0, 12, 25)
+    
+    voltage = stack.polarisation(current, 30.0, 0.0)
+    
+    assert voltage[0] == pytest.approx(19.0)
+    assert numpy.all(numpy.diff(voltage) < 0)
+
+def test_flooding_costs_voltage_until_purged():
+    stack = H100_Stack()
+    
+    for x in range(300):
+        stack.step(0.1, 8.3)
+    flooded = stack.voltage[0]
+    
+    for x in range(5):
+        stack.step(0.1, 8.3, purge=1)
+        
+    assert stack.flooding[0] < 0.01
+    assert stack.voltage[0] > flooded
+
+def test_fan_keeps_the_stack_cooler():
+    stack = H100_Stack(2)
+    
+    results = stack.simulate(1.0, numpy.full(600, 8.3), [[0, 1]] * 600)
+    
+    assert results['temperature'][-1, 1] < results['temperature'][-1, 0]
+    assert numpy.all(results['temperature'][-1] > 20.0)
+
+def test_hydrogen_is_consumed_at_the_faraday_rate_plus_purges():
+    stack = H100_Stack()
+    purge = purge_schedule(100, 0.1, 5.0, 0.5)
+    
+    stack.simulate(0.1, numpy.full(100, 5.0), 1, purge)
+    
+    expected = 20 * 5.0 / (2 * FARADAY) * 10.0 + 1e-3 * purge.sum() * 0.1
+    assert stack.moles[0] == pytest.approx(expected)
+
+def test_purges_dry_the_membrane_which_recovers_between_them():
+    stack = H100_Stack(2)
+    purge = numpy.stack([purge_schedule(6000, 0.1, period, 0.5) for period in (10.0, 60.0)], axis=1)
+    
+    hydration = stack.simulate(0.1, numpy.full(6000, 8.3), 1, purge)['hydration']
+    
+    assert hydration[-1, 0] < hydration[-1, 1] < 1.0
+    # Wetter just before a purge than just after it
+    assert hydration[5999, 1] > hydration[5404, 1]
+
+def test_simulate_matches_stepping_a_profile():
+    steps = 3000
+    current = 8.3 + 2.0 * numpy.sin(numpy.arange(steps) / 100.0)
+    fan = numpy.arange(steps) // 500 % 2
+    purge = purge_schedule(steps, 1.0, 30.0, 1.0)
+    stepped = H100_Stack()
+    
+    results = H100_Stack().simulate(1.0, current, fan, purge)
+    for x in range(steps):
+        stepped.step(1.0, current[x], fan[x], purge[x])
+        
+    assert results['voltage'][-1, 0] == pytest.approx(stepped.voltage[0], abs=1e-4)
+    assert results['temperature'][-1, 0] == pytest.approx(stepped.temperature[0], abs=1e-4)
+    assert results['hydration'][-1, 0] == pytest.approx(stepped.hydration[0])
+    assert results['flooding'][-1, 0] == pytest.approx(stepped.flooding[0])
+    assert results['moles'][-1, 0] == pytest.approx(stepped.moles[0])
+
+def test_each_stack_can_have_its_own_parameters():
+    stack = H100_Stack(3, resistance=[0.2, 0.35, 0.5])
+    
+    voltage = stack.step(1.0, 8.3)
+    
+    assert voltage[0] > voltage[1] > voltage[2]
+
+def test_h100_reads_the_stack_through_the_simulated_bus():
+    from h100Controller import H100
+    
+    simulated = bus.h100_bus()
+    previous = bus.install(simulated)
+    try:
+        plant = Stack_Plant(simulated, load=4.0)
+        h100 = H100('horizon')
+        h100.run()
+        h100.run()
+    finally:
+        bus.remove(simulated, previous)
+        
+    assert h100.voltage[0] == pytest.approx(plant.voltage, abs=0.1)
+    # The current sense is only about 0.4A per count at 12bit
+    assert h100.current[0] == pytest.approx(4.0, abs=0.4)
+    assert h100.temperature[2] == pytest.approx(plant.temperature, abs=0.1)
@@ -19,52 +19,265 @@
 
 #############################################################################
 
+# A switch can be timed two ways. Polled, timed() is called every loop and
+# toggles the switch when it finds its time is up, so the pulse is only as
+# accurate as the loop is fast. Given an Edge_Scheduler, timed() only sets
+# the pulse and a background thread asleep on a timerfd toggles the switch
+# at each deadline, whatever the loop is doing. Either way the last pulse
+# width is measured so the commanded and actual width can be compared.
+#
+# The on and off functions return -1 if the output couldn't be changed.
+# The pulse is measured from when each write was done, and an edge that
+# failed is counted and tried again rather than taken as done.
+#
+# An output may hold changes and write them later, as the hybrid board
+# does between begin() and flush() each tick. Then the switch is also
+# given a written function, called with a callback that it calls with the
+# time.monotonic() the change actually landed, and the pulse is measured
+# from those times rather than when on or off was called.
+
 # Import libraries
-from time import time
-import pifacedigitalio
+import threading
+from time import monotonic
+from quick2wire.timerfd import Timer as Timerfd, CLOCK_MONOTONIC
 
 
 # Define class
 class Switch:
-    # Code to run when class is created
-    def __init__(self, on, off):
+    # Seconds to wait before trying a failed scheduled edge again
+    RETRY = 0.01
+
+    # Code to run when class is created. The clock gives the time in seconds.
+    # With a scheduler the timed edges are fired by it rather than polled.
+    # Written tells the switch when a held change lands (see above)
+    def __init__(self, on, off, clock=monotonic, scheduler=None, written=None):
         self.__on = on
         self.__off = off
+        self.__clock = clock
+        self.__scheduler = scheduler
+        self.__written = written
+        self.__lock = threading.RLock()
+        self.__pulse = None
+        self.__onTime = None
+        self.__commanded = 0.0
+        self.__actual = 0.0
+        self.__error_max = 0.0
+        self.__failed = 0
         self.state = False
         self.lastTime = 0
         self.lastOff = 0
         self.state = False
-        self.lastTime = time()
+        self.lastTime = clock()
 
-    # Method for a timed flipflop
+    # Method for a timed flipflop, on for duration every freq seconds off
     def timed(self, freq, duration):
+        # Let the scheduler fire the edges, only telling it of a new pulse
+        if self.__scheduler:
+            if self.__pulse != (freq, duration):
+                with self.__lock:
+                    self.__pulse = (freq, duration)
+                    self.__commanded = duration
+                    self.__schedule(self.lastTime)
+            return self.state
+            
+        self.__commanded = duration
+        now = self.__clock()
+        
         # Deactivate if time is up
-        if (time() - self.lastTime) >= duration and self.state == True:
+        if (now - self.lastTime) >= duration and self.state == True:
             # Set switch to off
-            return self.write(False)
+            return self.__write(False, self.__clock)
         
         # Activate if wait is up
-        elif (time() - self.lastTime) >= freq and self.state == False:
+        elif (now - self.lastTime) >= freq and self.state == False:
             # Set switch to on
-            return self.write(True)
+            return self.__write(True, self.__clock)
+
+    # Method to schedule the next edge of the pulse from the last one
+    def __schedule(self, last):
+        freq, duration = self.__pulse
+        if self.state:
+            self.__scheduler.schedule(self, last + duration, False)
+        else:
+            self.__scheduler.schedule(self, last + freq, True)
+
+    # Method run by the scheduler at the deadline of an edge
+    def _edge(self, state, deadline, now):
+        with self.__lock:
+            # Ignore an edge that was cancelled while it was being fired
+            if self.__pulse is None:
+                return
+                
+            # If the output didn't change try the same edge again soon
+            if self.__write(state, monotonic) == -1:
+                self.__scheduler.schedule(self, monotonic() + self.RETRY, state)
+                return
+            
+            # The next edge is timed from this deadline so there is no drift
+            self.lastTime = deadline
+            self.__schedule(deadline)
 
     # Method to turn a switch on or off
     def write(self, state):
+        with self.__lock:
+            # No longer timed
+            if self.__pulse is not None:
+                self.__pulse = None
+                self.__scheduler.cancel(self)
+                
+            return self.__write(state, self.__clock)
+
+    # Method to change the switch and measure the pulse, timing the change
+    # by the clock once it has been written. Returns -1 if it failed
+    def __write(self, state, clock):
         # If we want to turn on...
         if state:
-            self.__on()
+            result = self.__on()
             
         # Otherwise assume turn off
         else:
-            self.__off()
+            result = self.__off()
+            
+        # The output didn't change so neither has the switch
+        if result is not None and result == -1:
+            self.__failed += 1
+            return -1
+            
+        now = clock()
+            
+        # Measure the pulse when it ends, once the change has landed
+        if state != self.state:
+            if self.__written is None:
+                self.__measure(state, now)
+            else:
+                self.__written(lambda landed: self.__measure(state, landed))
             
         # Save the time and state of this change to memory
-        self.lastTime = time()
+        self.lastTime = now
         self.state = state
         
         # Return the new state
         return self.state
 
+    # Method to time an edge of the pulse, measuring it when it ends
+    def __measure(self, state, now):
+        with self.__lock:
+            if state:
+                self.__onTime = now
+            elif self.__onTime is not None:
+                self.__actual = now - self.__onTime
+                self.__error_max = max(self.__error_max, abs(self.__actual - self.__commanded))
+
+    # Property - How long should the pulse be?
+    @property
+    def pulse_commanded(self):
+        return self.__commanded
+
+    # Property - How long was the last pulse?
+    @property
+    def pulse_actual(self):
+        return self.__actual
+
+    # Property - What's the worst pulse width error so far?
+    @property
+    def pulse_error_max(self):
+        return self.__error_max
+
+    # Property - How many edges couldn't be written?
+    @property
+    def edges_failed(self):
+        return self.__failed
+
     # Method to turn all switches off when code is cancelled
     def __del__(self):
         self.write(False)
+
+
+# Define class
+class Edge_Scheduler:
+    # Fires the timed edges of any number of switches from one thread,
+    # asleep on a CLOCK_MONOTONIC timerfd set for the next deadline.
+    # Code to run when class is created
+    def __init__(self):
+        self.__timer = Timerfd(clock=CLOCK_MONOTONIC)
+        self.__timer.fileno()  # Made now so both threads share the one timer
+        self.__lock = threading.Lock()
+        self.__pending = {}
+        self.__running = True
+        self.__fired = 0
+        self.__late = 0.0
+        self.__late_max = 0.0
+        self.__thread = threading.Thread(target=self.__run, name='edges', daemon=True)
+        self.__thread.start()
+
+    # Method to set the next edge of a switch, on or off at a monotonic time
+    def schedule(self, switch, deadline, state):
+        with self.__lock:
+            self.__pending[switch] = (deadline, state)
+            self.__arm()
+
+    # Method to forget the next edge of a switch
+    def cancel(self, switch):
+        with self.__lock:
+            if self.__pending.pop(switch, None) is not None:
+                self.__arm()
+
+    # Method to set the timer for the soonest deadline, the lock is held
+    def __arm(self):
+        if self.__pending:
+            deadline = min(edge[0] for edge in self.__pending.values())
+            self.__timer.offset = max(deadline - monotonic(), 1e-6)
+            self.__timer.start()
+        else:
+            self.__timer.stop()
+
+    # Method run by the thread, firing each edge as it falls due
+    def __run(self):
+        while self.__running:
+            self.__timer.wait()
+            
+            # Take every edge that is due
+            with self.__lock:
+                now = monotonic()
+                due = [(switch, edge) for switch, edge in self.__pending.items() if edge[0] <= now]
+                for switch, edge in due:
+                    del self.__pending[switch]
+                    
+            # Fire them, each switch schedules its next edge
+            for switch, (deadline, state) in due:
+                now = monotonic()
+                late = now - deadline
+                self.__fired += 1
+                self.__late += late
+                self.__late_max = max(self.__late_max, late)
+                switch._edge(state, deadline, now)
+                
+            with self.__lock:
+                self.__arm()
+
+    # Method to stop the thread and release the timer
+    def close(self):
+        with self.__lock:
+            self.__running = False
+            self.__pending.clear()
+            self.__timer.offset = 1e-6
+            self.__timer.start()
+        self.__thread.join()
+        self.__timer.close()
+
+    # Property - How many edges have been fired?
+    @property
+    def fired(self):
+        return self.__fired
+
+    # Property - What's the latest an edge has been fired, in seconds?
+    @property
+    def late_max(self):
+        return self.__late_max
+
+    # Property - What's the mean lateness of the edges fired, in seconds?
+    @property
+    def late_mean(self):
+        if self.__fired:
+            return self.__late / self.__fired
+        return 0.0
@@ -0,0 +1,98 @@
+import time, pytest
+from switch import switch
+from timer.timer import Virtual_Clock
+
+
+class Output:
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.edges = []
+
+        self.fail = 0
+
+    def on(self):
+        return self.write(True)
+
+    def off(self):
+        return self.write(False)
+
+    # Fail the next few writes as a bus error would
+    def write(self, state):
+        if self.fail:
+            self.fail -= 1
+            return -1
+        self.edges.append((self.clock(), state))
+
+
+def test_polled_pulse_depends_on_the_loop():
+    clock = Virtual_Clock()
+    output = Output(clock)
+    purge = switch.Switch(output.on, output.off, clock)
+    
+    # A 0.5 s pulse every 2 s, polled every 0.3 s
+    for x in range(12):
+        clock.set(x * 0.3)
+        purge.timed(2.0, 0.5)
+        
+    assert [state for t, state in output.edges] == [True, False]
+    assert purge.pulse_commanded == 0.5
+    assert purge.pulse_actual == pytest.approx(0.6)
+
+def test_scheduled_pulse_is_on_time_however_slow_the_loop():
+    scheduler = switch.Edge_Scheduler()
+    output = Output()
+    purge = switch.Switch(output.on, output.off, scheduler=scheduler)
+    
+    try:
+        # A 50 ms pulse every 100 ms, from a loop running at 5 Hz
+        for x in range(3):
+            purge.timed(0.1, 0.05)
+            time.sleep(0.2)
+        purge.write(False)
+    finally:
+        scheduler.close()
+        
+    times = [t for t, state in output.edges if state]
+    widths = [off - on for (on, a), (off, b) in zip(output.edges, output.edges[1:]) if a and not b]
+    
+    assert len(times) >= 3
+    assert purge.pulse_actual == pytest.approx(0.05, abs=0.01)
+    assert max(widths) == pytest.approx(0.05, abs=0.01)
+    assert scheduler.fired >= 6
+
+def test_failed_edge_is_counted_and_retried():
+    clock = Virtual_Clock()
+    output = Output(clock)
+    purge = switch.Switch(output.on, output.off, clock)
+    
+    clock.set(2.0)
+    purge.timed(2.0, 0.5)
+    
+    # The off edge fails, so the switch stays on until it is written
+    clock.set(2.5)
+    output.fail = 1
+    assert purge.timed(2.0, 0.5) == -1
+    assert purge.state and purge.edges_failed == 1
+    
+    clock.set(2.7)
+    purge.timed(2.0, 0.5)
+    assert [state for t, state in output.edges] == [True, False]
+    assert purge.pulse_actual == pytest.approx(0.7)
+
+def test_failed_scheduled_edge_is_retried():
+    scheduler = switch.Edge_Scheduler()
+    output = Output()
+    purge = switch.Switch(output.on, output.off, scheduler=scheduler)
+    start = time.monotonic()
+    
+    try:
+        # The first on edge fails twice before it is written
+        output.fail = 2
+        purge.timed(0.1, 0.05)
+        time.sleep(0.3)
+        purge.write(False)
+    finally:
+        scheduler.close()
+        
+    assert purge.edges_failed == 2
+    assert output.edges[0][0] - start >= 0.1 + 2 * switch.Switch.RETRY
@@ -20,26 +20,30 @@
 #############################################################################
 
 # Import libraries
-from quick2wire.i2c import I2CMaster, reading
+from quick2wire.i2c import perform, reading, Transaction
 
 
 # Define class
 class Tmp102:
+    # The read of each sensor, compiled on first use, by address
+    _reads = {}
+
     # Method to get the current reading
     @staticmethod
     def get(address):
+        read = Tmp102._reads.get(address)
+        if read is None:
+            read = Tmp102._reads[address] = Transaction(reading(address, 2))
+
         try:
-            # Using the I2C databus...
-            with I2CMaster(1) as master:
-                
-                # Read two bytes of data
-                msb, lsb = master.transaction(reading(address, 2))[0]
+            # Using the I2C databus, read two bytes of data
+            msb, lsb = perform(read, 1)[0]
                 
-                # Assemble the two bytes into a 16bit integer
-                temperature = ((( msb * 256 ) + lsb) >> 4 ) * 0.0625
+            # Assemble the two bytes into a 16bit integer
+            temperature = ((( msb * 256 ) + lsb) >> 4 ) * 0.0625
                 
-                # Return the value
-                return temperature
+            # Return the value
+            return temperature
 
         # If I2C error return -1
         except IOError:
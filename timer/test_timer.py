@@ -0,0 +1,69 @@
+import time
+from timer import timer
+from switch import switch
+
+
+def test_clock_only_moves_on_each_tick():
+    clock = timer.Clock()
+    first = clock()
+    
+    assert clock() == first == clock.now
+    assert clock.tick() >= first
+    assert clock.ns == int(clock.ns)
+
+def test_every_component_shares_the_time_of_the_tick():
+    clock = timer.Virtual_Clock(100.0)
+    my_time = timer.My_Time(clock)
+    
+    clock.advance(0.25)
+    my_time.run()
+    
+    assert my_time.delta == 0.25
+    assert my_time.last == 100.25
+
+def test_timed_switch_runs_on_the_clock_it_is_given():
+    clock = timer.Virtual_Clock()
+    calls = []
+    purge = switch.Switch(lambda: calls.append('on'), lambda: calls.append('off'), clock)
+    
+    clock.set(29.9)
+    purge.timed(30, 0.5)
+    clock.set(30.0)
+    purge.timed(30, 0.5)
+    clock.set(30.4)
+    purge.timed(30, 0.5)
+    clock.set(30.5)
+    purge.timed(30, 0.5)
+    
+    assert calls == ['on', 'off']
+
+def test_timer_elapsed():
+    clock = timer.Virtual_Clock(5.0)
+    stopwatch = timer.Timer(clock)
+    
+    clock.advance(2.0)
+    assert stopwatch.elapsed == 2.0
+    
+    stopwatch.reset()
+    assert stopwatch.elapsed == 0.0
+
+def test_fixed_rate_counts_missed_ticks_and_overruns():
+    rate = timer.Fixed_Rate(200)
+    
+    try:
+        for x in range(3):
+            rate.wait()
+        missed, overruns = rate.missed, rate.overruns
+        
+        # Work for over three periods, the ticks that passed are missed
+        time.sleep(0.017)
+        expirations = rate.wait()
+    finally:
+        rate.close()
+        
+    assert expirations >= 3
+    assert rate.missed >= missed + 2
+    assert rate.overruns == overruns + 1
+    assert rate.ticks == 4
+    assert rate.busy_max >= 0.017
+    assert rate.jitter_max >= 0.0
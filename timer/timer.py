@@ -21,13 +21,15 @@
 
 # Import libraries
 import time
+from quick2wire.timerfd import Timer as Timerfd, CLOCK_MONOTONIC
 
 
 # Define class
 class My_Time():
-    # Code to run when class is created
-    def __init__(self):
-        self.__start = time.time()
+    # Code to run when class is created. The clock gives the time in seconds
+    def __init__(self, clock=time.monotonic):
+        self.__clock = clock
+        self.__start = clock()
         self.__delta = 0
         self.__last = self.__start
         self.__timers = []
@@ -36,15 +38,16 @@ class My_Time():
     # Method to run the timer
     def run(self):
     	# Update dt
-        self.__delta = time.time() - self.__last
+        now = self.__clock()
+        self.__delta = now - self.__last
         
         # Update last time
-        self.__last = time.time()
+        self.__last = now
 
     # Method to create a new timer
     def create_timer(self):
     	# Append a new timer to the list of timers
-        self.__timers.append(Timer())
+        self.__timers.append(Timer(self.__clock))
         
         # Return the timer index in the list of timers
         return len(self.__timers) - 1
@@ -86,16 +89,214 @@ class My_Time():
 # Define class
 class Timer(My_Time):
     # Code to run when class is created
-    def __init__(self):
+    def __init__(self, clock=time.monotonic):
     	# Initialise base class
-        super().__init__()
+        super().__init__(clock)
+        self.__clock = clock
+        self.__start = clock()
 
     # Reset the timer
     def reset(self):
-        self.__start = time.time()
+        self.__start = self.__clock()
         
     # Property - What's the elapsed time?
     @property
     def elapsed(self):
-        return time.time() - self.__start
+        return self.__clock() - self.__start
+
+
+# Define class
+class Clock():
+    # The control loop's clock. CLOCK_MONOTONIC is read once at the start
+    # of each tick and every component is given that same time, so they
+    # all agree on when the tick happened, the clock is read once rather
+    # than by every component, and it never jumps when NTP sets the time.
+    # Call it to get the time of this tick in seconds
+    def __init__(self):
+        self.__ns = time.monotonic_ns()
+        self.__now = self.__ns / 1e9
+
+    def __call__(self):
+        return self.__now
+
+    # Method to read the clock for a new tick
+    def tick(self):
+        self.__ns = time.monotonic_ns()
+        self.__now = self.__ns / 1e9
+        return self.__now
+
+    # Property - What's the time of this tick in seconds?
+    @property
+    def now(self):
+        return self.__now
+
+    # Property - What's the time of this tick in nanoseconds?
+    @property
+    def ns(self):
+        return self.__ns
+
+
+# Define class
+class Virtual_Clock():
+    # A clock that only moves when told to, for simulation and replay.
+    # It can be used anywhere a Clock can
+    def __init__(self, start=0.0):
+        self.__now = start
+
+    def __call__(self):
+        return self.__now
+
+    # Method to start a new tick, the time doesn't change
+    def tick(self):
+        return self.__now
+
+    # Method to set the time
+    def set(self, now):
+        self.__now = now
+
+    # Method to move the time on
+    def advance(self, dt):
+        self.__now += dt
+        return self.__now
+
+    # Property - What's the time in seconds?
+    @property
+    def now(self):
+        return self.__now
+
+    # Property - What's the time in nanoseconds?
+    @property
+    def ns(self):
+        return int(round(self.__now * 1e9))
+
+
+# Define class
+class Fixed_Rate():
+    # Runs a loop at a fixed rate on a CLOCK_MONOTONIC timerfd. The
+    # thread sleeps in the kernel between ticks instead of spinning.
+    # Code to run when class is created
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError('Rate must be above zero')
+            
+        self.__period = 1.0 / rate
+        self.__timer = Timerfd(interval=self.__period, clock=CLOCK_MONOTONIC)
+        self.__started = False
+        
+        # Statistics
+        self.__start = 0.0
+        self.__expirations = 0
+        self.__ticks = 0
+        self.__missed = 0
+        self.__overruns = 0
+        self.__jitter = 0.0
+        self.__jitter_max = 0.0
+        self.__jitter_total = 0.0
+        self.__busy = 0.0
+        self.__busy_max = 0.0
+        self.__woken = 0.0
+
+    # Method to start the timer
+    def start(self):
+        self.__start = time.monotonic()
+        self.__woken = self.__start
+        self.__timer.start()
+        self.__started = True
+
+    # Method to stop the timer
+    def stop(self):
+        self.__timer.stop()
+        self.__started = False
+
+    # Method to close the timer
+    def close(self):
+        self.__timer.close()
+
+    # Method to wait for the next tick **blocking**
+    def wait(self):
+        # Start on the first call
+        if not self.__started:
+            self.start()
+            
+        # How long did the work since the last tick take?
+        self.__busy = time.monotonic() - self.__woken
+        self.__busy_max = max(self.__busy, self.__busy_max)
+        if self.__busy > self.__period:
+            self.__overruns += 1
+        
+        # Sleep until the timer expires. If the work overran we get
+        # the number of ticks that expired since we last waited
+        expirations = self.__timer.wait()
+        self.__woken = time.monotonic()
+        
+        # Every expiration after the first is a missed tick
+        self.__expirations += expirations
+        self.__missed += expirations - 1
+        self.__ticks += 1
         
+        # Jitter is how late we woke up after the latest expiration
+        self.__jitter = self.__woken - (self.__start + self.__expirations * self.__period)
+        self.__jitter_max = max(self.__jitter, self.__jitter_max)
+        self.__jitter_total += self.__jitter
+        
+        return expirations
+
+    # Method to describe the statistics
+    def report(self):
+        return ("Rate: {0:.1f}Hz ticks {1:d} missed {2:d} overruns {3:d} "
+                "jitter {4:.0f}/{5:.0f}/{6:.0f}us busy {7:.0f}/{8:.0f}us").format(
+                    self.rate, self.ticks, self.missed, self.overruns,
+                    self.jitter * 1e6, self.jitter_mean * 1e6, self.jitter_max * 1e6,
+                    self.busy * 1e6, self.busy_max * 1e6)
+
+    # Property - What's the rate?
+    @property
+    def rate(self):
+        return 1.0 / self.__period
+
+    # Property - What's the period?
+    @property
+    def period(self):
+        return self.__period
+
+    # Property - How many ticks have run?
+    @property
+    def ticks(self):
+        return self.__ticks
+
+    # Property - How many ticks were missed because the work overran?
+    @property
+    def missed(self):
+        return self.__missed
+
+    # Property - How many times did the work take longer than a period?
+    @property
+    def overruns(self):
+        return self.__overruns
+
+    # Property - How late was the last wake up?
+    @property
+    def jitter(self):
+        return self.__jitter
+
+    # Property - What's the latest wake up so far?
+    @property
+    def jitter_max(self):
+        return self.__jitter_max
+
+    # Property - What's the average wake up latency?
+    @property
+    def jitter_mean(self):
+        if self.__ticks:
+            return self.__jitter_total / self.__ticks
+        return 0.0
+
+    # Property - How long did the last tick's work take?
+    @property
+    def busy(self):
+        return self.__busy
+
+    # Property - What's the longest tick so far?
+    @property
+    def busy_max(self):
+        return self.__busy_max
@@ -22,6 +22,7 @@ import time, argparse
 from adc import adcpi
 from tdiLoadbank import scheduler
 from temperature import tmp102
+from calibration import calibration
 
 
 def _parse_comandline():
@@ -32,18 +33,13 @@ def _parse_comandline():
 
 
 # Get Current (internal)
+# Calibration in calibration/h100.json
 def __getCurrent(Adc, channel):
-    #        current = abs(Adc.val[channel] * 1000 / 6.9) + 0.424 - 0.125
-    current = abs(Adc.get(channel) * 1000 / 6.92) + 0.31  #inc divisor to lower error slope
-    if current < 0.475: current = 0  # Account for opamp validity
-    return current
+    return calibration.default('validation').apply_one('current', Adc.get(channel))
 
 
-# Get Voltage (internal)
 def __getVoltage(Adc, channel):
-    #        voltage = abs(Adc.val[channel] * 1000 / 60.9559671563) + 0.029
-    voltage = abs(Adc.get(channel) * 1000 / 47.5) - 5.74  #inc divisor to lower error slope
-    return voltage
+    return calibration.default('validation').apply_one('voltage', Adc.get(channel))
 
 
 try: